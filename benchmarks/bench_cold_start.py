@@ -0,0 +1,105 @@
+"""
+Import time and first-event latency of the Lambda handler.
+
+Every sample runs in a fresh interpreter, as a Lambda cold start would:
+  - import: importing lambda_handler alone, then the pipeline stack it defers (pandas, boto3, psycopg2).
+  - events: a moto-backed S3 event sent to handler() twice, the first one pays the deferred imports,
+    config, Secrets Manager and the Redshift connection, the second one is a warm invocation.
+    moto and the Postgres stand-in preload boto3 and psycopg2, so only pandas and the project
+    modules are part of the measured first event.
+
+Usage:
+    python benchmarks/bench_cold_start.py --dsn postgresql://postgres@localhost/bench --runs 5 --rows 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BUCKET = 'bench-datalakep'
+
+
+def child_import() -> dict:
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    start = time.perf_counter()
+    import lambda_handler
+    imported = time.perf_counter()
+    import pipeline
+    deferred = time.perf_counter()
+    return {'import_handler': imported - start, 'import_pipeline': deferred - imported}
+
+
+def child_events(dsn: str, csv_path: str) -> dict:
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    import boto3
+    from moto import mock_aws
+    import pg_standin
+
+    pg_standin.install(dsn)
+    with mock_aws():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        with open(csv_path, 'rb') as file:
+            s3.put_object(Bucket=BUCKET, Key='Upload/train.csv', Body=file.read())
+        event = {'Records': [{'eventSource': 'aws:s3',
+                              's3': {'bucket': {'name': BUCKET}, 'object': {'key': 'Upload/train.csv'}}}]}
+
+        start = time.perf_counter()
+        import lambda_handler
+        imported = time.perf_counter()
+        lambda_handler.handler(event)
+        first = time.perf_counter()
+        lambda_handler.handler(event)
+        warm = time.perf_counter()
+    return {'import_handler': imported - start, 'first_event': first - imported, 'warm_event': warm - first}
+
+
+def run_child(*args: str) -> dict:
+    output = subprocess.run([sys.executable, __file__, '--child', *args], cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def summary(label: str, values: list) -> None:
+    values = sorted(values)
+    print(f"{label:>16}: median {statistics.median(values) * 1e3:9.1f} ms, "
+          f"min {values[0] * 1e3:9.1f} ms, max {values[-1] * 1e3:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN', 'postgresql://postgres@localhost/postgres'))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--child', nargs='*')
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = child_import() if args.child[0] == 'import' else child_events(args.dsn, args.child[1])
+        print(json.dumps(result))
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic import titanic_csv
+
+    samples = [run_child('import') for _ in range(args.runs)]
+    for name in ('import_handler', 'import_pipeline'):
+        summary(name, [sample[name] for sample in samples])
+
+    with tempfile.NamedTemporaryFile(suffix='.csv') as csv_file:
+        csv_file.write(titanic_csv(args.rows))
+        csv_file.flush()
+        samples = [run_child('events', csv_file.name, '--dsn', args.dsn) for _ in range(args.runs)]
+    for name in ('import_handler', 'first_event', 'warm_event'):
+        summary(name, [sample[name] for sample in samples])
+
+
+if __name__ == '__main__':
+    main()
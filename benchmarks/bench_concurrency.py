@@ -0,0 +1,97 @@
+"""
+Files per second of the sequential loop and of the concurrent worker pool.
+
+Uploads synthetic CSV files to a moto-backed bucket, publishes their S3 events to a moto SQS queue
+and drains the queue through main's consumer logic, with the Redshift COPY served by a local
+Postgres stand-in. moto answers instantly, so --latency-ms adds an artificial round-trip to every
+S3 call to resemble the real network.
+
+Usage:
+    python benchmarks/bench_concurrency.py --dsn postgresql://postgres@localhost/bench --files 100 --workers 8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import boto3
+from moto import mock_aws
+import pg_standin
+from synthetic import titanic_csv
+
+BUCKET = 'bench-datalakep'
+
+
+def publish(sqs, queue_url: str, files: int, rows: int) -> None:
+    s3 = boto3.client('s3')
+    body = titanic_csv(rows)
+    for index in range(files):
+        key = f'Upload/train_{index}.csv'
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'size': len(body)}}}]}
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(event))
+
+
+def consume(redshift_config, sqs_config, engine=None) -> None:
+    from sqs_event_handler import get_files_data
+    from pipeline import process_file
+
+    while True:
+        if engine is not None:
+            engine.wait_for_capacity()
+        founded, files = get_files_data(sqs_config)
+        if not founded:
+            break
+        for bucket, key in files:
+            if engine is not None:
+                engine.submit(bucket, key)
+            else:
+                process_file(redshift_config, bucket, key)
+    if engine is not None:
+        engine.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN', 'postgresql://postgres@localhost/postgres'))
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    pg_standin.install(args.dsn)
+    redshift_config = {'host': 'standin', 'port': 5432, 'dbname': 'bench', 'user': 'bench', 'password': '',
+                       'iam_role': 'arn:aws:iam::000000000000:role/bench', 'pool_max_size': args.workers}
+
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        sqs = boto3.client('sqs')
+        queue_url = sqs.create_queue(QueueName='bench-queue')['QueueUrl']
+        sqs_config = {'region': 'us-west-2', 'queue_url': queue_url, 'waittime': 0, 'maxmessages': 10}
+
+        import s3_preproc
+        from redshift_loader import ensure_required_tables
+        from file_engine import ConcurrentFileProcessor
+        s3_preproc.s3.meta.events.register('before-send', lambda **kwargs: time.sleep(args.latency_ms / 1000))
+        ensure_required_tables(redshift_config)
+
+        for label, workers in (('sequential', 1), ('concurrent', args.workers)):
+            publish(sqs, queue_url, args.files, args.rows)
+            engine = None
+            if workers > 1:
+                engine = ConcurrentFileProcessor(redshift_config, workers=workers)
+            start = time.perf_counter()
+            consume(redshift_config, sqs_config, engine)
+            elapsed = time.perf_counter() - start
+            if engine is not None:
+                engine.shutdown()
+            print(f"{label:>10} ({workers} workers): {args.files / elapsed:7.1f} files/s")
+
+
+if __name__ == '__main__':
+    main()
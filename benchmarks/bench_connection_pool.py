@@ -0,0 +1,56 @@
+"""
+Connections opened per file, with and without the connection pool.
+
+Replays the Redshift calls main.main makes for every file (retrieve_table_names twice,
+query_col_names and the COPY) against a local Postgres stand-in.
+
+Usage:
+    python benchmarks/bench_connection_pool.py --dsn postgresql://postgres@localhost/bench --files 200
+"""
+import os
+import sys
+import time
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pg_standin
+import connection_pool
+from redshift_loader import retrieve_table_names, ensure_required_tables, query_col_names, copy_data_from_s3_to_redshift
+
+CSV = b"PassengerId,Survived\n892,false\n893,true\n894,false\n"
+
+
+def run(config_params, files: int) -> None:
+    for _ in range(files):
+        retrieve_table_names(config_params)
+        query_col_names(config_params, 'gender_submission')
+        retrieve_table_names(config_params)
+        copy_data_from_s3_to_redshift(config_params, 's3://bench/Tmp/gender_submission-autogen.csv', 'gender_submission',
+                                      columns=['passengerid', 'survived'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN', 'postgresql://postgres@localhost/postgres'))
+    parser.add_argument('--files', type=int, default=200)
+    args = parser.parse_args()
+
+    pg_standin.install(args.dsn, fetcher=lambda path: CSV)
+    config_params = {'host': 'standin', 'port': 5432, 'dbname': 'bench', 'user': 'bench',
+                     'password': '', 'iam_role': 'arn:aws:iam::000000000000:role/bench'}
+    ensure_required_tables(config_params)
+
+    for label, idle_timeout in (('unpooled', -1), ('pooled', 300)):
+        connection_pool._pools.clear()
+        config_params['pool_idle_timeout'] = idle_timeout #A negative timeout closes every connection on release
+        before = pg_standin.connects
+        start = time.perf_counter()
+        run(config_params, args.files)
+        elapsed = time.perf_counter() - start
+        connects = pg_standin.connects - before
+        print(f"{label:>9}: {connects / args.files:.2f} connects/file, {1000 * elapsed / args.files:.2f} ms/file")
+
+
+if __name__ == '__main__':
+    main()
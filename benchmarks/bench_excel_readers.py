@@ -0,0 +1,66 @@
+"""
+Parse time and peak Python memory of the Excel readers on a synthetic workbook.
+
+Compares the old pd.read_excel(engine='openpyxl') call with the streaming read-only openpyxl
+reader and, when python-calamine is installed, the calamine engine.
+
+Usage:
+    python benchmarks/bench_excel_readers.py --rows 200000 --chunksize 50000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pandas as pd
+from openpyxl import Workbook
+from synthetic import titanic_frame
+from file_readers import read_excel_openpyxl_chunks, read_excel_calamine_chunks, calamine_available
+
+
+def write_workbook(path: str, rows: int) -> None:
+    workbook = Workbook(write_only=True) #Keeps generation itself cheap for large sizes
+    worksheet = workbook.create_sheet('train')
+    df = titanic_frame(rows)
+    worksheet.append(list(df.columns))
+    for record in df.astype(object).where(df.notna(), None).itertuples(index=False):
+        worksheet.append(list(record))
+    workbook.save(path)
+
+
+def measure(label: str, path: str, read) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, 'rb') as fileobj:
+        rows = sum(len(chunk) for chunk in read(fileobj))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>18}: {rows} rows in {elapsed:7.2f} s ({rows / elapsed:9.0f} rows/s), peak {peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunksize', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'train.xlsx')
+        write_workbook(path, args.rows)
+        print(f"workbook: {args.rows} rows, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+        measure('read_excel', path, lambda fileobj: [pd.read_excel(fileobj, engine='openpyxl')])
+        measure('openpyxl streaming', path, lambda fileobj: read_excel_openpyxl_chunks(fileobj, args.chunksize))
+        if calamine_available():
+            measure('calamine', path, lambda fileobj: read_excel_calamine_chunks(fileobj, args.chunksize))
+        else:
+            print(f"{'calamine':>18}: skipped, python-calamine is not installed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""
+End to end benchmark of the SQS consumer in main.py.
+
+Synthetic Titanic-shaped CSV or XLSX files are uploaded to a moto S3 bucket, their S3 events are
+sent to a moto SQS queue and main.main() consumes them against the local Postgres stand-in, with
+the same configuration file the service reads (config/config.yaml plus the overrides below).
+
+Every scenario (format x rows per file) runs in a fresh interpreter so its peak RSS is its own. A
+scenario reports:
+  - throughput: rows and MiB of input per second of wall time, from the first event to the last commit.
+  - latency: p50/p90/p99/max of the per-file time, and per stage from the FileTrace of every file.
+  - memory: peak RSS of the process, and per stage the highest RSS sampled while a thread was inside
+    that stage. Stages of different files overlap when Concurrency is enabled, so the per stage
+    peaks are upper bounds of what the stage itself needs. Also the largest DataFrame parsed first
+    for a file (the whole file in memory, or its first chunk when streaming), from the memory report
+    of the traces (compare with --set Preproc.compact_dtypes=false).
+
+Results are written as JSON to benchmarks/results/ (or --output) and --compare reports the
+scenarios whose time or memory grew more than --threshold against a previous result file,
+exiting with status 1 so the harness can gate a CI job.
+
+Usage:
+    python benchmarks/bench_pipeline.py --dsn postgresql://postgres@localhost/bench --rows 10000 100000 1000000 --formats csv xlsx
+    python benchmarks/bench_pipeline.py --rows 100000 --files 8 --set Concurrency.workers=8 --compare benchmarks/results/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+RESULTS = os.path.join(ROOT, 'benchmarks', 'results')
+BUCKET = 'bench-datalakep'
+QUEUE = 'bench-datalakep-queue'
+
+# Applied on top of config/config.yaml: no metrics endpoint, short polls and batch waits so the run
+# ends soon after the last file instead of waiting on production timeouts. Every file of a scenario
+# has the same content, so content fingerprints are off or all files but one would be skipped
+OVERRIDES = {
+    'S3.bucket': BUCKET,
+    'SQS.waittime': 1,
+    'Batching.max_wait_seconds': 2,
+    'Metrics.enabled': False,
+    'Metrics.json_logs': False,
+    'Metrics.memory_report': True, #peak_frame_mib
+    'Preproc.fingerprint': False,
+    'Preproc.processes': 0, #Spawned workers create their S3 client outside mock_aws
+}
+
+# Functions that run every stage, keyed by (module file, function). The innermost match of a
+# sampled thread stack is the stage it is in
+STAGE_FUNCTIONS = {
+    ('s3_preproc.py', 'object_identity'): 'ledger_lookup',
+    ('ingestion_ledger.py', 'is_loaded'): 'ledger_lookup',
+    ('s3_preproc.py', 'load_file'): 'load_file',
+    ('s3_preproc.py', 'chunks'): 'load_file',
+    ('s3_preproc.py', 'check_columns'): 'check_columns',
+    ('s3_preproc.py', 'format_for_table'): 'format_for_table',
+    ('validation.py', 'validate_dataframe'): 'validate',
+    ('fingerprint.py', 'row_blocks'): 'fingerprint',
+    ('s3_preproc.py', 'save_dataframe_to_s3'): 'save_dataframe_to_s3',
+    ('s3_preproc.py', 'save_dataframe_parts_to_s3'): 'save_dataframe_to_s3',
+    ('s3_preproc.py', 'write'): 'save_dataframe_to_s3',
+    ('s3_preproc.py', 'finish'): 'save_dataframe_to_s3',
+    ('redshift_loader.py', 'copy_data_from_s3_to_redshift'): 'copy_data_from_s3_to_redshift',
+}
+
+# Compared by --compare, lower is better for all of them
+COMPARED = ('wall_seconds', 'peak_rss_mib')
+COMPARED_LATENCY = ('p50', 'p90')
+
+
+def percentiles(values: list) -> dict:
+    #Nearest rank, enough for the handful to thousands of samples of a run
+    values = sorted(values)
+    if not values:
+        return {}
+    rank = lambda q: values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+    return {'p50': rank(0.50), 'p90': rank(0.90), 'p99': rank(0.99), 'max': values[-1], 'count': len(values)}
+
+
+def rss_mib() -> float:
+    #Current resident set size, from /proc on Linux, falling back to the peak elsewhere
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class StageSampler(threading.Thread):
+    """
+    Sample the RSS and the stage every thread is in, every interval seconds.
+    """
+
+    def __init__(self, interval: float = 0.02) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peaks = defaultdict(float)
+        self.samples = defaultdict(int)
+        self._stop_event = threading.Event()
+
+    def _stages(self) -> set:
+        stages = set()
+        for thread_id, frame in sys._current_frames().items():
+            while frame is not None:
+                code = frame.f_code
+                stage = STAGE_FUNCTIONS.get((os.path.basename(code.co_filename), code.co_name))
+                if stage is not None:
+                    stages.add(stage)
+                    break
+                frame = frame.f_back
+        return stages
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            rss = rss_mib()
+            for stage in self._stages():
+                self.peaks[stage] = max(self.peaks[stage], rss)
+                self.samples[stage] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class TraceCollector:
+    """
+    Logging handler target collecting the FileTrace published for every file.
+    """
+
+    def __init__(self) -> None:
+        import logging
+        self.traces = []
+        self.done = threading.Condition()
+        collector = self
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                trace = getattr(record, 'trace', None)
+                if trace is not None:
+                    with collector.done:
+                        collector.traces.append(trace)
+                        collector.done.notify_all()
+
+        self.handler = Handler()
+        logging.getLogger('datalakep.trace').addHandler(self.handler)
+
+    def wait(self, count: int, timeout: float) -> bool:
+        with self.done:
+            return self.done.wait_for(lambda: len(self.traces) >= count, timeout)
+
+
+def reset_database(dsn: str) -> None:
+    #Every scenario starts from empty tables and ledger, otherwise repeated files are skipped as duplicates
+    import psycopg2
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from sql_queries import TABLE_DDL, INTERNAL_TABLE_DDL
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cursor:
+        for table in list(TABLE_DDL) + list(INTERNAL_TABLE_DDL):
+            cursor.execute(f'DROP TABLE IF EXISTS {table};')
+    connection.close()
+
+
+def child(dsn: str, fmt: str, rows: int, files: int, timeout: float) -> dict:
+    #Runs in the scenario work directory, whose config/config.yaml main() reads
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    import boto3
+    from moto import mock_aws
+    import pg_standin
+    from synthetic import write_titanic_csv, write_titanic_xlsx
+
+    reset_database(dsn)
+    pg_standin.install(dsn)
+    with open('config/config.yaml') as file:
+        config = yaml.safe_load(file)
+
+    with mock_aws():
+        s3 = boto3.client('s3')
+        sqs = boto3.client('sqs')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': config['Region']})
+        queue_url = sqs.create_queue(QueueName=QUEUE)['QueueUrl']
+        config['SQS']['url'] = queue_url
+        with open('config/config.yaml', 'w') as file:
+            yaml.safe_dump(config, file)
+
+        source = f'source.{fmt}'
+        size = (write_titanic_csv if fmt == 'csv' else write_titanic_xlsx)(source, rows)
+        keys = [f'Upload/train_{index:04d}.{fmt}' for index in range(files)]
+        for key in keys:
+            s3.upload_file(source, BUCKET, key) #Same content under every key, the ledger tells files apart by key
+        os.remove(source)
+
+        import main as service
+        collector = TraceCollector()
+        sampler = StageSampler()
+        stop = threading.Event()
+        consumer = threading.Thread(target=service.main, args=(stop,), daemon=True)
+
+        sampler.start()
+        start = time.perf_counter()
+        for key in keys:
+            event = {'Records': [{'eventSource': 'aws:s3',
+                                  's3': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'size': size}}}]}
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(event))
+        consumer.start()
+        finished = collector.wait(files, timeout)
+        wall = time.perf_counter() - start
+        stop.set()
+        consumer.join(timeout)
+        sampler.stop()
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    traces = collector.traces
+    statuses = defaultdict(int)
+    stage_seconds = defaultdict(list)
+    stage_rows = defaultdict(int)
+    for trace in traces:
+        statuses[trace['status']] += 1
+        for name, stats in trace['stages'].items():
+            stage_seconds[name].append(stats['seconds'])
+            stage_rows[name] += stats['rows']
+    loaded_rows = rows * statuses.get('loaded', 0)
+
+    return {
+        'format': fmt,
+        'rows': rows,
+        'files': files,
+        'input_mib': round(size * files / 2**20, 3),
+        'complete': finished,
+        'statuses': dict(statuses),
+        'wall_seconds': round(wall, 3),
+        'rows_per_second': round(loaded_rows / wall, 1),
+        'mib_per_second': round(size * files / 2**20 / wall, 3),
+        'peak_rss_mib': round(peak, 1),
+        'peak_frame_mib': round(max((trace['memory']['bytes'] for trace in traces if 'memory' in trace), default=0) / 2**20, 3),
+        'file_seconds': percentiles([trace['seconds'] for trace in traces]),
+        'stages': {
+            name: {
+                **percentiles(values),
+                'total_seconds': round(sum(values), 6),
+                'rows_per_second': round(stage_rows[name] / sum(values), 1) if sum(values) else None,
+                'peak_rss_mib': round(sampler.peaks[name], 1) if name in sampler.peaks else None,
+                'rss_samples': sampler.samples.get(name, 0),
+            }
+            for name, values in stage_seconds.items()
+        },
+    }
+
+
+def scenario_config(overrides: dict) -> dict:
+    with open(os.path.join(ROOT, 'config', 'config.yaml')) as file:
+        config = yaml.safe_load(file)
+    for path, value in overrides.items():
+        section, key = path.split('.', 1)
+        config.setdefault(section, {})[key] = value
+    return config
+
+
+def run_scenario(args, overrides: dict, fmt: str, rows: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix='datalakep-bench-')
+    try:
+        os.makedirs(os.path.join(workdir, 'config'))
+        with open(os.path.join(workdir, 'config', 'config.yaml'), 'w') as file:
+            yaml.safe_dump(scenario_config(overrides), file)
+        with open(os.path.join(workdir, 'service.log'), 'wb') as log:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', fmt, str(rows),
+                                        '--files', str(args.files), '--dsn', args.dsn, '--timeout', str(args.timeout)],
+                                       cwd=workdir, stdout=subprocess.PIPE, stderr=log)
+        if completed.returncode != 0:
+            with open(os.path.join(workdir, 'service.log'), 'rb') as log:
+                sys.stderr.write(log.read().decode(errors='replace')[-4000:])
+            raise RuntimeError(f'Scenario {fmt}-{rows} failed with exit status {completed.returncode}')
+        return json.loads(completed.stdout.decode().strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(name: str, result: dict) -> None:
+    latency = result['file_seconds']
+    print(f"{name}: {result['wall_seconds']:.2f} s, {result['rows_per_second']:,.0f} rows/s, "
+          f"{result['mib_per_second']:.2f} MiB/s, peak RSS {result['peak_rss_mib']:.0f} MiB, "
+          f"largest DataFrame {result.get('peak_frame_mib', 0):.1f} MiB, "
+          f"file p50 {latency.get('p50', 0):.2f} s p99 {latency.get('p99', 0):.2f} s, {result['statuses']}")
+    for stage, stats in result['stages'].items():
+        peak = f"{stats['peak_rss_mib']:.0f} MiB" if stats['peak_rss_mib'] is not None else '-'
+        print(f"  {stage:>30}: p50 {stats['p50'] * 1e3:9.1f} ms  p90 {stats['p90'] * 1e3:9.1f} ms  "
+              f"p99 {stats['p99'] * 1e3:9.1f} ms  total {stats['total_seconds']:8.2f} s  peak RSS {peak}")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Metrics of current that are more than threshold (a fraction) above the same metric of baseline.
+    """
+    if baseline.get('overrides') != current.get('overrides'):
+        print('warning: the runs used different configuration overrides')
+    regressions = []
+
+    def check(label, old, new):
+        if old and new is not None and new > old * (1 + threshold):
+            regressions.append(f'{label}: {old:.3f} -> {new:.3f} (+{(new / old - 1) * 100:.0f}%)')
+
+    for name, result in current['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        for metric in COMPARED:
+            check(f'{name} {metric}', old[metric], result[metric])
+        for quantile in COMPARED_LATENCY:
+            check(f'{name} file {quantile}', old['file_seconds'].get(quantile), result['file_seconds'].get(quantile))
+        for stage, stats in result['stages'].items():
+            old_stats = old['stages'].get(stage, {})
+            check(f'{name} {stage} p90', old_stats.get('p90'), stats['p90'])
+            check(f'{name} {stage} peak RSS', old_stats.get('peak_rss_mib'), stats['peak_rss_mib'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN', 'postgresql://postgres@localhost/postgres'))
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Rows per file, one scenario per value (10k to 10M)')
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'xlsx'], default=['csv'])
+    parser.add_argument('--files', type=int, default=5, help='Files per scenario')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='Override a config.yaml value, parsed as YAML, e.g. --set Preproc.streaming=false')
+    parser.add_argument('--timeout', type=float, default=3600, help='Seconds to wait for a scenario to load')
+    parser.add_argument('--output', help='Result file, defaults to benchmarks/results/<time>-<revision>.json')
+    parser.add_argument('--compare', help='Previous result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative growth reported as a regression')
+    parser.add_argument('--child', nargs=2, metavar=('FORMAT', 'ROWS'))
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(child(args.dsn, args.child[0], int(args.child[1]), args.files, args.timeout)))
+        return
+
+    from synthetic import XLSX_MAX_ROWS
+    overrides = dict(OVERRIDES)
+    for item in args.set:
+        path, value = item.split('=', 1)
+        overrides[path] = yaml.safe_load(value)
+
+    scenarios = {}
+    for fmt in args.formats:
+        for rows in args.rows:
+            if fmt == 'xlsx' and rows > XLSX_MAX_ROWS:
+                print(f'{fmt}-{rows}: skipped, an XLSX sheet holds at most {XLSX_MAX_ROWS} rows')
+                continue
+            name = f'{fmt}-{rows}'
+            scenarios[name] = run_scenario(args, overrides, fmt, rows)
+            report(name, scenarios[name])
+
+    revision = git_revision()
+    result = {
+        'revision': revision,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'files': args.files,
+        'overrides': overrides,
+        'scenarios': scenarios,
+    }
+    output = args.output or os.path.join(RESULTS, f"{time.strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=2)
+    print(f'results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), result, args.threshold)
+        for line in regressions:
+            print(f'regression {line}')
+        if regressions:
+            sys.exit(1)
+        print(f'no regression above {args.threshold:.0%} against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Routing throughput: difflib scans against the precomputed TableRouter index.
+
+Builds --tables synthetic table names and routes --files filenames drawn from them (with suffixes,
+dates and typos) plus unknown names. difflib is only timed on a sample and extrapolated, a full run
+over 5k tables takes hours.
+
+Usage:
+    python benchmarks/bench_routing.py --tables 5000 --files 100000
+"""
+import os
+import sys
+import time
+import random
+import difflib
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from table_router import TableRouter
+
+WORDS = ['sales', 'orders', 'customer', 'invoice', 'stock', 'claims', 'events', 'payments', 'users',
+         'sensor', 'audit', 'ledger', 'shipment', 'returns', 'pricing', 'campaign', 'session', 'device']
+
+
+def table_names(count: int, rng: random.Random) -> list:
+    names = set()
+    while len(names) < count:
+        names.add('_'.join(rng.sample(WORDS, 2)) + f'_{rng.randrange(1000):03d}')
+    return sorted(names)
+
+
+def filenames(tables: list, count: int, distinct: int, rng: random.Random) -> list:
+    stems = []
+    for _ in range(distinct):
+        table = rng.choice(tables)
+        variant = rng.randrange(4)
+        if variant == 0:
+            stems.append(table)
+        elif variant == 1:
+            stems.append(f'{table}_{rng.randrange(2020, 2026)}{rng.randrange(1, 13):02d}')
+        elif variant == 2:
+            position = rng.randrange(len(table))
+            stems.append(table[:position] + table[position + 1:]) #Typo
+        else:
+            stems.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(12)))
+    return [f'{rng.choice(stems)}.{rng.choice(["csv", "xlsx"])}' for _ in range(count)]
+
+
+def route_difflib(filename: str, tables: list) -> str:
+    matches = difflib.get_close_matches(filename.split('.')[0].lower(), tables, n=1, cutoff=0.4)
+    return matches[0] if matches else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tables', type=int, default=5000)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=20000, help='Distinct filename stems among the files')
+    parser.add_argument('--difflib-sample', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    tables = table_names(args.tables, rng)
+    files = filenames(tables, args.files, args.distinct, rng)
+
+    start = time.perf_counter()
+    for filename in files[:args.difflib_sample]:
+        route_difflib(filename, tables)
+    per_file = (time.perf_counter() - start) / args.difflib_sample
+    print(f"{'difflib':>16}: {per_file * 1e3:9.3f} ms/file, {per_file * args.files:9.1f} s for {args.files} files (extrapolated)")
+
+    start = time.perf_counter()
+    router = TableRouter(tables)
+    built = time.perf_counter()
+    print(f"{'index build':>16}: {built - start:9.3f} s for {args.tables} tables")
+
+    cold = TableRouter(tables, cache_size=0)
+    start = time.perf_counter()
+    routed = sum(cold.route(filename) is not None for filename in files)
+    elapsed = time.perf_counter() - start
+    print(f"{'router, no memo':>16}: {elapsed / args.files * 1e3:9.3f} ms/file, {elapsed:9.2f} s ({routed} routed)")
+
+    start = time.perf_counter()
+    routed = sum(router.route(filename) is not None for filename in files)
+    elapsed = time.perf_counter() - start
+    print(f"{'router, memo':>16}: {elapsed / args.files * 1e3:9.3f} ms/file, {elapsed:9.2f} s ({routed} routed)")
+
+
+if __name__ == '__main__':
+    main()
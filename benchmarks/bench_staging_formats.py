@@ -0,0 +1,64 @@
+"""
+Bytes staged and load time for every staging format.
+
+Formats a synthetic train.csv, stages it with save_dataframe_to_s3 in a moto-backed bucket and COPYs
+it into a local Postgres stand-in. moto has no bandwidth limit, so --mbps throttles every S3 request
+by its payload size to resemble the real link between the host and S3.
+
+Usage:
+    python benchmarks/bench_staging_formats.py --dsn postgresql://postgres@localhost/bench --rows 500000 --mbps 400
+"""
+import os
+import sys
+import time
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import boto3
+from moto import mock_aws
+import pg_standin
+from synthetic import titanic_frame
+
+BUCKET = 'bench-datalakep'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_PG_DSN', 'postgresql://postgres@localhost/postgres'))
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--mbps', type=float, default=400)
+    args = parser.parse_args()
+
+    pg_standin.install(args.dsn)
+    redshift_config = {'host': 'standin', 'port': 5432, 'dbname': 'bench', 'user': 'bench', 'password': '',
+                       'iam_role': 'arn:aws:iam::000000000000:role/bench'}
+
+    def throttle(request, **kwargs):
+        body = request.body or b''
+        time.sleep(len(body) * 8 / (args.mbps * 1e6))
+
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        import s3_preproc
+        from s3_preproc import save_dataframe_to_s3, format_for_table, staging_columns, STAGING_SUFFIXES
+        from redshift_loader import ensure_required_tables, copy_data_from_s3_to_redshift
+        s3_preproc.s3.meta.events.register('before-send', throttle)
+        ensure_required_tables(redshift_config)
+        df = format_for_table(titanic_frame(args.rows), 'train_data', 'train.csv')
+
+        print(f"{'format':>9} {'MiB staged':>11} {'stage s':>8} {'copy s':>8} {'total s':>8}")
+        for staging_format, suffix in STAGING_SUFFIXES.items():
+            key = f'Tmp/train-autogen{suffix}'
+            start = time.perf_counter()
+            size = save_dataframe_to_s3(df, BUCKET, key, staging_format, 'train_data')
+            staged = time.perf_counter()
+            copy_data_from_s3_to_redshift(redshift_config, f's3://{BUCKET}/{key}', 'train_data',
+                                          staging_format=staging_format, columns=staging_columns(df))
+            copied = time.perf_counter()
+            print(f"{staging_format:>9} {size / 2**20:11.2f} {staged - start:8.2f} {copied - staged:8.2f} {copied - start:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Peak Python memory of the in-memory and the streaming CSV paths.
+
+Runs load_file + format_for_table + save_dataframe_to_s3 and the chunked equivalent over the same
+synthetic CSV stored in a moto-backed S3 bucket, and reports the tracemalloc peak of each.
+
+Usage:
+    python benchmarks/bench_streaming_memory.py --rows 1000000 --chunksize 50000
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import boto3
+from moto import mock_aws
+from synthetic import titanic_csv
+
+BUCKET = 'bench-datalakep'
+
+
+def measure(label: str, run) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>9}: peak {peak / 2**20:8.1f} MiB, {elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunksize', type=int, default=50000)
+    args = parser.parse_args()
+
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        body = titanic_csv(args.rows)
+        boto3.client('s3').put_object(Bucket=BUCKET, Key='Upload/train.csv', Body=body)
+        print(f"input: {args.rows} rows, {len(body) / 2**20:.1f} MiB")
+        del body
+
+        from s3_preproc import load_file, load_file_chunks, format_for_table, save_dataframe_to_s3, stream_dataframes_to_s3
+
+        def in_memory():
+            _, df = load_file(BUCKET, 'Upload/train.csv')
+            save_dataframe_to_s3(format_for_table(df, 'train_data', 'train.csv'), BUCKET, 'Tmp/train-autogen.csv')
+
+        def streaming():
+            _, chunks = load_file_chunks(BUCKET, 'Upload/train.csv', args.chunksize)
+            formatted = (format_for_table(chunk, 'train_data', 'train.csv') for chunk in chunks)
+            stream_dataframes_to_s3(formatted, BUCKET, 'Tmp/train-autogen.csv')
+
+        measure('in-memory', in_memory)
+        measure('streaming', streaming)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Local Postgres stand-in for Redshift, used by the benchmarks.
+
+Redshift specific DDL is rewritten into plain Postgres and COPY ... FROM 's3://...' statements are
+served by downloading the object (from real S3 or a moto mock) and streaming it through
+COPY ... FROM STDIN, so the loader code runs unmodified against a local database.
+"""
+import io
+import re
+import gzip
+import json
+import boto3
+import psycopg2
+from psycopg2 import extensions
+from typing import Callable, Optional
+
+_COPY_RE = re.compile(r"^\s*COPY\s+(?P<table>\S+)\s*(?P<columns>\([^)]*\))?\s+FROM\s+'(?P<path>s3://[^']+)'(?P<options>.*)$",
+                      re.IGNORECASE | re.DOTALL)
+
+connects = 0 #Physical connections opened through the stand-in
+
+
+def redshift_to_postgres(sql: str) -> str:
+    """
+    Rewrite the Redshift only parts of a DDL statement into Postgres syntax.
+    """
+    sql = re.sub(r'IDENTITY\(\s*\d+\s*,\s*\d+\s*\)', 'GENERATED BY DEFAULT AS IDENTITY', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s+DISTSTYLE\s+\w+', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s+DISTKEY\s*\([^)]*\)', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s+ENCODE\s+\w+', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s+(?:COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'GETDATE\(\)', 'now()', sql, flags=re.IGNORECASE)
+    return sql
+
+
+def s3_fetcher(s3_path: str) -> bytes:
+    """
+    Default fetcher: download the object from S3 (a moto mock when one is active).
+    """
+    bucket, key = s3_path[len('s3://'):].split('/', 1)
+    return boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+class StandinCursor(extensions.cursor):
+    fetcher: Callable[[str], bytes] = staticmethod(s3_fetcher)
+
+    def _non_identity_columns(self, table: str) -> str:
+        #Redshift COPY without a column list skips IDENTITY columns, Postgres does not
+        super().execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = %s AND is_identity = 'NO' ORDER BY ordinal_position",
+            (table,)
+        )
+        return '(' + ', '.join(row[0] for row in self.fetchall()) + ')'
+
+    @staticmethod
+    def _decode(body: bytes, options: str) -> bytes:
+        #Turn a staged object into plain CSV, whatever its staging format
+        if 'PARQUET' in options:
+            import pyarrow.parquet as pq
+            return pq.read_table(io.BytesIO(body)).to_pandas().to_csv(index=False, header=False).encode('utf-8')
+        if re.search(r'\bGZIP\b', options):
+            return gzip.decompress(body)
+        if re.search(r'\bZSTD\b', options):
+            import zstandard
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        return body
+
+    def execute(self, query, vars=None):
+        match = _COPY_RE.match(query) if isinstance(query, str) else None
+        if match is None:
+            return super().execute(redshift_to_postgres(query) if isinstance(query, str) else query, vars)
+
+        options = match.group('options').upper()
+        header = re.search(r'IGNOREHEADER\s+(\d+)', options)
+        columns = match.group('columns') or self._non_identity_columns(match.group('table'))
+        if re.search(r'\bMANIFEST\b', options):
+            manifest = json.loads(self.fetcher(match.group('path')))
+            paths = [entry['url'] for entry in manifest['entries']]
+        else:
+            paths = [match.group('path')]
+
+        data = io.BytesIO()
+        for path in paths:
+            body = self._decode(self.fetcher(path), options)
+            if header:
+                body = body.split(b'\n', int(header.group(1)))[-1] #Every file carries its own header
+            data.write(body)
+        data.seek(0)
+        copy_sql = f"COPY {match.group('table')} {columns} FROM STDIN WITH (FORMAT csv)"
+        return self.copy_expert(copy_sql, data)
+
+
+def install(dsn: str, fetcher: Optional[Callable[[str], bytes]] = None) -> None:
+    """
+    Redirect every psycopg2.connect call to the local Postgres given by dsn.
+
+    Parameters:
+        dsn (str): libpq connection string of the local Postgres, e.g. 'postgresql://postgres@localhost/bench'.
+        fetcher (callable, optional): Function mapping an s3:// path to its bytes. Defaults to boto3.
+    """
+    real_connect = psycopg2.connect
+    if fetcher is not None:
+        StandinCursor.fetcher = staticmethod(fetcher)
+
+    def connect(*args, **kwargs):
+        global connects
+        connects += 1
+        return real_connect(dsn, cursor_factory=StandinCursor)
+
+    psycopg2.connect = connect
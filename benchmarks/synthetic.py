@@ -0,0 +1,98 @@
+"""
+Synthetic Titanic-shaped data for the benchmarks.
+"""
+import os
+from typing import Iterator
+import numpy as np
+import pandas as pd
+
+TRAIN_COLUMNS = ['PassengerId', 'Survived', 'Pclass', 'Name', 'Sex', 'Age', 'SibSp',
+                 'Parch', 'Ticket', 'Fare', 'Cabin', 'Embarked']
+
+
+def titanic_frame(rows: int, seed: int = 0, with_survived: bool = True, first_id: int = 1) -> pd.DataFrame:
+    """
+    Build a DataFrame with the columns and value ranges of the Kaggle Titanic train.csv.
+
+    Parameters:
+        rows (int): Number of passengers.
+        seed (int): Seed for the random generator, so runs are comparable.
+        with_survived (bool): Include the Survived column (train) or not (test).
+        first_id (int): PassengerId of the first row, for frames generated in several pieces.
+    """
+    rng = np.random.default_rng(seed)
+    surnames = np.array(['Braund', 'Cumings', 'Heikkinen', 'Futrelle', 'Allen', 'Moran', 'McCarthy', 'Palsson'])
+    titles = np.array(['Mr.', 'Mrs.', 'Miss.', 'Master.'])
+    given = np.array(['Owen Harris', 'John Bradley', 'Laina', 'Jacques Heath', 'William Henry', 'James', 'Gosta Leonard'])
+    age = np.round(rng.uniform(0.42, 80, rows), 2)
+    age[rng.random(rows) < 0.2] = np.nan
+    cabin = pd.Series(np.char.add(rng.choice(list('ABCDEFG'), rows), rng.integers(1, 150, rows).astype(str)))
+    cabin[rng.random(rows) < 0.77] = None
+
+    frame = pd.DataFrame({
+        'PassengerId': np.arange(first_id, first_id + rows),
+        'Survived': rng.integers(0, 2, rows),
+        'Pclass': rng.integers(1, 4, rows),
+        'Name': pd.Series(rng.choice(surnames, rows)) + ', ' + rng.choice(titles, rows) + ' ' + rng.choice(given, rows),
+        'Sex': rng.choice(['male', 'female'], rows),
+        'Age': age,
+        'SibSp': rng.integers(0, 9, rows),
+        'Parch': rng.integers(0, 7, rows),
+        'Ticket': pd.Series(rng.integers(1000, 3999999, rows)).astype(str),
+        'Fare': np.round(rng.gamma(1.5, 22, rows), 4),
+        'Cabin': cabin,
+        'Embarked': rng.choice(['S', 'C', 'Q'], rows, p=[0.72, 0.19, 0.09]),
+    })
+    if not with_survived:
+        frame = frame.drop(columns='Survived')
+    return frame
+
+
+def titanic_csv(rows: int, seed: int = 0, with_survived: bool = True) -> bytes:
+    """
+    Same as titanic_frame, rendered as CSV bytes.
+    """
+    return titanic_frame(rows, seed, with_survived).to_csv(index=False).encode('utf-8')
+
+
+# Largest sheet Excel can open: 1,048,576 rows including the header
+XLSX_MAX_ROWS = 1048575
+
+
+def _pieces(rows: int, seed: int, with_survived: bool, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, rows, chunk_rows):
+        yield titanic_frame(min(chunk_rows, rows - start), seed + start // chunk_rows, with_survived, start + 1)
+
+
+def write_titanic_csv(path: str, rows: int, seed: int = 0, with_survived: bool = True, chunk_rows: int = 500000) -> int:
+    """
+    Write a Titanic-shaped CSV file piece by piece, so files of millions of rows fit in memory.
+
+    Returns:
+        int: Size of the file in bytes.
+    """
+    with open(path, 'w', newline='') as file:
+        for index, frame in enumerate(_pieces(rows, seed, with_survived, chunk_rows)):
+            frame.to_csv(file, index=False, header=index == 0)
+    return os.path.getsize(path)
+
+
+def write_titanic_xlsx(path: str, rows: int, seed: int = 0, with_survived: bool = True, chunk_rows: int = 100000) -> int:
+    """
+    Write a Titanic-shaped XLSX file with a write-only workbook, at most XLSX_MAX_ROWS rows.
+
+    Returns:
+        int: Size of the file in bytes.
+    """
+    if rows > XLSX_MAX_ROWS:
+        raise ValueError(f'An XLSX sheet holds at most {XLSX_MAX_ROWS} rows, {rows} requested')
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(TRAIN_COLUMNS if with_survived else [c for c in TRAIN_COLUMNS if c != 'Survived'])
+    for frame in _pieces(rows, seed, with_survived, chunk_rows):
+        frame = frame.astype(object).where(frame.notna(), None)
+        for row in frame.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+    return os.path.getsize(path)
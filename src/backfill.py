@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import threading
+from collections import defaultdict
+from typing import Dict, List, Union, Optional, Iterator, Tuple, Set
+from redshift_loader import get_rs_config_params, ensure_required_tables
+from s3_preproc import s3, get_preproc_config_params
+from file_readers import READERS
+from table_router import route_file
+from copy_batcher import get_batch_config_params, CopyBatcher
+from file_engine import SMALL_LANE, get_scheduling_config_params, ConcurrentFileProcessor
+from process_pool import shutdown_process_pool
+from staging_cleaner import get_cleanup_config_params, start_cleaner
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_backfill_config_params() -> Dict[str, Union[int, str]]:
+    """
+    Load the backfill parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with backfill parameters:
+            - bucket (str): Bucket listed by default, S3.bucket if not set.
+            - prefix (str): Folder listed by default.
+            - workers (int): Small files prepared at the same time (all files when Scheduling is disabled).
+            - max_in_flight (int): Files submitted and not yet handed to the COPY stage.
+            - max_files (int): Files per batched COPY of a table.
+            - max_bytes (int): Staged bytes per batched COPY of a table.
+            - checkpoint (str): Local file where the loaded keys are recorded.
+            - checkpoint_seconds (float): Longest time between two checkpoint writes.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    backfill = config.get('Backfill', {})
+    workers = backfill.get('workers', 8)
+    return {
+        'bucket': backfill.get('bucket', config.get('S3', {}).get('bucket')),
+        'prefix': backfill.get('prefix', 'Upload/'),
+        'workers': workers,
+        'max_in_flight': backfill.get('max_in_flight', 4 * workers),
+        'max_files': backfill.get('max_files', 500),
+        'max_bytes': backfill.get('max_bytes', 1024 * 1024 * 1024),
+        'checkpoint': backfill.get('checkpoint', 'backfill_checkpoint.json'),
+        'checkpoint_seconds': backfill.get('checkpoint_seconds', 10)
+    }
+
+def list_files(bucket: str, prefix: str) -> Iterator[Tuple[str, int]]:
+    """
+    Page through the objects under a prefix, keeping the ones a reader is registered for.
+
+    Returns:
+        Iterator[Tuple[str, int]]: (key, size in bytes) of every file, in key order.
+    """
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            key = item['Key']
+            if item['Size'] > 0 and key.split('.')[-1].lower() in READERS:
+                yield key, item['Size']
+
+def group_by_table(rs_config: Dict[str, Union[str, int]],
+                   files: Iterator[Tuple[str, int]]
+                   ) -> Dict[Optional[str], List[Tuple[str, int]]]:
+    """
+    Group files by the table their name routes to. Files that match no table are grouped under None:
+    they are loaded only if schema inference creates a table for them.
+    """
+    groups: Dict[Optional[str], List[Tuple[str, int]]] = defaultdict(list)
+    for key, size in files:
+        groups[route_file(rs_config, key.split('/')[-1])].append((key, size))
+    return groups
+
+class BackfillCheckpoint:
+    """
+    Keys of a backfill already loaded (or found not compatible) and the ones that failed, kept in a
+    local JSON file so an interrupted backfill resumes where it stopped. A key is recorded done only
+    once its COPY committed. The file is rewritten atomically at most every interval seconds, and
+    by save().
+
+    Parameters:
+        path (str): Checkpoint file.
+        bucket (str): Bucket of the backfill.
+        prefix (str): Prefix of the backfill. A checkpoint of another bucket or prefix is rejected.
+        interval (float): Longest time between two writes while keys are being recorded.
+    """
+
+    def __init__(self, path: str, bucket: str, prefix: str, interval: float = 10) -> None:
+        self.path = path
+        self.bucket = bucket
+        self.prefix = prefix
+        self.interval = interval
+        self.done: Set[str] = set()
+        self.failed: Dict[str, str] = {}
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            if (state['bucket'], state['prefix']) != (bucket, prefix):
+                raise ValueError(f"Checkpoint {path} belongs to s3://{state['bucket']}/{state['prefix']}, "
+                                 f"not s3://{bucket}/{prefix}")
+            self.done = set(state['done'])
+            self.failed = dict(state.get('failed', {})) #Retried by this run, kept until they load
+            logger.info(f'Resuming backfill from {path}: {len(self.done)} files already loaded, '
+                        f'{len(self.failed)} failed before')
+
+    def mark_done(self, key: str) -> None:
+        with self._lock:
+            self.done.add(key)
+            self.failed.pop(key, None)
+        self._save_due()
+
+    def mark_failed(self, key: str, error: Optional[Exception]) -> None:
+        with self._lock:
+            self.failed[key] = f'{type(error).__name__}: {error}' if error is not None else 'failed'
+        self._save_due()
+
+    def _save_due(self) -> None:
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Write the checkpoint to a temporary file and move it over the previous one.
+        """
+        with self._lock:
+            state = {'bucket': self.bucket, 'prefix': self.prefix, 'done': sorted(self.done), 'failed': dict(self.failed)}
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(state, file)
+            os.replace(temporary, self.path)
+            self._saved_at = time.monotonic()
+
+def backfill(bucket: str,
+             prefix: str,
+             tables: Optional[List[str]] = None,
+             checkpoint_path: Optional[str] = None,
+             dry_run: bool = False
+             ) -> Dict[str, int]:
+    """
+    Load every file under a prefix without S3 events: the files are listed, grouped by table and
+    run through the same preparation as the SQS consumer by a pool of workers, and the staged files
+    of every table are loaded with large batched COPY commands.
+
+    Tables are submitted one after the other, so the batches of a table fill up quickly while the
+    workers keep several files of it in progress. Files recorded in the checkpoint are skipped, and
+    with the ingestion ledger enabled files loaded by the consumer are skipped as well.
+
+    Parameters:
+        bucket (str): Bucket to load.
+        prefix (str): Folder to load.
+        tables (List[str], optional): Only load the files routed to these tables.
+        checkpoint_path (str, optional): Checkpoint file, Backfill.checkpoint if None.
+        dry_run (bool): Only report the files per table.
+
+    Returns:
+        dict: Number of files 'listed', 'skipped' (already in the checkpoint), 'submitted', 'loaded' and 'failed'.
+    """
+    redshift_config = get_rs_config_params()
+    backfill_config = get_backfill_config_params()
+    groups = group_by_table(redshift_config, list_files(bucket, prefix))
+    for table_name, files in sorted(groups.items(), key=lambda item: item[0] or ''):
+        logger.info(f"{table_name or 'no table'}: {len(files)} files, {sum(size for _, size in files) / 2**20:.1f} MiB")
+    if tables:
+        groups = {table_name: files for table_name, files in groups.items() if table_name in tables}
+    counts = {'listed': sum(len(files) for files in groups.values()), 'skipped': 0, 'submitted': 0, 'loaded': 0, 'failed': 0}
+    if dry_run:
+        return counts
+
+    checkpoint = BackfillCheckpoint(checkpoint_path or backfill_config['checkpoint'], bucket, prefix,
+                                    backfill_config['checkpoint_seconds'])
+    preproc_config = get_preproc_config_params()
+    cleanup_config = get_cleanup_config_params()
+    ensure_required_tables(redshift_config)
+    cleaner = start_cleaner(cleanup_config['flush_seconds']) if cleanup_config['enabled'] else None
+    batch_config = get_batch_config_params()
+    batcher = CopyBatcher( #Always batched, with larger thresholds than the consumer
+        redshift_config,
+        max_files=backfill_config['max_files'],
+        max_bytes=backfill_config['max_bytes'],
+        max_wait_seconds=batch_config['max_wait_seconds'],
+        manifest_prefix=batch_config['manifest_prefix']
+    )
+    scheduling_config = get_scheduling_config_params()
+    scheduling_config['workers'][SMALL_LANE] = backfill_config['workers']
+    engine = ConcurrentFileProcessor(
+        redshift_config,
+        workers=backfill_config['workers'],
+        max_in_flight=backfill_config['max_in_flight'],
+        batcher=batcher,
+        preproc_config=preproc_config,
+        scheduling_config=scheduling_config
+    )
+
+    submitted: Set[str] = set()
+    try:
+        for table_name in sorted(groups, key=lambda table: table or ''):
+            for key, size in groups[table_name]:
+                if key in checkpoint.done:
+                    counts['skipped'] += 1
+                    continue
+                while not engine.wait_for_capacity(timeout=1):
+                    batcher.flush_due()
+                batcher.flush_due()
+                engine.submit(bucket, key, lambda key=key: checkpoint.mark_done(key),
+                              lambda error, key=key: checkpoint.mark_failed(key, error), size, raw_key=True)
+                submitted.add(key)
+    finally:
+        engine.drain()
+        batcher.flush()
+        engine.shutdown()
+        shutdown_process_pool()
+        if cleaner is not None:
+            cleaner.stop()
+        checkpoint.save()
+
+    failed = {key: error for key, error in checkpoint.failed.items() if key in submitted} #Not the earlier failures left out by --table
+    counts['submitted'] = len(submitted)
+    counts['failed'] = len(failed)
+    counts['loaded'] = counts['submitted'] - counts['failed']
+    for key, error in sorted(failed.items()):
+        logger.error(f'Backfill of {key} failed: {error}')
+    logger.info(f"Backfill of s3://{bucket}/{prefix}: {counts['loaded']} files loaded, {counts['failed']} failed, "
+                f"{counts['skipped']} already loaded before")
+    return counts
+
+def main(argv: Optional[List[str]] = None) -> int:
+    config = get_backfill_config_params()
+    parser = argparse.ArgumentParser(description='Load every file under an S3 prefix into Redshift, without S3 events.')
+    parser.add_argument('--bucket', default=config['bucket'])
+    parser.add_argument('--prefix', default=config['prefix'])
+    parser.add_argument('--table', action='append', dest='tables', metavar='TABLE',
+                        help='Only load the files routed to this table, can be repeated')
+    parser.add_argument('--checkpoint', default=config['checkpoint'], help='Checkpoint file, resumed if it exists')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the files per table')
+    args = parser.parse_args(argv)
+    counts = backfill(args.bucket, args.prefix, args.tables, args.checkpoint, args.dry_run)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,205 @@
+import time
+import threading
+import logging
+import psycopg2
+from psycopg2 import extensions
+from contextlib import contextmanager
+from typing import Dict, Union, List, Tuple, Iterator
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RedshiftConnectionPool:
+    """
+    Thread-safe pool of reusable Redshift connections.
+
+    Connections are handed out LIFO so the most recently used (and most likely alive) socket is
+    reused first. Idle connections are closed once they exceed the idle timeout, and connections
+    that have been idle for longer than the health check interval are probed with a cheap query
+    before being handed out. A broken connection is discarded and replaced transparently.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters as returned by
+            get_rs_config_params.
+        max_size (int): Maximum number of connections open at the same time.
+        idle_timeout (float): Seconds an unused connection may stay open before it is closed.
+        health_check_interval (float): Seconds of idleness after which a connection is probed
+            with SELECT 1 before reuse.
+    """
+
+    def __init__(self,
+                 config_params: Dict[str, Union[str, int]],
+                 max_size: int = 4,
+                 idle_timeout: float = 300,
+                 health_check_interval: float = 30
+                 ) -> None:
+        self.config_params = config_params
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connects = 0 #Number of physical connections opened, useful to measure reuse
+        self._idle: List[Tuple[extensions.connection, float]] = [] #(connection, last time used)
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def _connect(self) -> extensions.connection:
+        connection = psycopg2.connect(
+            host=self.config_params['host'],
+            port=self.config_params['port'],
+            dbname=self.config_params['dbname'],
+            user=self.config_params['user'],
+            password=self.config_params['password']
+        )
+        with self._cond:
+            self.connects += 1
+        return connection
+
+    def _is_healthy(self, connection: extensions.connection, last_used: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            connection.rollback()
+            return True
+        except psycopg2.Error as error:
+            logger.warning("Discarding broken Redshift connection: %s", error)
+            return False
+
+    def _prune_idle(self) -> None:
+        #Must be called holding the lock. Oldest connections sit at the bottom of the stack
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.pop(0)
+            self._close(connection)
+
+    @staticmethod
+    def _close(connection: extensions.connection) -> None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self, timeout: Union[float, None] = None) -> extensions.connection:
+        """
+        Borrow a connection from the pool, opening a new one if none is idle and the pool is not full.
+
+        Parameters:
+            timeout (float, optional): Seconds to wait for a free connection. Waits forever if None.
+
+        Returns:
+            connection: An open psycopg2 connection with no transaction in progress.
+
+        Raises:
+            TimeoutError: If no connection became available within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        connection, last_used = None, 0.0
+        with self._cond:
+            while True:
+                self._prune_idle()
+                if self._idle or self._in_use < self.max_size:
+                    if self._idle:
+                        connection, last_used = self._idle.pop()
+                    self._in_use += 1 #The slot is taken before the lock is released
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('Timed out waiting for a Redshift connection')
+                self._cond.wait(remaining)
+
+        try:
+            while connection is not None: #Probed without the lock, so a slow SELECT 1 does not block other threads
+                if self._is_healthy(connection, last_used):
+                    return connection
+                self._close(connection) #Try the next idle one, or reconnect below
+                with self._cond:
+                    connection, last_used = self._idle.pop() if self._idle else (None, 0.0)
+            return self._connect()
+        except Exception:
+            if connection is not None:
+                self._close(connection)
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection: extensions.connection, discard: bool = False) -> None:
+        """
+        Return a borrowed connection to the pool.
+
+        Parameters:
+            connection: The connection obtained from acquire.
+            discard (bool): Close the connection instead of keeping it for reuse.
+        """
+        if not discard and not connection.closed:
+            try:
+                if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback() #Never hand out a connection with a pending transaction
+            except psycopg2.Error:
+                discard = True
+        if discard or connection.closed:
+            self._close(connection)
+        with self._cond:
+            self._in_use -= 1
+            if not discard and not connection.closed:
+                self._idle.append((connection, time.monotonic()))
+            self._prune_idle()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[extensions.connection]:
+        """
+        Context manager that borrows a connection and always gives it back.
+
+        Any uncommitted work is rolled back on exit. Connections that failed at the network level
+        are discarded so the next borrower gets a fresh one.
+        """
+        connection = self.acquire()
+        discard = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(connection, discard=discard)
+
+    def close_all(self) -> None:
+        """
+        Close every idle connection. Borrowed connections are closed when they are released.
+        """
+        with self._cond:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._close(connection)
+
+
+_pools: Dict[Tuple, RedshiftConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(config_params: Dict[str, Union[str, int]]) -> RedshiftConnectionPool:
+    """
+    Return the process-wide connection pool for the given Redshift parameters, creating it on first use.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters as returned by
+            get_rs_config_params. The optional pool_max_size, pool_idle_timeout and
+            pool_health_check_interval keys size the pool.
+
+    Returns:
+        RedshiftConnectionPool: The shared pool for that cluster, database and user.
+    """
+    pool_key = (config_params['host'], config_params['port'], config_params['dbname'], config_params['user'])
+    with _pools_lock:
+        pool = _pools.get(pool_key)
+        if pool is None:
+            pool = RedshiftConnectionPool(
+                config_params,
+                max_size=config_params.get('pool_max_size', 4),
+                idle_timeout=config_params.get('pool_idle_timeout', 300),
+                health_check_interval=config_params.get('pool_health_check_interval', 30)
+            )
+            _pools[pool_key] = pool
+        return pool
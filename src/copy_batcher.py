@@ -0,0 +1,229 @@
+import time
+import uuid
+import itertools
+import yaml
+import threading
+import logging
+from redshift_loader import copy_data_from_s3_to_redshift
+from s3_preproc import save_manifest_to_s3
+from metrics import FileTrace
+from ingestion_ledger import LedgerEntry, AlreadyLoaded
+from staging_cleaner import delete_when_loaded, discard_staged
+from failure_policy import classify, FATAL
+from typing import Dict, Union, List, Tuple, Optional, Callable, NamedTuple
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_batch_config_params() -> Dict[str, Union[bool, int]]:
+    """
+    Load the COPY batching parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with batching parameters:
+            - enabled (bool): Whether staged files are coalesced before the COPY.
+            - max_files (int): Flush a table once this many files are pending.
+            - max_bytes (int): Flush a table once its pending files add up to this many bytes.
+            - max_wait_seconds (int): Flush a table once its oldest pending file waited this long.
+            - manifest_prefix (str): Folder in the bucket where COPY manifests are written.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    batching = config.get('Batching', {})
+    return {
+        'enabled': batching.get('enabled', False),
+        'max_files': batching.get('max_files', 50),
+        'max_bytes': batching.get('max_bytes', 128 * 1024 * 1024),
+        'max_wait_seconds': batching.get('max_wait_seconds', 30),
+        'manifest_prefix': batching.get('manifest_prefix', 'Tmp/manifests/')
+    }
+
+class StagedFile(NamedTuple):
+    """
+    A file already staged in S3 and waiting to be copied.
+
+    Attributes:
+        s3_path (str): Full S3 path of the staged file.
+        size (int): Size of the staged file in bytes.
+        staging_format (str): Format of the staged file: csv, csv_gzip, csv_zstd or parquet.
+        columns (Tuple[str, ...], optional): Target columns in file order.
+        on_commit (callable, optional): Called once the file has been committed to Redshift.
+        on_error (callable, optional): Called with the exception if the file could not be loaded.
+        trace (FileTrace, optional): Receives the time of every COPY attempt that included the file.
+        ledger_entry (LedgerEntry, optional): Written to the ingestion ledger by the COPY transaction.
+        parts (Tuple[Tuple[str, int], ...]): (S3 path, size) of every object of a split staged file,
+            empty if the file is the single object at s3_path.
+    """
+    s3_path: str
+    size: int
+    staging_format: str = 'csv'
+    columns: Optional[Tuple[str, ...]] = None
+    on_commit: Optional[Callable[[], None]] = None
+    on_error: Optional[Callable[[Exception], None]] = None
+    trace: Optional[FileTrace] = None
+    ledger_entry: Optional[LedgerEntry] = None
+    parts: Tuple[Tuple[str, int], ...] = ()
+
+    def entries(self) -> List[Tuple[str, int]]:
+        """
+        (S3 path, size) of every object the COPY has to load.
+        """
+        return list(self.parts) if self.parts else [(self.s3_path, self.size)]
+
+class CopyBatcher:
+    """
+    Coalesce staged files per target table and load each group with a single manifest COPY.
+
+    A table is flushed when its pending files reach max_files or max_bytes, or when the oldest one
+    has waited max_wait_seconds (checked by flush_due). Files of a flushed batch that differ in format
+    or column layout are loaded with separate COPY commands. If a batch COPY fails the batch is split
+    in half and each half retried, so one bad file only fails itself.
+
+    Parameters:
+        rs_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        max_files (int): File count threshold per table.
+        max_bytes (int): Size threshold per table in bytes.
+        max_wait_seconds (float): Age threshold of the oldest pending file.
+        manifest_prefix (str): Folder in the bucket where COPY manifests are written.
+    """
+
+    def __init__(self,
+                 rs_config: Dict[str, Union[str, int]],
+                 max_files: int = 50,
+                 max_bytes: int = 128 * 1024 * 1024,
+                 max_wait_seconds: float = 30,
+                 manifest_prefix: str = 'Tmp/manifests/'
+                 ) -> None:
+        self.rs_config = rs_config
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_wait_seconds = max_wait_seconds
+        self.manifest_prefix = manifest_prefix
+        self._pending: Dict[str, List[StagedFile]] = {}
+        self._first_added: Dict[str, float] = {}
+        self._table_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def add(self, table_name: str, staged_file: StagedFile) -> None:
+        """
+        Queue a staged file for its table and flush the table if a size or count threshold is hit.
+
+        Parameters:
+            table_name (str): The destination table in Redshift.
+            staged_file (StagedFile): The file to load.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(table_name, [])
+            if not pending:
+                self._first_added[table_name] = time.monotonic()
+            pending.append(staged_file)
+            full = len(pending) >= self.max_files or sum(f.size for f in pending) >= self.max_bytes
+
+        if full:
+            self._flush_table(table_name)
+
+    def flush_due(self) -> None:
+        """
+        Flush every table whose oldest pending file has waited at least max_wait_seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [table for table, added in self._first_added.items() if now - added >= self.max_wait_seconds]
+
+        for table_name in due:
+            self._flush_table(table_name)
+
+    def flush(self) -> None:
+        """
+        Flush every pending file regardless of thresholds.
+        """
+        with self._lock:
+            tables = list(self._pending)
+
+        for table_name in tables:
+            self._flush_table(table_name)
+
+    def _flush_table(self, table_name: str) -> None:
+        #The per table lock is held from taking the batch until its COPY ends, so batches of the
+        #same table are loaded in the order their files were added
+        with self._lock:
+            table_lock = self._table_locks.setdefault(table_name, threading.Lock())
+        with table_lock:
+            with self._lock:
+                self._first_added.pop(table_name, None)
+                batch = self._pending.pop(table_name, [])
+            if table_name in self.rs_config.get('merge', {}):
+                #A later file must win over an earlier one with the same keys, so merges go one file at a time
+                for staged_file in batch:
+                    self._copy_batch(table_name, [staged_file])
+                return
+            for _, group in itertools.groupby(batch, key=lambda f: (f.staging_format, f.columns)):
+                self._copy_batch(table_name, list(group)) #Consecutive runs keep the arrival order
+
+    def _copy_batch(self, table_name: str, batch: List[StagedFile]) -> None:
+        if not batch:
+            return
+        start = time.perf_counter()
+        ledger_entries = [f.ledger_entry for f in batch if f.ledger_entry is not None] or None
+        entries = [entry for staged_file in batch for entry in staged_file.entries()]
+        staged = [s3_path for s3_path, _ in entries] #Deleted once the COPY committed
+        try:
+            staging_format, columns = batch[0].staging_format, batch[0].columns
+            if len(entries) == 1:
+                copy_data_from_s3_to_redshift(self.rs_config, batch[0].s3_path, table_name,
+                                              staging_format=staging_format, columns=columns,
+                                              ledger_entries=ledger_entries)
+            else:
+                bucket = batch[0].s3_path[len('s3://'):].split('/', 1)[0]
+                manifest_key = f"{self.manifest_prefix}{table_name}-{uuid.uuid4().hex}.manifest"
+                save_manifest_to_s3(entries, bucket, manifest_key)
+                staged.append(f"s3://{bucket}/{manifest_key}")
+                copy_data_from_s3_to_redshift(self.rs_config, f"s3://{bucket}/{manifest_key}", table_name,
+                                              manifest=True, staging_format=staging_format, columns=columns,
+                                              ledger_entries=ledger_entries)
+        except Exception as error:
+            self._record_copy(batch, time.perf_counter() - start, committed=False)
+            if len(batch) == 1 and isinstance(error, AlreadyLoaded):
+                delete_when_loaded(staged)
+                if batch[0].trace is not None:
+                    batch[0].trace.finish('duplicate')
+                if batch[0].on_commit is not None:
+                    batch[0].on_commit() #Loaded earlier, the message can be acknowledged
+                return
+            if len(batch) == 1:
+                logger.error("Error loading %s into %s: %s", batch[0].s3_path, table_name, error)
+                discard_staged(staged) #A redelivery stages the file again under new keys
+                if batch[0].on_error is not None:
+                    batch[0].on_error(error)
+                return
+            if classify(error) != FATAL:
+                #Redshift or S3 failed, not one of the files: splitting the batch would only fail again
+                logger.error("Batch of %d files for %s failed: %s", len(batch), table_name, error)
+                discard_staged(staged)
+                for staged_file in batch:
+                    if staged_file.on_error is not None:
+                        staged_file.on_error(error)
+                return
+            logger.warning("Batch of %d files for %s failed, retrying in halves: %s", len(batch), table_name, error)
+            discard_staged(staged[len(entries):]) #The manifest, the halves write their own
+            middle = len(batch) // 2
+            self._copy_batch(table_name, batch[:middle])
+            self._copy_batch(table_name, batch[middle:])
+            return
+
+        self._record_copy(batch, time.perf_counter() - start, committed=True)
+        delete_when_loaded(staged)
+        logger.info(f'Loaded {len(batch)} files into {table_name}')
+        for staged_file in batch:
+            if staged_file.on_commit is not None:
+                staged_file.on_commit()
+
+    @staticmethod
+    def _record_copy(batch: List[StagedFile], seconds: float, committed: bool) -> None:
+        #Every file of a batch is charged the whole COPY, that is the latency it saw
+        for staged_file in batch:
+            if staged_file.trace is not None:
+                rows = staged_file.trace.rows if committed else 0
+                nbytes = staged_file.size if committed else 0
+                staged_file.trace.record('copy_data_from_s3_to_redshift', seconds, rows, nbytes)
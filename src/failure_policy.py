@@ -0,0 +1,354 @@
+import json
+import time
+import yaml
+import random
+import datetime
+import threading
+import traceback
+import psycopg2
+from functools import lru_cache, wraps
+from concurrent.futures.process import BrokenProcessPool
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from typing import Dict, Union, Optional, Callable, Any
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Classes of failures: worth retrying soon, Redshift unreachable (retried once it is back, never
+# blamed on the file), or caused by the file itself (retrying gives the same result)
+RETRYABLE = 'retryable'
+UNAVAILABLE = 'unavailable'
+FATAL = 'fatal'
+
+# Error codes S3 (and other AWS services) return when the request may succeed if sent again
+RETRYABLE_AWS_CODES = {'Throttling', 'ThrottlingException', 'SlowDown', 'RequestTimeout', 'RequestTimeoutException',
+                       'RequestLimitExceeded', 'ProvisionedThroughputExceededException', 'InternalError',
+                       'ServiceUnavailable', 'TooManyRequestsException'}
+
+def get_failure_config_params() -> Dict[str, Union[bool, int, float, str]]:
+    """
+    Load the failure handling parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with failure parameters:
+            - enabled (bool): Whether failed files are retried, dead-lettered and Redshift guarded by
+              the circuit breaker. Otherwise failed files are released for redelivery right away.
+            - max_attempts (int): Attempts of a file preparation or COPY within the same delivery.
+            - base_delay (float): Seconds before the first retry, doubled on every attempt.
+            - max_delay (float): Longest wait between two attempts.
+            - max_receives (int): Deliveries of a file failing with retryable errors before it is dead-lettered.
+            - redelivery_delay (float): Seconds before the first redelivery of a failed file, doubled on every delivery.
+            - redelivery_max_delay (float): Longest wait before a redelivery (SQS allows up to 12 h).
+            - dead_letter_prefix (str): Folder in the bucket that receives the files that cannot be loaded.
+            - breaker_threshold (int): Consecutive Redshift connection failures that open the circuit breaker.
+            - breaker_reset_seconds (float): Seconds the breaker stays open before a call probes Redshift again.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    failures = config.get('Failures', {})
+    return {
+        'enabled': failures.get('enabled', False),
+        'max_attempts': max(failures.get('max_attempts', 3), 1),
+        'base_delay': failures.get('base_delay', 0.5),
+        'max_delay': failures.get('max_delay', 30),
+        'max_receives': failures.get('max_receives', 5),
+        'redelivery_delay': failures.get('redelivery_delay', 30),
+        'redelivery_max_delay': min(failures.get('redelivery_max_delay', 900), 43200),
+        'dead_letter_prefix': failures.get('dead_letter_prefix', 'DeadLetter/'),
+        'breaker_threshold': failures.get('breaker_threshold', 5),
+        'breaker_reset_seconds': failures.get('breaker_reset_seconds', 30)
+    }
+
+@lru_cache(maxsize=1)
+def _default_config_params() -> Dict[str, Union[bool, int, float, str]]:
+    return get_failure_config_params()
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling Redshift while the circuit breaker is open.
+    """
+
+def classify(error: BaseException) -> str:
+    """
+    Class of a failure: RETRYABLE, UNAVAILABLE or FATAL.
+
+    Connection errors and the SQLSTATE classes 08 (connection), 53 (insufficient resources) and 57
+    (operator intervention, e.g. a cluster restart) mean Redshift is unavailable. Transaction
+    rollbacks (40, serialization conflicts and deadlocks), S3 throttling, 5xx responses, network
+    errors and crashed worker processes are retryable. Everything else, e.g. a file that cannot be
+    parsed, a COPY rejected by stl_load_errors, a missing object or access denied, is fatal.
+    """
+    if isinstance(error, CircuitOpen):
+        return UNAVAILABLE
+    if isinstance(error, psycopg2.Error):
+        code = error.pgcode or ''
+        if code.startswith('40'):
+            return RETRYABLE
+        if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)) or code[:2] in ('08', '53', '57'):
+            return UNAVAILABLE
+        if isinstance(error, psycopg2.InternalError) and 'stl_load_errors' not in str(error):
+            return RETRYABLE #Internal errors other than rejected rows, e.g. a node failing mid query
+        return FATAL
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return RETRYABLE if code in RETRYABLE_AWS_CODES or status >= 500 else FATAL
+    if isinstance(error, (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError, BrokenProcessPool)):
+        return RETRYABLE
+    return FATAL
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with full jitter: a random wait between 0 and base_delay * 2**(attempt - 1),
+    capped at max_delay, so consumers that failed together do not retry together.
+
+    Parameters:
+        attempt (int): Number of attempts that failed so far, starting at 1.
+        base_delay (float): Upper bound of the first wait.
+        max_delay (float): Cap of the upper bound.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+def call_with_retries(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Call func, retrying retryable failures and Redshift connection failures with jittered exponential
+    backoff, up to Failures.max_attempts attempts. Fatal errors, CircuitOpen and the error of the
+    last attempt are raised. func is called once if failure handling is disabled.
+    """
+    config = _default_config_params()
+    attempts = config['max_attempts'] if config['enabled'] else 1
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if attempt == attempts or isinstance(error, CircuitOpen) or classify(error) == FATAL:
+                raise error
+            delay = backoff_delay(attempt, config['base_delay'], config['max_delay'])
+            logger.warning("Attempt %d of %s failed, retrying in %.2f s: %s", attempt, getattr(func, '__name__', func), delay, error)
+            time.sleep(delay)
+
+class CircuitBreaker:
+    """
+    Stops calls to Redshift while it is unavailable, so files fail fast instead of each waiting on
+    connection timeouts, and the consumer stops taking messages until it is back.
+
+    The breaker opens after threshold consecutive calls fail with UNAVAILABLE errors. While open,
+    calls raise CircuitOpen. Once reset_seconds have passed a single call is let through as a probe:
+    if it succeeds the breaker closes, otherwise it stays open for another reset_seconds. Any other
+    outcome, including a fatal error, shows Redshift is answering and resets the failure count.
+
+    Parameters:
+        threshold (int): Consecutive UNAVAILABLE failures that open the breaker.
+        reset_seconds (float): Seconds the breaker stays open before the probe.
+    """
+
+    def __init__(self, threshold: int = 5, reset_seconds: float = 30) -> None:
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._cond = threading.Condition()
+
+    @property
+    def is_open(self) -> bool:
+        with self._cond:
+            return self._opened_at is not None
+
+    def _allows(self) -> bool:
+        #Must be called holding the lock
+        if self._opened_at is None:
+            return True
+        return not self._probing and time.monotonic() - self._opened_at >= self.reset_seconds
+
+    def before_call(self) -> None:
+        """
+        Raise CircuitOpen unless the call may go ahead. The first call after the reset time is the probe.
+        """
+        with self._cond:
+            if not self._allows():
+                raise CircuitOpen(f'Redshift circuit breaker open after {self._failures} connection failures')
+            if self._opened_at is not None:
+                self._probing = True
+
+    def record(self, error: Optional[Exception] = None) -> None:
+        """
+        Record the outcome of a call: None if it succeeded, otherwise the exception it raised.
+        """
+        with self._cond:
+            if error is not None and isinstance(error, CircuitOpen):
+                return
+            if error is not None and classify(error) == UNAVAILABLE:
+                self._failures += 1
+                if self._probing or self._failures >= self.threshold:
+                    if self._opened_at is None:
+                        logger.error("Redshift unavailable after %d failures, pausing for %s s: %s",
+                                     self._failures, self.reset_seconds, error)
+                    self._opened_at = time.monotonic()
+                self._probing = False
+                return
+            if self._opened_at is not None:
+                logger.info("Redshift available again, closing the circuit breaker")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._cond.notify_all()
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Call func through the breaker.
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as error:
+            self.record(error)
+            raise error
+        self.record()
+        return result
+
+    def wait_until_closed(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block while the breaker is open and its probe is not due. The reset time is only checked again
+        when the timeout expires, so callers should pass a short one and call again.
+
+        Returns:
+            bool: True if calls may go ahead.
+        """
+        with self._cond:
+            return self._cond.wait_for(self._allows, timeout)
+
+_breaker: Optional[CircuitBreaker] = None
+_breaker_lock = threading.Lock()
+
+def get_breaker() -> Optional[CircuitBreaker]:
+    """
+    The circuit breaker of the Redshift calls, shared by every thread of the process. None if failure handling is disabled.
+    """
+    global _breaker
+    config = _default_config_params()
+    if not config['enabled']:
+        return None
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(config['breaker_threshold'], config['breaker_reset_seconds'])
+        return _breaker
+
+def call_redshift(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Call func through the circuit breaker, with retries, see call_with_retries and CircuitBreaker.
+    """
+    breaker = get_breaker()
+    if breaker is None:
+        return func(*args, **kwargs)
+
+    @wraps(func)
+    def guarded() -> Any:
+        return breaker.call(func, *args, **kwargs)
+    return call_with_retries(guarded)
+
+def dead_letter(bucket: str,
+                key: str,
+                error: Exception,
+                deliveries: int = 1,
+                prefix: Optional[str] = None,
+                raw_key: bool = False
+                ) -> str:
+    """
+    Copy a file that cannot be loaded under the dead-letter prefix, next to a JSON document with the
+    error context. The uploaded file is left where it is. Files fixed in place or under the prefix
+    can be loaded again with the backfill CLI.
+
+    Parameters:
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file, as the S3 event gives it.
+        error (Exception): The last failure of the file.
+        deliveries (int): Number of times the file was delivered.
+        prefix (str, optional): Dead-letter folder, Failures.dead_letter_prefix if None.
+        raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+
+    Returns:
+        str: Key of the dead-lettered copy.
+    """
+    from s3_preproc import s3, object_key #Imported on first use, the Redshift loader imports this module
+    source_key = object_key(key, raw_key)
+    dead_letter_key = f"{prefix or _default_config_params()['dead_letter_prefix']}{source_key}"
+    context = {
+        'bucket': bucket,
+        'key': source_key,
+        'dead_letter_key': dead_letter_key,
+        'classification': classify(error),
+        'error_type': type(error).__name__,
+        'error': str(error),
+        'traceback': traceback.format_exception(type(error), error, error.__traceback__),
+        'deliveries': deliveries,
+        'failed_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    try:
+        s3.copy({'Bucket': bucket, 'Key': source_key}, bucket, dead_letter_key) #Managed copy, also for objects over 5 GB
+    except Exception as copy_error:
+        logger.error("Could not copy %s to the dead-letter prefix: %s", source_key, copy_error)
+        context['copy_error'] = f'{type(copy_error).__name__}: {copy_error}'
+    s3.put_object(Bucket=bucket, Key=f'{dead_letter_key}.error.json', Body=json.dumps(context, indent=2).encode('utf-8'),
+                  ContentType='application/json')
+    logger.error(f'File {source_key} dead-lettered to s3://{bucket}/{dead_letter_key}: {type(error).__name__}: {error}')
+    return dead_letter_key
+
+def handle_failure(bucket: str, key: str, error: Exception, deliveries: int = 1, raw_key: bool = False) -> Optional[float]:
+    """
+    Decide what becomes of a file that failed: dead-lettered if the error is fatal or it kept failing
+    with retryable errors for max_receives deliveries, otherwise delivered again after a jittered
+    backoff. Files that failed because Redshift is unavailable are never dead-lettered.
+
+    Parameters:
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        error (Exception): The failure.
+        deliveries (int): Number of times the file was delivered, this delivery included.
+        raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+
+    Returns:
+        Optional[float]: Seconds before the file is delivered again, None if it was dead-lettered
+            and needs no redelivery.
+    """
+    config = _default_config_params()
+    kind = classify(error)
+    if kind == FATAL or (kind == RETRYABLE and deliveries >= config['max_receives']):
+        try:
+            dead_letter(bucket, key, error, deliveries, config['dead_letter_prefix'], raw_key)
+            return None
+        except Exception as dead_letter_error:
+            logger.error("Could not dead-letter %s, leaving it for redelivery: %s", key, dead_letter_error)
+    return backoff_delay(deliveries, config['redelivery_delay'], config['redelivery_max_delay'])
+
+def failure_callback(bucket: str,
+                     key: str,
+                     deliveries: int,
+                     dead_lettered: Callable[[], None],
+                     redeliver: Callable[..., None],
+                     raw_key: bool = False
+                     ) -> Callable[[Exception], None]:
+    """
+    on_error callback of a file, see handle_failure. If failure handling is disabled every failure is redelivered.
+
+    Parameters:
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        deliveries (int): Number of times the file was delivered, this delivery included.
+        dead_lettered (callable): Called once the file is dead-lettered, e.g. SqsMessage.file_done.
+        redeliver (callable): Called with the exception and the delay in seconds (None for the
+            default) if the file must be delivered again, e.g. SqsMessage.file_failed.
+        raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+    """
+    def on_error(error: Exception) -> None:
+        if not _default_config_params()['enabled']:
+            redeliver(error, None)
+            return
+        delay = handle_failure(bucket, key, error, deliveries, raw_key)
+        if delay is None:
+            dead_lettered()
+        else:
+            redeliver(error, delay)
+    return on_error
@@ -0,0 +1,327 @@
+import yaml
+import queue
+import itertools
+import threading
+import logging
+from contextlib import contextmanager
+from concurrent.futures import Future
+from pipeline import prepare_file, load_prepared_file
+from table_router import route_file
+from s3_preproc import object_size
+from copy_batcher import CopyBatcher
+from failure_policy import call_with_retries
+from typing import Dict, Union, Optional, Iterator, Callable, Tuple
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_concurrency_config_params() -> Dict[str, Union[bool, int]]:
+    """
+    Load the concurrent processing parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with concurrency parameters:
+            - enabled (bool): Whether files are processed by a worker pool.
+            - workers (int): Number of files processed at the same time. With Scheduling enabled
+              the workers of every lane are set there instead.
+            - max_in_flight (int): Files accepted before the consumer stops polling SQS.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    concurrency = config.get('Concurrency', {})
+    workers = concurrency.get('workers', 4)
+    return {
+        'enabled': concurrency.get('enabled', False),
+        'workers': workers,
+        'max_in_flight': concurrency.get('max_in_flight', 2 * workers)
+    }
+
+SMALL_LANE = 'small'
+LARGE_LANE = 'large'
+OVERSIZED_LANE = 'oversized'
+
+def get_scheduling_config_params() -> Dict[str, Union[bool, int, Dict]]:
+    """
+    Load the size and priority scheduling parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with scheduling parameters:
+            - enabled (bool): Whether files are split in lanes by size. Otherwise every file goes
+              through a single lane of Concurrency.workers threads in arrival order.
+            - large_size (int): Files of at least this many bytes go to the large lane.
+            - oversized_size (int): Files of at least this many bytes go to a lane of their own,
+              0 to keep them in the large lane.
+            - workers (dict): Worker threads per lane: small, large and oversized.
+            - table_lanes (dict): Lane of every file of a table, whatever its size.
+            - priorities (dict): Priority of the files of a table within their lane, higher first (default 0).
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    scheduling = config.get('Scheduling', {})
+    workers = scheduling.get('workers', {}) or {}
+    return {
+        'enabled': scheduling.get('enabled', False),
+        'large_size': scheduling.get('large_size', 64 * 1024 * 1024),
+        'oversized_size': scheduling.get('oversized_size', 0) or 0,
+        'workers': {
+            SMALL_LANE: workers.get(SMALL_LANE, 4),
+            LARGE_LANE: workers.get(LARGE_LANE, 1),
+            OVERSIZED_LANE: workers.get(OVERSIZED_LANE, 1)
+        },
+        'table_lanes': scheduling.get('table_lanes', {}) or {},
+        'priorities': scheduling.get('priorities', {}) or {}
+    }
+
+class FileLane:
+    """
+    Worker threads with their own queue, so files of one lane never wait behind files of another.
+    Queued files start by priority, higher first, then in submission order.
+
+    Parameters:
+        name (str): Lane name, also the prefix of its thread names.
+        workers (int): Number of worker threads.
+    """
+
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self._queue: 'queue.PriorityQueue[Tuple[int, int, Optional[Callable[[], None]]]]' = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._threads = [threading.Thread(target=self._run, name=f'{name}-worker-{index}', daemon=True)
+                         for index in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, work: Callable[[], None], priority: int = 0) -> None:
+        """
+        Queue a file, work runs it.
+        """
+        self._queue.put((-priority, next(self._order), work))
+
+    def _run(self) -> None:
+        while True:
+            _, _, work = self._queue.get()
+            if work is None:
+                return
+            work()
+
+    def shutdown(self) -> None:
+        """
+        Run the queued files and stop the worker threads.
+        """
+        for _ in self._threads:
+            self._queue.put((2**31, next(self._order), None)) #Sorts after every queued file
+        for thread in self._threads:
+            thread.join()
+
+class TableSequencer:
+    """
+    Hands out numbered turns per table, so work on the same table runs in arrival order while work
+    on different tables runs freely in parallel.
+    """
+
+    def __init__(self) -> None:
+        self._issued: Dict[Optional[str], int] = {}
+        self._serving: Dict[Optional[str], int] = {}
+        self._cond = threading.Condition()
+
+    def ticket(self, table_name: Optional[str]) -> int:
+        """
+        Take the next place in line for a table.
+        """
+        with self._cond:
+            ticket = self._issued.get(table_name, 0)
+            self._issued[table_name] = ticket + 1
+            return ticket
+
+    @contextmanager
+    def turn(self, table_name: Optional[str], ticket: int) -> Iterator[None]:
+        """
+        Wait until every earlier ticket of the table is done, then hold the turn for the block.
+        The turn is always passed on, even if the block raises.
+        """
+        with self._cond:
+            while self._serving.get(table_name, 0) != ticket:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._serving[table_name] = ticket + 1
+                self._cond.notify_all()
+
+class ConcurrentFileProcessor:
+    """
+    Worker pool that runs the ETL of several files at once.
+
+    Download, parsing, formatting and staging run in parallel across files. The COPY (or the hand
+    over to the batcher) of files that go to the same table happens in the order the files were
+    submitted. At most max_in_flight files are accepted at a time; wait_for_capacity lets the SQS
+    consumer stop polling while the workers are saturated.
+
+    With a scheduling configuration, files are classified by the size announced in their S3 event
+    and by their table into lanes with their own workers: a 2 GB workbook keeps a large lane worker
+    busy while small files go on through the small lane. Order per table is kept within a lane, so
+    files of a table that land in different lanes may be loaded out of arrival order.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        workers (int): Number of worker threads, when files are not scheduled in lanes.
+        max_in_flight (int, optional): Maximum number of submitted and unfinished files.
+            Defaults to twice the number of workers.
+        batcher (CopyBatcher, optional): Batched COPY stage shared by all workers.
+        preproc_config (dict, optional): Preprocessing parameters from get_preproc_config_params.
+        scheduling_config (dict, optional): Lanes from get_scheduling_config_params, used if enabled.
+    """
+
+    def __init__(self,
+                 redshift_config: Dict[str, Union[str, int]],
+                 workers: int = 4,
+                 max_in_flight: Optional[int] = None,
+                 batcher: Optional[CopyBatcher] = None,
+                 preproc_config: Optional[Dict[str, Union[bool, int, str]]] = None,
+                 scheduling_config: Optional[Dict[str, Union[bool, int, Dict]]] = None
+                 ) -> None:
+        self.redshift_config = redshift_config
+        self.batcher = batcher
+        self.preproc_config = preproc_config
+        self.scheduling = scheduling_config if scheduling_config and scheduling_config['enabled'] else None
+        self.sequencer = TableSequencer()
+        if self.scheduling is None:
+            lane_workers = {SMALL_LANE: workers}
+        else:
+            lane_workers = {lane: count for lane, count in self.scheduling['workers'].items()
+                            if lane != OVERSIZED_LANE or self.scheduling['oversized_size']}
+        self.lanes = {lane: FileLane(lane, count) for lane, count in lane_workers.items()}
+        self.max_in_flight = max_in_flight or 2 * sum(lane_workers.values())
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def lane_for(self, bucket: str, key: str, table_name: Optional[str], size: Optional[int], raw_key: bool = False) -> str:
+        """
+        Lane of a file: the one configured for its table, otherwise the one for its size. The size
+        comes from the S3 event, or from a HEAD request if the event did not carry it.
+        """
+        if self.scheduling is None:
+            return SMALL_LANE
+        lane = self.scheduling['table_lanes'].get(table_name)
+        if lane in self.lanes:
+            return lane
+        if size is None:
+            try:
+                size = object_size(bucket, key, raw_key)
+            except Exception as error:
+                logger.warning("Could not read the size of %s, scheduling it as a small file: %s", key, error)
+                size = 0
+        if OVERSIZED_LANE in self.lanes and size >= self.scheduling['oversized_size']:
+            return OVERSIZED_LANE
+        return LARGE_LANE if size >= self.scheduling['large_size'] else SMALL_LANE
+
+    def wait_for_capacity(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until fewer than max_in_flight files are being processed.
+
+        Parameters:
+            timeout (float, optional): Seconds to wait. Waits forever if None.
+
+        Returns:
+            bool: True if there is capacity, False if the timeout expired.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight < self.max_in_flight, timeout)
+
+    def submit(self,
+               bucket: str,
+               key: str,
+               on_commit: Optional[Callable[[], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None,
+               size: Optional[int] = None,
+               raw_key: bool = False
+               ) -> Future:
+        """
+        Queue an uploaded file for processing.
+
+        Parameters:
+            bucket (str): The S3 bucket of the uploaded file.
+            key (str): The key of the uploaded file.
+            on_commit (callable, optional): Called once the file is loaded or found not compatible.
+            on_error (callable, optional): Called with the exception if the file could not be loaded.
+            size (int, optional): Size in bytes from the S3 event, used to choose the lane.
+            raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+
+        Returns:
+            Future: Resolves once the file has been handed to the COPY stage or discarded.
+        """
+        filename = key.split('/')[-1]
+        try:
+            table_name = route_file(self.redshift_config, filename)
+        except Exception as error: #e.g. the catalog refresh failed, the worker routes the file again
+            logger.warning("Could not route %s, scheduling it without a table: %s", key, error)
+            table_name = None
+        lane = self.lane_for(bucket, key, table_name, size, raw_key)
+        ticket = self.sequencer.ticket((lane, table_name))
+        priority = self.scheduling['priorities'].get(table_name, 0) if self.scheduling else 0
+        with self._cond:
+            self._in_flight += 1
+        future: Future = Future()
+
+        def work() -> None:
+            future.set_running_or_notify_cancel()
+            try:
+                self._run(bucket, key, (lane, table_name), ticket, on_commit, on_error, raw_key)
+            except Exception as error: #e.g. raised by a callback, the lane thread must survive it
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+        self.lanes[lane].submit(work, priority)
+        return future
+
+    def _run(self,
+             bucket: str,
+             key: str,
+             sequence: Tuple[str, Optional[str]],
+             ticket: int,
+             on_commit: Optional[Callable[[], None]],
+             on_error: Optional[Callable[[Exception], None]],
+             raw_key: bool = False
+             ) -> None:
+        prepared = None
+        failure = None
+        try:
+            try:
+                prepared = call_with_retries(prepare_file, self.redshift_config, bucket, key, self.preproc_config, raw_key)
+            except Exception as error:
+                logger.error("Error preparing file %s: %s", key, error)
+                failure = error
+
+            with self.sequencer.turn(sequence, ticket): #Keep per table order for the COPY, within the lane
+                if prepared is not None:
+                    load_prepared_file(self.redshift_config, bucket, prepared, self.batcher, on_commit, on_error)
+                elif failure is None and on_commit is not None:
+                    on_commit() #Not compatible, nothing to load
+        except Exception as error:
+            logger.error("Error loading file %s: %s", key, error)
+            failure = error
+        finally:
+            if failure is not None and on_error is not None:
+                on_error(failure)
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def drain(self) -> None:
+        """
+        Block until every submitted file has been processed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight == 0)
+
+    def shutdown(self) -> None:
+        """
+        Finish the submitted files and stop the worker threads.
+        """
+        for lane in self.lanes.values():
+            lane.shutdown()
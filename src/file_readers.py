@@ -0,0 +1,212 @@
+import importlib.util
+import pandas as pd
+from io import BytesIO, RawIOBase
+from typing import Dict, List, Union, Optional, Iterator, Callable, IO, Tuple
+from frame_dtypes import FrameDtypes, parser_dtypes, compact
+
+SheetSelector = Union[int, str, List[Union[int, str]]]
+
+HEADER_PEEK_SIZE = 64 * 1024 #Bytes read ahead to find the header of a CSV stream
+
+def calamine_available() -> bool:
+    """
+    Whether the Rust based calamine Excel engine (python-calamine) is installed.
+    """
+    return importlib.util.find_spec('python_calamine') is not None
+
+def _sheets(sheet_name: SheetSelector) -> List[Union[int, str]]:
+    return list(sheet_name) if isinstance(sheet_name, (list, tuple)) else [sheet_name]
+
+def _slices(df: pd.DataFrame, chunksize: Optional[int]) -> Iterator[pd.DataFrame]:
+    if chunksize is None or len(df) <= chunksize:
+        yield df
+        return
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize].reset_index(drop=True)
+
+class _Prefixed(RawIOBase):
+    #Read-only stream that returns the bytes already read from a stream, then the rest of it
+    def __init__(self, head: bytes, fileobj: IO) -> None:
+        super().__init__()
+        self._head = head
+        self._fileobj = fileobj
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._head:
+            data, self._head = self._head[:len(buffer)], self._head[len(buffer):]
+        else:
+            data = self._fileobj.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _peek_header(fileobj: IO) -> Tuple[List[str], IO]:
+    #Column names of a CSV stream, and a stream that still starts at the header
+    head = fileobj.read(HEADER_PEEK_SIZE)
+    while b'\n' not in head:
+        block = fileobj.read(HEADER_PEEK_SIZE)
+        if not block:
+            break
+        head += block
+    columns = list(pd.read_csv(BytesIO(head), nrows=0).columns) if head.strip() else []
+    return columns, _Prefixed(head, fileobj)
+
+def read_csv_chunks(fileobj: IO, chunksize: Optional[int] = None, dtypes: Optional[FrameDtypes] = None, **options) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV file as DataFrames of at most chunksize rows (a single DataFrame if chunksize is None).
+
+    Parameters:
+        fileobj: Binary file object, it does not need to be seekable.
+        chunksize (int, optional): Rows per DataFrame.
+        dtypes (FrameDtypes, optional): Compact dtypes of the target table. Text columns are parsed
+            straight into them, so no Python object is created per value, and numbers are narrowed.
+    """
+    parse_options = {}
+    if dtypes is not None:
+        columns, fileobj = _peek_header(fileobj)
+        parse_options['dtype'] = parser_dtypes(columns, dtypes)
+    if chunksize is None:
+        yield compact(pd.read_csv(fileobj, **parse_options), dtypes)
+    else:
+        for chunk in pd.read_csv(fileobj, chunksize=chunksize, **parse_options):
+            yield compact(chunk, dtypes)
+
+def read_excel_openpyxl_chunks(fileobj: IO, chunksize: Optional[int] = None, sheet_name: SheetSelector = 0) -> Iterator[pd.DataFrame]:
+    """
+    Read the selected sheets of an .xlsx workbook row by row with openpyxl in read-only mode, so
+    only one chunk of rows is materialized at a time. The first row of every sheet is the header.
+
+    Parameters:
+        fileobj: Seekable binary file object with the workbook.
+        chunksize (int, optional): Rows per DataFrame. A single DataFrame per sheet if None.
+        sheet_name (int, str or list): Sheet index, sheet name, or a list of them.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for sheet in _sheets(sheet_name):
+            worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+            rows = worksheet.iter_rows(values_only=True)
+            header = list(next(rows, None) or [])
+            while header and header[-1] is None:
+                header.pop() #Formatted but empty trailing cells
+            if not header:
+                continue
+            width = len(header)
+            padding = (None,) * width
+            batch = []
+            produced = False
+            for row in rows:
+                row = (row + padding)[:width]
+                if all(value is None for value in row):
+                    continue
+                batch.append(row)
+                if chunksize is not None and len(batch) >= chunksize:
+                    yield pd.DataFrame.from_records(batch, columns=header).infer_objects()
+                    produced = True
+                    batch = []
+            if batch or not produced:
+                #A sheet with a header and no rows is an empty DataFrame, like pd.read_excel gives
+                yield pd.DataFrame.from_records(batch, columns=header).infer_objects()
+    finally:
+        workbook.close()
+
+def read_excel_calamine_chunks(fileobj: IO, chunksize: Optional[int] = None, sheet_name: SheetSelector = 0) -> Iterator[pd.DataFrame]:
+    """
+    Read the selected sheets with the calamine engine. It parses a whole sheet at once, but an
+    order of magnitude faster than openpyxl, and also reads legacy .xls files.
+
+    Parameters:
+        fileobj: Seekable binary file object with the workbook.
+        chunksize (int, optional): Rows per DataFrame. A single DataFrame per sheet if None.
+        sheet_name (int, str or list): Sheet index, sheet name, or a list of them.
+    """
+    for sheet in _sheets(sheet_name):
+        fileobj.seek(0)
+        yield from _slices(pd.read_excel(fileobj, engine='calamine', sheet_name=sheet), chunksize)
+
+def _rewound(fileobj: IO) -> IO:
+    fileobj.seek(0)
+    return fileobj
+
+def read_excel_chunks(fileobj: IO,
+                      chunksize: Optional[int] = None,
+                      sheet_name: SheetSelector = 0,
+                      engine: str = 'auto',
+                      extension: str = 'xlsx',
+                      dtypes: Optional[FrameDtypes] = None
+                      ) -> Iterator[pd.DataFrame]:
+    """
+    Read an Excel workbook with the requested engine.
+
+    Parameters:
+        fileobj: Seekable binary file object with the workbook.
+        chunksize (int, optional): Rows per DataFrame.
+        sheet_name (int, str or list): Sheet index, sheet name, or a list of them.
+        engine (str): 'calamine', 'openpyxl' or 'auto' (calamine when installed, openpyxl otherwise).
+        extension (str): 'xlsx' or 'xls'. openpyxl cannot read .xls, those fall back to pandas' default.
+        dtypes (FrameDtypes, optional): Compact dtypes of the target table, applied to every chunk
+            as soon as it is parsed.
+    """
+    if engine == 'auto':
+        engine = 'calamine' if calamine_available() else 'openpyxl'
+    if engine == 'calamine':
+        chunks = read_excel_calamine_chunks(fileobj, chunksize, sheet_name)
+    elif extension == 'xls':
+        chunks = (chunk for sheet in _sheets(sheet_name)
+                  for chunk in _slices(pd.read_excel(_rewound(fileobj), sheet_name=sheet), chunksize))
+    else:
+        chunks = read_excel_openpyxl_chunks(fileobj, chunksize, sheet_name)
+    for chunk in chunks:
+        yield compact(chunk, dtypes)
+
+READERS: Dict[str, Callable[..., Iterator[pd.DataFrame]]] = {
+    'csv': read_csv_chunks,
+    'xlsx': lambda fileobj, chunksize=None, **options: read_excel_chunks(fileobj, chunksize, extension='xlsx', **options),
+    'xls': lambda fileobj, chunksize=None, **options: read_excel_chunks(fileobj, chunksize, extension='xls', **options)
+}
+
+# Formats that need random access to the file, so they are spooled before parsing -> s3_preproc.py
+SEEKABLE_FORMATS = {'xlsx', 'xls'}
+
+def register_reader(extension: str, reader: Callable[..., Iterator[pd.DataFrame]], seekable: bool = False) -> None:
+    """
+    Add or replace the reader used for a file extension.
+
+    Parameters:
+        extension (str): Lowercase extension without the dot, e.g. 'parquet'.
+        reader (callable): Function (fileobj, chunksize=None, **options) yielding DataFrames. The
+            options are sheet_name, engine and dtypes (FrameDtypes or None, see read_chunks).
+        seekable (bool): Whether the reader needs a seekable file object.
+    """
+    READERS[extension] = reader
+    if seekable:
+        SEEKABLE_FORMATS.add(extension)
+    else:
+        SEEKABLE_FORMATS.discard(extension)
+
+def read_chunks(fileobj: IO,
+                extension: str,
+                chunksize: Optional[int] = None,
+                sheet_name: SheetSelector = 0,
+                excel_engine: str = 'auto',
+                dtypes: Optional[FrameDtypes] = None
+                ) -> Iterator[pd.DataFrame]:
+    """
+    Parse a file with the reader registered for its extension.
+
+    Parameters:
+        fileobj: Binary file object with the file content.
+        extension (str): Lowercase extension of the file.
+        chunksize (int, optional): Rows per DataFrame, or None for a single DataFrame per sheet.
+        sheet_name (int, str or list): Sheets to read from workbooks.
+        excel_engine (str): Engine for workbooks: 'auto', 'calamine' or 'openpyxl'.
+        dtypes (FrameDtypes, optional): Compact dtypes of the target table, see frame_dtypes.
+
+    Returns:
+        Iterator[pd.DataFrame]: The parsed data.
+    """
+    return READERS[extension](fileobj, chunksize, sheet_name=sheet_name, engine=excel_engine, dtypes=dtypes)
@@ -0,0 +1,159 @@
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Set, Iterable, Iterator, Optional, Any
+from frame_dtypes import concat_frames
+
+MAX_BLOCK_FACTOR = 4 #A block is cut at block_rows * MAX_BLOCK_FACTOR rows even without a boundary row
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    64 bit hash of every row of a DataFrame, from its values only (not its index).
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def row_blocks(chunks: Iterable[pd.DataFrame],
+               block_rows: int,
+               tail: Optional[List[pd.DataFrame]] = None
+               ) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Regroup a stream of DataFrames into content-defined blocks of rows and hash every block.
+
+    A block ends after every row whose hash is a multiple of block_rows, so blocks average about
+    block_rows rows and their boundaries depend on the rows themselves, not on their position:
+    inserting or deleting rows only changes the blocks around the edit, the rest of the file keeps
+    the same hashes. Chunk boundaries of the input do not matter either.
+
+    Parameters:
+        chunks (Iterable[pd.DataFrame]): Rows as they will be staged, with the same columns.
+        block_rows (int): Average rows per block.
+        tail (List[pd.DataFrame], optional): Receives the rows after the last boundary instead of
+            hashing them as the last block, for a stream that goes on elsewhere.
+
+    Returns:
+        Iterator[Tuple[pd.DataFrame, str]]: Every block with the hex digest of its rows.
+    """
+    limit = block_rows * MAX_BLOCK_FACTOR
+    pending: Optional[pd.DataFrame] = None
+    for chunk in chunks:
+        frame = chunk if pending is None else concat_frames([pending, chunk])
+        hashes = row_hashes(frame)
+        start = 0
+        for end in np.flatnonzero(hashes % block_rows == 0) + 1:
+            while end - start > limit:
+                yield frame.iloc[start:start + limit], _digest(hashes[start:start + limit])
+                start += limit
+            yield frame.iloc[start:end], _digest(hashes[start:end])
+            start = end
+        while len(frame) - start > limit:
+            yield frame.iloc[start:start + limit], _digest(hashes[start:start + limit])
+            start += limit
+        pending = frame.iloc[start:] if start < len(frame) else None
+    if pending is not None:
+        if tail is not None:
+            tail.append(pending)
+        else:
+            yield pending, _digest(row_hashes(pending))
+
+def _digest(hashes: np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(hashes).tobytes(), digest_size=16).hexdigest()
+
+class BlockFingerprint:
+    """
+    Fingerprint of a file being staged, compared with the last loaded version of the same object.
+
+    filter() lets through only the blocks of rows whose hash is not in the previous version, and
+    keeps the hash of every block so the new version can be recorded in the ingestion ledger.
+    Only used for tables loaded in merge mode, where the edited rows replace their previous
+    versions on the merge keys. Rows removed from the new version of the file are not deleted from
+    the table. Append tables load every new version whole, changed blocks alone would duplicate
+    the edited rows.
+
+    Parameters:
+        previous (Set[str]): Block hashes of the last loaded version, see ingestion_ledger.latest_blocks.
+        block_rows (int): Average rows per block.
+
+    Attributes:
+        blocks (List[Tuple[str, int]]): (hash, rows) of every block seen, in file order.
+        changed_rows (int): Rows in blocks that were let through.
+        head, tail, bounded: Edges of the last piece given to filter_piece.
+    """
+
+    def __init__(self, previous: Set[str], block_rows: int) -> None:
+        self.previous = frozenset(previous)
+        self.block_rows = max(int(block_rows), 1)
+        self.blocks: List[Tuple[str, int]] = []
+        self.changed_rows = 0
+        self.head: Optional[pd.DataFrame] = None
+        self.tail: Optional[pd.DataFrame] = None
+        self.bounded = False
+
+    def filter(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        The blocks of chunks that are new or changed since the previous version.
+        """
+        return self._changed(row_blocks(chunks, self.block_rows))
+
+    def _changed(self, blocks: Iterable[Tuple[pd.DataFrame, str]]) -> Iterator[pd.DataFrame]:
+        for block, digest in blocks:
+            self.blocks.append((digest, len(block)))
+            if digest not in self.previous:
+                self.changed_rows += len(block)
+                yield block
+
+    def filter_piece(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        filter() for one piece of a file whose pieces are fingerprinted apart, e.g. by worker
+        processes. The rows up to the first block boundary of the piece are kept in head and the
+        rows after its last one in tail, neither hashed nor let through: their blocks span the
+        neighbouring pieces and are hashed by extend_pieces, so the blocks are the same as if the
+        file was fingerprinted in one stream. A piece without any boundary is all head, with
+        bounded False.
+        """
+        self.head, self.tail, self.bounded = None, None, False
+        chunks = iter(chunks)
+        head: List[pd.DataFrame] = []
+        rest: Iterator[pd.DataFrame] = iter(())
+        for chunk in chunks:
+            cuts = np.flatnonzero(row_hashes(chunk) % self.block_rows == 0)
+            if len(cuts):
+                head.append(chunk.iloc[:cuts[0] + 1])
+                rest = itertools.chain([chunk.iloc[cuts[0] + 1:]], chunks)
+                self.bounded = True
+                break
+            head.append(chunk)
+        self.head = concat_frames(head) if head else None
+        tail: List[pd.DataFrame] = []
+        yield from self._changed(row_blocks(rest, self.block_rows, tail))
+        self.tail = tail[0] if tail else None
+
+    def extend_pieces(self, pieces: Iterable[Any]) -> Iterator[pd.DataFrame]:
+        """
+        Add the blocks of the pieces of a file fingerprinted with filter_piece, in file order, and
+        let through the changed blocks made of the tail of a piece and the head of the next ones.
+
+        Parameters:
+            pieces (Iterable): Objects with the head, tail, bounded, blocks and changed_rows of
+                every piece, e.g. process_pool.StagedPart.
+
+        Returns:
+            Iterator[pd.DataFrame]: The changed blocks across pieces, they are staged by the caller.
+        """
+        carry: List[pd.DataFrame] = []
+        for piece in pieces:
+            if piece.head is not None:
+                carry.append(piece.head)
+            if piece.bounded:
+                yield from self.filter(carry)
+                carry = [piece.tail] if piece.tail is not None else []
+            self.blocks.extend(piece.blocks)
+            self.changed_rows += piece.changed_rows
+        yield from self.filter(carry)
+
+    @property
+    def unchanged(self) -> bool:
+        """
+        Whether every block of the file was already loaded, so there is nothing to COPY.
+        """
+        return bool(self.blocks) and self.changed_rows == 0
@@ -0,0 +1,137 @@
+import importlib.util
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from typing import Dict, List, Union, Optional, Any, NamedTuple, Iterable
+
+INTEGER_DTYPES = {'smallint': 'int16', 'integer': 'int32', 'bigint': 'int64'}
+NULLABLE_INTEGER_DTYPES = {'int8': 'Int8', 'int16': 'Int16', 'int32': 'Int32', 'int64': 'Int64'}
+TEXT_TYPES = {'character varying', 'character', 'text'}
+
+class FrameDtypes(NamedTuple):
+    """
+    Compact dtypes of a table's columns, keyed by lowercase column name.
+
+    Attributes:
+        text (Dict[str, Any]): dtype the parser gives every text column: 'category' for short
+            columns, whose few distinct values are stored once, and a string dtype otherwise.
+        numeric (Dict[str, str]): Narrowest numpy dtype the parsed numbers of a column are cast to.
+    """
+    text: Dict[str, Any]
+    numeric: Dict[str, str]
+
+def string_dtype(storage: str = 'pyarrow') -> pd.StringDtype:
+    """
+    String dtype for text columns: 'pyarrow' keeps the values in Arrow buffers instead of one Python
+    object per value, 'python' is used when pyarrow is not installed.
+    """
+    if storage == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+        storage = 'python'
+    return pd.StringDtype(storage)
+
+def frame_dtypes(column_definitions: List[Dict[str, Union[str, int, None]]],
+                 category_max_length: int = 8,
+                 string_storage: str = 'pyarrow'
+                 ) -> FrameDtypes:
+    """
+    Derive the dtypes a file is parsed with from the Redshift definition of its table.
+
+    Parameters:
+        column_definitions (List[dict]): Columns of the table, see SchemaCatalog.column_definitions.
+        category_max_length (int): Text columns declared this short or shorter (e.g. CHAR(1),
+            VARCHAR(6)) are categoricals.
+        string_storage (str): 'pyarrow' or 'python', see string_dtype.
+
+    Returns:
+        FrameDtypes: The dtypes of the table's columns.
+    """
+    text: Dict[str, Any] = {}
+    numeric: Dict[str, str] = {}
+    strings = string_dtype(string_storage)
+    for definition in column_definitions:
+        name, data_type = definition['name'], definition['data_type']
+        if data_type in TEXT_TYPES:
+            length = definition['character_maximum_length']
+            text[name] = 'category' if length and length <= category_max_length else strings
+        elif data_type in INTEGER_DTYPES:
+            numeric[name] = INTEGER_DTYPES[data_type]
+        elif data_type == 'real':
+            numeric[name] = 'float32'
+        elif data_type == 'boolean':
+            numeric[name] = 'int8' #Flags written as 0/1, format_for_table turns them into true/false
+    return FrameDtypes(text, numeric)
+
+def parser_dtypes(columns: Iterable[str], dtypes: FrameDtypes) -> Dict[str, Any]:
+    """
+    The text dtypes of dtypes keyed by the column names of a file header, as pd.read_csv takes them.
+    """
+    return {column: dtypes.text[str(column).lower()] for column in columns if str(column).lower() in dtypes.text}
+
+def _narrow(series: pd.Series, target: str) -> pd.Series:
+    #Values that do not fit (or are not numbers at all) are left for validation to reject
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return series
+    if target.startswith('float'):
+        return series.astype(target) if pd.api.types.is_float_dtype(series) else series
+    low, high = series.min(), series.max()
+    if pd.isna(low):
+        return series
+    limits = np.iinfo(target)
+    if low < limits.min or high > limits.max:
+        return series
+    if pd.api.types.is_float_dtype(series):
+        #Integers with nulls are parsed as floats
+        if not (series.dropna() % 1 == 0).all():
+            return series
+        return series.astype(NULLABLE_INTEGER_DTYPES[target])
+    return series.astype(target)
+
+def compact(df: pd.DataFrame, dtypes: Optional[FrameDtypes]) -> pd.DataFrame:
+    """
+    Give a parsed DataFrame the dtypes of its table: text columns the parser left as objects (e.g.
+    from workbooks) are converted, and numbers are narrowed to the declared integer or REAL width
+    when every value fits.
+
+    Parameters:
+        df (pd.DataFrame): Parsed rows.
+        dtypes (FrameDtypes, optional): See frame_dtypes. The DataFrame is returned as is if None.
+    """
+    if dtypes is None:
+        return df
+    for column in df.columns:
+        name = str(column).lower()
+        if name in dtypes.text and df[column].dtype == object:
+            df[column] = df[column].astype(dtypes.text[name])
+        elif name in dtypes.numeric:
+            df[column] = _narrow(df[column], dtypes.numeric[name])
+    return df
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    pd.concat of parsed chunks that keeps categorical columns categorical: the categories of every
+    chunk are unioned first, pd.concat turns categoricals with different categories into objects.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    frames = [frame.copy(deep=False) for frame in frames] #Columns are replaced below, not the callers' frames
+    for column in frames[0].columns:
+        series = [frame[column] for frame in frames if column in frame.columns]
+        if len(series) == len(frames) and all(isinstance(values.dtype, pd.CategoricalDtype) for values in series):
+            categories = union_categoricals(series).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+def memory_report(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Memory footprint of a DataFrame, Python objects included.
+
+    Returns:
+        dict: 'bytes' and 'rows' of the whole DataFrame, and 'columns' with the dtype and bytes of every column.
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    return {
+        'bytes': int(usage.sum()),
+        'rows': len(df),
+        'columns': {str(column): {'dtype': str(df[column].dtype), 'bytes': int(usage[column])} for column in df.columns}
+    }
@@ -0,0 +1,166 @@
+import logging
+from psycopg2.extras import execute_values
+from connection_pool import get_pool
+from failure_policy import call_redshift
+from sql_queries import QUERY_LEDGER_LOOKUP, QUERY_LEDGER_CONTENT_LOOKUP, INSERT_LEDGER_ENTRY
+from sql_queries import QUERY_LATEST_BLOCKS, INSERT_LEDGER_BLOCKS, DELETE_SUPERSEDED_BLOCKS
+from typing import Dict, Union, List, Optional, NamedTuple, Set, Tuple
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LedgerEntry(NamedTuple):
+    """
+    An S3 object version loaded into Redshift.
+
+    Attributes:
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        etag (str): ETag of the object, without quotes. Identical content keeps the same ETag.
+        version_id (str, optional): S3 version id, None for unversioned buckets.
+        table_name (str): Table the rows were copied into.
+        rows (int): Number of rows staged for the COPY.
+        size (int): Size of the object in bytes.
+        blocks (Tuple[Tuple[str, int], ...]): (hash, rows) of every block of rows of the object, in
+            file order, when content fingerprints are enabled. See fingerprint.py.
+    """
+    bucket: str
+    key: str
+    etag: str
+    version_id: Optional[str] = None
+    table_name: str = ''
+    rows: int = 0
+    size: int = 0
+    blocks: Tuple[Tuple[str, int], ...] = ()
+
+class AlreadyLoaded(Exception):
+    """
+    Raised by a COPY whose files are already in the ledger. The transaction is rolled back, so
+    nothing was loaded twice and the file can be considered done.
+    """
+
+def is_loaded(config_params: Dict[str, Union[str, int]], bucket: str, key: str, etag: str) -> bool:
+    """
+    Whether an object with this content was already loaded. A single indexed lookup, meant to run
+    before anything is downloaded.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        etag (str): ETag of the object as returned by HEAD.
+
+    Returns:
+        bool: True if the ledger has a committed load of this bucket, key and ETag.
+    """
+    def lookup() -> bool:
+        with get_pool(config_params).connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(QUERY_LEDGER_LOOKUP, (bucket, key, etag))
+                return cursor.fetchone() is not None
+
+    try:
+        found = call_redshift(lookup)
+    except Exception as error:
+        logger.error("Error reading the ingestion ledger: %s", error)
+        raise error
+    return found
+
+def content_loaded(config_params: Dict[str, Union[str, int]], etag: str, size: int, table_name: str) -> Optional[str]:
+    """
+    Whether the same content was already loaded into a table under any key, e.g. a spreadsheet
+    uploaded again with another name. Content is matched on the ETag and the size of the object.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters.
+        etag (str): ETag of the object as returned by HEAD.
+        size (int): Size of the object in bytes.
+        table_name (str): Table the object is routed to.
+
+    Returns:
+        Optional[str]: The key the content was loaded from, None if it was never loaded.
+    """
+    def lookup() -> Optional[Tuple[str]]:
+        with get_pool(config_params).connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(QUERY_LEDGER_CONTENT_LOOKUP, (etag, size, table_name))
+                return cursor.fetchone()
+
+    try:
+        row = call_redshift(lookup)
+    except Exception as error:
+        logger.error("Error reading the ingestion ledger: %s", error)
+        raise error
+    return None if row is None else row[0]
+
+def latest_blocks(config_params: Dict[str, Union[str, int]], bucket: str, key: str) -> Set[str]:
+    """
+    Block hashes of the last version of an object that was loaded.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+
+    Returns:
+        Set[str]: The hashes, empty if the object was never loaded with fingerprints.
+    """
+    def lookup() -> Set[str]:
+        with get_pool(config_params).connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(QUERY_LATEST_BLOCKS, (bucket, key, bucket, key))
+                return {row[0] for row in cursor.fetchall()}
+
+    try:
+        hashes = call_redshift(lookup)
+    except Exception as error:
+        logger.error("Error reading the ingestion ledger: %s", error)
+        raise error
+    return hashes
+
+def record_loaded(config_params: Dict[str, Union[str, int]], entries: List[LedgerEntry]) -> None:
+    """
+    Record objects in their own transaction, for versions whose rows are all loaded already and
+    need no COPY.
+
+    Raises:
+        AlreadyLoaded: If any of the objects is already in the ledger. Nothing is recorded.
+    """
+    def record() -> None:
+        with get_pool(config_params).connection() as connection:
+            with connection.cursor() as cursor:
+                record_entries(cursor, entries)
+                connection.commit()
+
+    try:
+        call_redshift(record)
+    except AlreadyLoaded as error:
+        logger.info("Not recording %s", error)
+        raise error
+    except Exception as error:
+        logger.error("Error writing the ingestion ledger: %s", error)
+        raise error
+
+def record_entries(cursor, entries: List[LedgerEntry]) -> None:
+    """
+    Insert ledger rows, and the block hashes of every entry that has them, inside the caller's
+    transaction, before its COPY, so both commit or roll back together. The block hashes of earlier
+    versions of the objects are deleted, only the last version is compared with.
+
+    Parameters:
+        cursor: Cursor of the transaction that runs the COPY.
+        entries (List[LedgerEntry]): The objects loaded by the COPY.
+
+    Raises:
+        AlreadyLoaded: If any of the objects is already in the ledger, e.g. it was loaded by another
+            consumer since it was checked. The caller must roll the transaction back.
+    """
+    for entry in entries:
+        cursor.execute(INSERT_LEDGER_ENTRY, (entry.bucket, entry.key, entry.etag, entry.version_id, entry.table_name,
+                                             entry.rows, entry.size or None, entry.bucket, entry.key, entry.etag))
+        if cursor.rowcount == 0:
+            raise AlreadyLoaded(f's3://{entry.bucket}/{entry.key} ({entry.etag}) is already loaded')
+        cursor.execute(DELETE_SUPERSEDED_BLOCKS, (entry.bucket, entry.key, entry.etag)) #Keeps the blocks table bounded
+        if entry.blocks:
+            execute_values(cursor, INSERT_LEDGER_BLOCKS,
+                           [(entry.bucket, entry.key, entry.etag, index, block_hash, rows)
+                            for index, (block_hash, rows) in enumerate(entry.blocks)], page_size=1000)
@@ -0,0 +1,114 @@
+import json
+import time
+import logging
+from typing import Dict, Union, List, Tuple, Optional, Any
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Kept between warm invocations of the same Lambda container. The heavy modules (pandas, openpyxl,
+# psycopg2, boto3) are only imported the first time an event needs them, so importing this module is cheap
+_state: Dict[str, Any] = {}
+
+def _warm_state() -> Dict[str, Any]:
+    #Config, Secrets Manager password and the first Redshift connection are resolved once per container
+    if not _state:
+        start = time.perf_counter()
+        from redshift_loader import get_rs_config_params, ensure_required_tables
+        from s3_preproc import get_preproc_config_params
+        from copy_batcher import get_batch_config_params
+        from metrics import get_metrics_config_params, configure_json_logging
+        from staging_cleaner import get_cleanup_config_params, start_cleaner
+
+        if get_metrics_config_params()['json_logs']:
+            configure_json_logging()
+        redshift_config = get_rs_config_params()
+        ensure_required_tables(redshift_config) #Also leaves a pooled connection open for the next invocations
+        cleanup_config = get_cleanup_config_params()
+        _state.update({
+            'cleaner': start_cleaner(cleanup_config['flush_seconds']) if cleanup_config['enabled'] else None,
+            'redshift_config': redshift_config,
+            'preproc_config': get_preproc_config_params(),
+            'batch_config': get_batch_config_params()
+        })
+        logger.info(f'Cold start initialization took {time.perf_counter() - start:.3f} s')
+    return _state
+
+def event_files(event: Dict[str, Any]) -> List[Tuple[Optional[str], str, str]]:
+    """
+    Extract the uploaded files from a Lambda event.
+
+    Accepts S3 notifications delivered directly to the function and S3 notifications wrapped in
+    SQS messages (an SQS event source mapping). Test events without records are ignored.
+
+    Parameters:
+        event (dict): The Lambda event payload.
+
+    Returns:
+        List[Tuple[Optional[str], str, str]]: (SQS message id or None, S3 bucket name, key) per file.
+    """
+    files = []
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            body = json.loads(record['body'])
+            for s3_record in body.get('Records', []):
+                files.append((record['messageId'], s3_record['s3']['bucket']['name'], s3_record['s3']['object']['key']))
+        elif 's3' in record:
+            files.append((None, record['s3']['bucket']['name'], record['s3']['object']['key']))
+    return files
+
+def handler(event: Dict[str, Any], context: Any = None) -> Dict[str, Union[int, List[Dict[str, str]]]]:
+    """
+    Lambda entry point: run the ETL for every file announced by the event.
+
+    Files of the same event are coalesced into one COPY per table when batching is enabled.
+    For SQS events the messages whose files failed are reported as batchItemFailures so only
+    those are delivered again; for direct S3 events the first error is raised so Lambda retries.
+    Files that cannot be loaded are dead-lettered instead, see failure_policy.handle_failure.
+
+    Parameters:
+        event (dict): S3 or SQS event payload.
+        context: Lambda context object, unused.
+
+    Returns:
+        dict: The number of files in the event and, for SQS events, the failed message ids.
+    """
+    state = _warm_state()
+    from pipeline import process_file
+    from copy_batcher import CopyBatcher
+    from failure_policy import failure_callback
+
+    files = event_files(event)
+    batch_config = state['batch_config']
+    batcher = None
+    if batch_config['enabled'] and len(files) > 1:
+        batcher = CopyBatcher(
+            state['redshift_config'],
+            max_files=batch_config['max_files'],
+            max_bytes=batch_config['max_bytes'],
+            max_wait_seconds=batch_config['max_wait_seconds'],
+            manifest_prefix=batch_config['manifest_prefix']
+        )
+
+    receive_counts = {record['messageId']: int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+                      for record in event.get('Records', []) if record.get('eventSource') == 'aws:sqs'}
+    failures: Dict[Optional[str], Exception] = {}
+    for message_id, bucket, key in files:
+        def redeliver(error: Exception, delay: Optional[float] = None, message_id: Optional[str] = message_id) -> None:
+            failures.setdefault(message_id, error) #Lambda redelivers after the visibility timeout, whatever the delay
+        on_error = failure_callback(bucket, key, receive_counts.get(message_id, 1), lambda: None, redeliver)
+        try:
+            process_file(state['redshift_config'], bucket, key, batcher, state['preproc_config'], on_error=on_error)
+        except Exception as error:
+            logger.error("Error processing file %s: %s", key, error)
+            on_error(error)
+    if batcher is not None:
+        batcher.flush()
+    if state['cleaner'] is not None:
+        state['cleaner'].flush(timeout=30) #Background threads do not run while the container is frozen
+
+    from_sqs = any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', []))
+    if from_sqs:
+        return {'files': len(files), 'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+    if failures:
+        raise next(iter(failures.values()))
+    return {'files': len(files)}
@@ -1,38 +1,117 @@
-from redshift_loader import get_rs_config_params, ensure_required_tables, copy_data_from_s3_to_redshift, retrieve_table_names
-from sqs_event_handler import get_sqs_config_params, get_files_data
-from s3_preproc import load_file, check_columns, decide_table_for_file, format_for_table, save_dataframe_to_s3
+from redshift_loader import get_rs_config_params, ensure_required_tables
+from sqs_event_handler import get_sqs_config_params, SqsPoller
+from s3_preproc import get_preproc_config_params
+from copy_batcher import get_batch_config_params, CopyBatcher
+from file_engine import get_concurrency_config_params, get_scheduling_config_params, ConcurrentFileProcessor
+from pipeline import process_file
+from process_pool import shutdown_process_pool
+from staging_cleaner import get_cleanup_config_params, start_cleaner
+from metrics import get_metrics_config_params, configure_json_logging, start_metrics_server
+from failure_policy import get_breaker, failure_callback
+from typing import Optional
+import threading
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main():
-    
+def main(stop: Optional[threading.Event] = None):
+    """
+    Consume S3 events from SQS and load the announced files into Redshift.
+
+    Parameters:
+        stop (threading.Event, optional): Ends the loop once set, e.g. by a benchmark that fed a fixed
+            set of events. In flight files are drained and staged batches flushed before returning.
+            Without it the consumer runs until interrupted.
+    """
+
     redshift_config = get_rs_config_params()
     sqs_config = get_sqs_config_params()
-    
+    batch_config = get_batch_config_params()
+    preproc_config = get_preproc_config_params()
+    concurrency_config = get_concurrency_config_params()
+    scheduling_config = get_scheduling_config_params()
+    metrics_config = get_metrics_config_params()
+    cleanup_config = get_cleanup_config_params()
+
+    if metrics_config['json_logs']:
+        configure_json_logging()
+    if metrics_config['enabled']:
+        start_metrics_server(metrics_config['port'], metrics_config['address']) #Stage counters and histograms
+
     ensure_required_tables(redshift_config) #Check if the tables exist and initialize them if not
 
+    cleaner = None
+    if cleanup_config['enabled']:
+        cleaner = start_cleaner(cleanup_config['flush_seconds']) #Deletes staged objects once their COPY committed
+
+    batcher = None
+    if batch_config['enabled']:
+        batcher = CopyBatcher(
+            redshift_config,
+            max_files=batch_config['max_files'],
+            max_bytes=batch_config['max_bytes'],
+            max_wait_seconds=batch_config['max_wait_seconds'],
+            manifest_prefix=batch_config['manifest_prefix']
+        )
+
+    engine = None
+    if concurrency_config['enabled']:
+        engine = ConcurrentFileProcessor(
+            redshift_config,
+            workers=concurrency_config['workers'],
+            max_in_flight=concurrency_config['max_in_flight'],
+            batcher=batcher,
+            preproc_config=preproc_config,
+            scheduling_config=scheduling_config #Lanes by size, so small files do not wait behind large ones
+        )
+
+    poller = SqsPoller(sqs_config) #Prefetches messages in the background, deletes them once loaded
+    poller.start()
+
+    breaker = get_breaker() #Shared with the COPY calls, None if failure handling is disabled
+
     #Loop to listen to messages
-    while True:
-        founded, files = get_files_data(sqs_config) #Served a message retrieve key and value from the S3 event
-        if not founded:
-            continue
-        for bucket, key in files:
-            targetfile, df = load_file(bucket, key) #Load a pandas DataFrame for preprocessing if necessary
-            if targetfile:
-                key = key.split('/')[1] #Expecting files from a special upload folder
-                if check_columns(redshift_config, df, key): #Check if columns are compatible with known definitions
-                    all_tables = retrieve_table_names(redshift_config)
-                    table_name = decide_table_for_file(key, all_tables)
-                    key2 = f"Tmp/{key.split('.')[0]}-autogen.csv" #A Tmp folder is needed in the bucket 
-                    s3_path = f"s3://{bucket}/{key2}"
-                    df = format_for_table(df, table_name, key) #Preproc
-                    save_dataframe_to_s3(df, bucket, key2) #Save to csv format for COPY command
-                    copy_data_from_s3_to_redshift(redshift_config, s3_path, table_name)
-                    logger.info(f'File {key} from bucket {bucket} is a valid file')
-            else:
-                logger.info(f'File {key} detected, but not compatible')          
+    try:
+        while stop is None or not stop.is_set():
+            if breaker is not None and not breaker.wait_until_closed(timeout=1):
+                continue #Redshift unavailable: leave the messages in the queue until the breaker lets a probe through
+            if engine is not None:
+                engine.wait_for_capacity() #Backpressure: do not take messages the workers cannot handle
+            message = poller.get(timeout=1) #Served a message retrieve key and value from the S3 event
+            if batcher is not None:
+                batcher.flush_due() #Time threshold, checked after every poll
+            if message is None:
+                continue
+            for bucket, key, size in message.files:
+                #Dead-letters poison files, retryable failures are delivered again after a backoff
+                on_error = failure_callback(bucket, key, message.receive_count, message.file_done, message.file_failed)
+                if engine is not None:
+                    while not engine.wait_for_capacity(timeout=1): #Checked per file, a message may list several
+                        if batcher is not None:
+                            batcher.flush_due()
+                    try:
+                        engine.submit(bucket, key, message.file_done, on_error, size)
+                    except Exception as error:
+                        logger.error("Error submitting file %s: %s", key, error)
+                        on_error(error) #One bad file must not stop the consumer
+                    continue
+                try:
+                    process_file(redshift_config, bucket, key, batcher, preproc_config,
+                                 message.file_done, on_error)
+                except Exception as error:
+                    logger.error("Error processing file %s: %s", key, error)
+                    on_error(error) #One bad file must not stop the consumer
+    finally:
+        if engine is not None:
+            engine.drain()
+            engine.shutdown()
+        if batcher is not None:
+            batcher.flush() #Do not leave staged files behind on shutdown
+        poller.stop()
+        shutdown_process_pool()
+        if cleaner is not None:
+            cleaner.stop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
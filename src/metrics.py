@@ -0,0 +1,342 @@
+import json
+import time
+import yaml
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Union, List, Optional, Iterator, Iterable, Callable, Any
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('datalakep.trace')
+
+# Stages of the pipeline, in the order a file goes through them
+STAGES = ('ledger_lookup', 'load_file', 'check_columns', 'format_for_table', 'validate', 'fingerprint',
+          'save_dataframe_to_s3', 'copy_data_from_s3_to_redshift')
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def get_metrics_config_params() -> Dict[str, Union[bool, int, str]]:
+    """
+    Load the instrumentation parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with metrics parameters:
+            - enabled (bool): Whether the Prometheus endpoint is served.
+            - port (int): Port of the local HTTP endpoint.
+            - address (str): Address the endpoint binds to.
+            - json_logs (bool): Whether every log line is written as a JSON object.
+            - memory_report (bool): Whether the memory footprint of the first DataFrame parsed for
+              every file is added to its trace. Off by default, it scans every text value once.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    metrics = config.get('Metrics', {})
+    return {
+        'enabled': metrics.get('enabled', False),
+        'port': metrics.get('port', 9102),
+        'address': metrics.get('address', '127.0.0.1'),
+        'json_logs': metrics.get('json_logs', False),
+        'memory_report': metrics.get('memory_report', False)
+    }
+
+class _Prometheus:
+    #Collectors are created once per process, prometheus_client rejects duplicate names
+    def __init__(self, client) -> None:
+        self.stage_seconds = client.Histogram('datalakep_stage_seconds', 'Time spent on a file in each pipeline stage',
+                                              ['stage'], buckets=STAGE_BUCKETS)
+        self.stage_rows = client.Counter('datalakep_stage_rows', 'Rows handled by each pipeline stage', ['stage'])
+        self.stage_bytes = client.Counter('datalakep_stage_bytes', 'Bytes read or written by each pipeline stage', ['stage'])
+        self.file_seconds = client.Histogram('datalakep_file_seconds', 'Time from picking a file up to its final status',
+                                             ['status'], buckets=STAGE_BUCKETS)
+        self.files = client.Counter('datalakep_files', 'Files processed by final status', ['status'])
+
+_prometheus: Optional[_Prometheus] = None
+_prometheus_lock = threading.Lock()
+
+def _collectors() -> Optional[_Prometheus]:
+    global _prometheus
+    if _prometheus is None:
+        try:
+            import prometheus_client
+        except ImportError:
+            return None
+        with _prometheus_lock:
+            if _prometheus is None:
+                _prometheus = _Prometheus(prometheus_client)
+    return _prometheus
+
+def start_metrics_server(port: int = 9102, address: str = '127.0.0.1') -> bool:
+    """
+    Serve the pipeline counters and histograms in the Prometheus text format on a local HTTP endpoint.
+
+    Parameters:
+        port (int): Port of the endpoint.
+        address (str): Address the endpoint binds to.
+
+    Returns:
+        bool: False if prometheus_client is not installed and nothing is served.
+    """
+    if _collectors() is None:
+        logger.warning("prometheus_client is not installed, the metrics endpoint is disabled")
+        return False
+    import prometheus_client
+    prometheus_client.start_http_server(port, addr=address)
+    logger.info(f'Serving metrics on http://{address}:{port}/metrics')
+    return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    Render log records as one JSON object per line. Trace records are embedded as objects, not strings.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        trace = getattr(record, 'trace', None)
+        if trace is not None:
+            entry.update(trace)
+        else:
+            entry['message'] = record.getMessage()
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_json_logging() -> None:
+    """
+    Switch every handler of the root logger to JsonFormatter.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(JsonFormatter())
+
+class FileTrace:
+    """
+    Timing, row and byte counts of every pipeline stage for one uploaded file.
+
+    Stages may nest, e.g. streaming chunks are parsed while the staging upload pulls them, so each
+    stage keeps its exclusive time: time spent in a nested stage is not counted for its parent.
+    finish() publishes the trace once, to the Prometheus collectors and as a JSON log record.
+
+    Parameters:
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+    """
+
+    def __init__(self, bucket: str, key: str) -> None:
+        self.bucket = bucket
+        self.key = key
+        self.table_name: Optional[str] = None
+        self.rows = 0 #Rows staged for the COPY
+        self.stages: Dict[str, Dict[str, Union[int, float]]] = {}
+        self.memory: Optional[Dict[str, Any]] = None #First parsed DataFrame, the largest across workers, see add_memory
+        self._started = time.perf_counter()
+        self._stack: List[List[float]] = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def _stats(self, name: str) -> Dict[str, Union[int, float]]:
+        return self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes': 0})
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Union[int, float]]]:
+        """
+        Time a stage. The yielded dictionary takes the rows and bytes handled, e.g. stats['rows'] += len(df).
+
+        Parameters:
+            name (str): Stage name, see STAGES.
+        """
+        with self._lock:
+            stats = self._stats(name)
+        frame = [0.0] #Time spent in nested stages
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += elapsed
+            with self._lock:
+                stats['seconds'] += elapsed - frame[0]
+                stats['calls'] += 1
+
+    def record(self, name: str, seconds: float, rows: int = 0, nbytes: int = 0) -> None:
+        """
+        Add a stage measured elsewhere, e.g. a batched COPY shared by several files.
+
+        Parameters:
+            name (str): Stage name, see STAGES.
+            seconds (float): Duration of the stage.
+            rows (int): Rows handled.
+            nbytes (int): Bytes handled.
+        """
+        with self._lock:
+            stats = self._stats(name)
+            stats['seconds'] += seconds
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['bytes'] += nbytes
+
+    def add(self, name: str, rows: int = 0, nbytes: int = 0) -> None:
+        """
+        Count rows or bytes for a stage without timing it.
+        """
+        with self._lock:
+            stats = self._stats(name)
+            stats['rows'] += rows
+            stats['bytes'] += nbytes
+
+    def add_memory(self, report: Dict[str, Any]) -> None:
+        """
+        Keep the memory report of a parsed DataFrame if it is the largest of the file so far.
+
+        Parameters:
+            report (dict): See frame_dtypes.memory_report.
+        """
+        with self._lock:
+            if self.memory is None or report['bytes'] > self.memory['bytes']:
+                self.memory = report
+
+    def timed(self, name: str, chunks: Iterable[Any]) -> Iterator[Any]:
+        """
+        Wrap an iterator of DataFrames so producing every item is timed as the given stage and its rows counted.
+        """
+        iterator = iter(chunks)
+        while True:
+            with self.stage(name) as stats:
+                chunk = next(iterator, None)
+                if chunk is not None:
+                    stats['rows'] += len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def finish(self, status: str, error: Optional[Exception] = None) -> None:
+        """
+        Publish the trace. Only the first call has an effect.
+
+        Parameters:
+            status (str): 'loaded', 'skipped', 'duplicate' or 'failed'.
+            error (Exception, optional): The failure, for failed files.
+        """
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+            memory = self.memory
+        seconds = time.perf_counter() - self._started
+
+        collectors = _collectors()
+        if collectors is not None:
+            for name, stats in stages.items():
+                collectors.stage_seconds.labels(name).observe(stats['seconds'])
+                collectors.stage_rows.labels(name).inc(stats['rows'])
+                collectors.stage_bytes.labels(name).inc(stats['bytes'])
+            collectors.file_seconds.labels(status).observe(seconds)
+            collectors.files.labels(status).inc()
+
+        trace = {
+            'event': 'file_trace',
+            'bucket': self.bucket,
+            'key': self.key,
+            'table': self.table_name,
+            'status': status,
+            'seconds': round(seconds, 6),
+            'stages': {name: {**stats, 'seconds': round(stats['seconds'], 6)} for name, stats in stages.items()}
+        }
+        if memory is not None:
+            trace['memory'] = memory
+        if error is not None:
+            trace['error'] = f'{type(error).__name__}: {error}'
+        trace_logger.info(json.dumps(trace), extra={'trace': trace})
+
+    def committed(self, callback: Optional[Callable[[], None]]) -> Callable[[], None]:
+        """
+        Wrap an on_commit callback so the trace is published as loaded first.
+        """
+        def on_commit() -> None:
+            self.finish('loaded')
+            if callback is not None:
+                callback()
+        return on_commit
+
+    def failed(self, callback: Optional[Callable[[Exception], None]]) -> Callable[[Exception], None]:
+        """
+        Wrap an on_error callback so the trace is published as failed first.
+        """
+        def on_error(error: Exception) -> None:
+            self.finish('failed', error)
+            if callback is not None:
+                callback(error)
+        return on_error
+
+_local = threading.local()
+
+def current_trace() -> Optional[FileTrace]:
+    """
+    Returns:
+        Optional[FileTrace]: The trace activated in this thread, if any.
+    """
+    return getattr(_local, 'trace', None)
+
+@contextmanager
+def activate(trace: FileTrace) -> Iterator[FileTrace]:
+    """
+    Make trace the target of stage(), timed() and add_bytes() in this thread.
+    """
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, Union[int, float]]]:
+    """
+    Time a stage of the active trace. Without an active trace the stats are discarded.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes': 0}
+        return
+    with trace.stage(name) as stats:
+        yield stats
+
+def timed(name: str, chunks: Iterable[Any]) -> Iterable[Any]:
+    """
+    FileTrace.timed on the active trace, chunks unchanged without one.
+    """
+    trace = current_trace()
+    return chunks if trace is None else trace.timed(name, chunks)
+
+def add_bytes(name: str, nbytes: int) -> None:
+    """
+    Count bytes for a stage of the active trace, e.g. the size of the object read from S3.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, nbytes=nbytes)
+
+_memory_report: Optional[bool] = None #Metrics.memory_report, read on first use
+
+def add_memory(df: Any) -> None:
+    """
+    Record the memory footprint of a parsed DataFrame in the active trace, if Metrics.memory_report
+    is enabled. Only the first DataFrame of a trace is measured, memory_usage(deep=True) scans every
+    text value: the whole file when it is read at once, the first chunk when streaming.
+    """
+    global _memory_report
+    trace = current_trace()
+    if trace is None or trace.memory is not None:
+        return
+    if _memory_report is None:
+        _memory_report = get_metrics_config_params()['memory_report']
+    if _memory_report:
+        from frame_dtypes import memory_report
+        trace.add_memory(memory_report(df))
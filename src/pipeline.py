@@ -0,0 +1,518 @@
+from redshift_loader import copy_data_from_s3_to_redshift, get_slice_count
+from ingestion_ledger import LedgerEntry, AlreadyLoaded, is_loaded, content_loaded, latest_blocks, record_loaded
+from s3_preproc import load_file, format_for_table, save_dataframe_to_s3, save_manifest_to_s3
+from s3_preproc import load_file_chunks, save_dataframe_parts_to_s3, stream_dataframe_parts_to_s3
+from s3_preproc import staging_columns, object_key, object_identity, object_size, part_key, delete_staged_objects, staging_key
+from process_pool import get_process_pool, pool_size, header_line, collect_parts, stage_part, StagingTask
+from process_pool import read_line_range, READ_BLOCK_SIZE
+from schema_catalog import get_catalog
+from table_router import route_file
+from schema_inference import table_for_file
+from validation import validate_dataframe, validate_chunks, rejected_rows_key
+from fingerprint import BlockFingerprint
+from frame_dtypes import FrameDtypes, frame_dtypes, concat_frames
+from copy_batcher import CopyBatcher, StagedFile
+from staging_cleaner import delete_when_loaded, discard_staged
+from failure_policy import call_with_retries
+from metrics import FileTrace, activate, stage, timed
+from typing import Dict, Union, Optional, NamedTuple, Callable, Tuple, List, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
+from contextlib import contextmanager
+import pandas as pd
+import time
+import itertools
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PreparedFile(NamedTuple):
+    """
+    An uploaded file that passed validation and is staged in S3, ready for the COPY.
+
+    Attributes:
+        filename (str): Name of the uploaded file, without the upload folder.
+        table_name (str): Destination table in Redshift.
+        s3_path (str): Full S3 path of the staged file. When it was split, the parts share its name.
+        size (int): Size of the staged file in bytes, all parts included.
+        staging_format (str): Format of the staged file.
+        columns (Tuple[str, ...]): Target columns in file order.
+        rows (int): Number of rows staged.
+        trace (FileTrace, optional): Stage timings of the file, published once it is loaded.
+        ledger_entry (LedgerEntry, optional): Recorded in the ingestion ledger by the COPY transaction.
+        parts (Tuple[Tuple[str, int], ...]): (S3 path, size) of every staged object, empty if the
+            file is the single object at s3_path.
+    """
+    filename: str
+    table_name: str
+    s3_path: str
+    size: int
+    staging_format: str
+    columns: Tuple[str, ...]
+    rows: int = 0
+    trace: Optional[FileTrace] = None
+    ledger_entry: Optional[LedgerEntry] = None
+    parts: Tuple[Tuple[str, int], ...] = ()
+
+    def entries(self) -> List[Tuple[str, int]]:
+        """
+        (S3 path, size) of every object the COPY has to load.
+        """
+        return list(self.parts) if self.parts else [(self.s3_path, self.size)]
+
+def staging_parts(redshift_config: Dict[str, Union[str, int]],
+                  preproc_config: Optional[Dict[str, Union[bool, int, str]]]
+                  ) -> int:
+    """
+    Number of objects a staged file is split into, from the staging_parts setting: a fixed number,
+    or 'auto' for the slice count of the cluster.
+    """
+    parts = preproc_config['staging_parts'] if preproc_config else 1
+    return get_slice_count(redshift_config) if parts == 'auto' else max(int(parts), 1)
+
+def parse_dtypes(redshift_config: Dict[str, Union[str, int]],
+                 filename: str,
+                 preproc_config: Optional[Dict[str, Union[bool, int, str]]]
+                 ) -> Optional[FrameDtypes]:
+    """
+    Compact dtypes a file is parsed with, from the definition of the table its name routes to.
+    None if compact_dtypes is disabled or the file matches no table yet.
+    """
+    if not preproc_config or not preproc_config['compact_dtypes']:
+        return None
+    table_name = route_file(redshift_config, filename)
+    if table_name is None:
+        return None
+    return frame_dtypes(get_catalog(redshift_config).column_definitions(table_name),
+                        preproc_config['category_max_length'], preproc_config['string_storage'])
+
+def prepare_file(redshift_config: Dict[str, Union[str, int]],
+                 bucket: str,
+                 key: str,
+                 preproc_config: Optional[Dict[str, Union[bool, int, str]]] = None,
+                 raw_key: bool = False
+                 ) -> Optional[PreparedFile]:
+    """
+    First half of the ETL for a single uploaded file: load, validate, format and stage.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        preproc_config (dict, optional): Preprocessing parameters from get_preproc_config_params.
+            When streaming is enabled, files are processed chunk by chunk with bounded memory.
+            When the ledger is enabled, objects already loaded are skipped before they are downloaded.
+            Files of at least process_min_size bytes are staged by the worker processes when enabled.
+            When fingerprints are enabled, content loaded under another key is skipped as well, and
+            for tables loaded in merge mode only the blocks of rows that changed since the last loaded
+            version of the object are staged.
+        raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+            Either way the file is traced and recorded in the ledger under its decoded key.
+
+    Returns:
+        Optional[PreparedFile]: The staged file, or None if the file is not compatible or already loaded.
+    """
+    key = object_key(key, raw_key) #Decoded once, the steps below take raw keys
+    trace = FileTrace(bucket, key) #Published here if the file fails or is skipped, after the COPY otherwise
+    ledger_entry = None
+    fingerprint = None
+    previous = None
+    size = None
+    try:
+        with activate(trace):
+            if preproc_config and preproc_config['ledger']:
+                with stage('ledger_lookup'):
+                    etag, version_id, size = object_identity(bucket, key, raw_key=True)
+                    loaded = is_loaded(redshift_config, bucket, key, etag)
+                    if not loaded and preproc_config['fingerprint']:
+                        table_name = route_file(redshift_config, key.split('/')[-1])
+                        loaded_as = content_loaded(redshift_config, etag, size, table_name) if table_name else None
+                        if loaded_as is not None:
+                            logger.info(f'File {key} has the content of {loaded_as}, already loaded into {table_name}')
+                            loaded = True
+                        if table_name in redshift_config.get('merge', {}):
+                            #Only merge tables replace edited rows, append tables load new versions whole
+                            previous = latest_blocks(redshift_config, bucket, key)
+                if loaded:
+                    logger.info(f'File {key} ({etag}) is already loaded, skipping it')
+                    trace.finish('duplicate')
+                    return None
+                ledger_entry = LedgerEntry(bucket, key, etag, version_id, size=size)
+                if previous is not None:
+                    fingerprint = BlockFingerprint(previous, preproc_config['fingerprint_block_rows'])
+            processes = pool_size(preproc_config['processes']) if preproc_config else 0
+            pool = get_process_pool(processes) if processes > 1 else None
+            if pool is not None and (size or object_size(bucket, key, raw_key=True)) >= preproc_config['process_min_size']:
+                prepared = prepare_file_in_processes(redshift_config, bucket, key, preproc_config, pool, processes, fingerprint)
+            elif preproc_config and preproc_config['streaming']:
+                prepared = prepare_file_streaming(redshift_config, bucket, key, preproc_config, fingerprint)
+            else:
+                prepared = _prepare_file_in_memory(redshift_config, bucket, key, preproc_config, fingerprint)
+            if fingerprint is not None and fingerprint.unchanged:
+                #Every block of rows is in the last loaded version: record this one, there is nothing to COPY
+                if prepared is not None:
+                    delete_staged_objects(bucket, prepared.entries())
+                try:
+                    record_loaded(redshift_config, [ledger_entry._replace(table_name=route_file(redshift_config, key.split('/')[-1]),
+                                                                          blocks=tuple(fingerprint.blocks))])
+                except AlreadyLoaded:
+                    pass #Recorded by another consumer meanwhile
+                logger.info(f'File {key} ({etag}) has no changed rows, skipping it')
+    except Exception as error:
+        trace.finish('failed', error)
+        raise error
+    if fingerprint is not None and fingerprint.unchanged:
+        trace.finish('duplicate')
+        return None
+    if prepared is None:
+        trace.finish('skipped')
+        return None
+    trace.table_name = prepared.table_name
+    trace.rows = prepared.rows
+    if ledger_entry is not None:
+        ledger_entry = ledger_entry._replace(table_name=prepared.table_name, rows=prepared.rows,
+                                             blocks=tuple(fingerprint.blocks) if fingerprint is not None else ())
+    return prepared._replace(trace=trace, ledger_entry=ledger_entry)
+
+def _prepare_file_in_memory(redshift_config: Dict[str, Union[str, int]],
+                            bucket: str,
+                            key: str,
+                            preproc_config: Optional[Dict[str, Union[bool, int, str]]] = None,
+                            fingerprint: Optional[BlockFingerprint] = None
+                            ) -> Optional[PreparedFile]:
+    staging_format = preproc_config['staging_format'] if preproc_config else 'csv'
+    reader_options = {'sheet_name': preproc_config['sheet_name'], 'excel_engine': preproc_config['excel_engine']} if preproc_config else {}
+
+    with stage('load_file') as stats:
+        targetfile, df = load_file(bucket, key, dtypes=parse_dtypes(redshift_config, key.split('/')[-1], preproc_config),
+                                   raw_key=True, **reader_options) #Load a pandas DataFrame for preprocessing if necessary
+        stats['rows'] += 0 if df is None else len(df)
+    if not targetfile:
+        logger.info(f'File {key} detected, but not compatible')
+        return None
+    if df.empty:
+        logger.info(f'File {key} has no rows, nothing to load')
+        return None
+
+    key = key.split('/')[-1] #Expecting files from a special upload folder
+    with stage('check_columns') as stats:
+        stats['rows'] += len(df)
+        table_name = table_for_file(redshift_config, df, key) #Check if columns are compatible with known definitions
+        if table_name is None:
+            return None
+
+    key2 = staging_key(key, staging_format) #Unique per run, a Tmp folder is needed in the bucket
+    s3_path = f"s3://{bucket}/{key2}"
+    with stage('format_for_table') as stats:
+        df = format_for_table(df, table_name, key) #Preproc
+        stats['rows'] += len(df)
+    if preproc_config and preproc_config['validate']:
+        with stage('validate') as stats:
+            stats['rows'] += len(df)
+            df, rejected = validate_dataframe(df, get_catalog(redshift_config).column_definitions(table_name))
+            save_rejected_rows(rejected, bucket, key, preproc_config['error_prefix'])
+        if df.empty:
+            logger.warning(f'File {key} has no valid rows, nothing to load')
+            return None
+    if fingerprint is not None:
+        with stage('fingerprint') as stats:
+            stats['rows'] += len(df)
+            blocks = list(fingerprint.filter([df]))
+            df = pd.concat(blocks, ignore_index=True) if blocks else df.iloc[0:0]
+        if df.empty:
+            return None #Unchanged since the last load
+    with stage('save_dataframe_to_s3') as stats:
+        min_part_rows = preproc_config['min_part_rows'] if preproc_config else 100000
+        parts = save_dataframe_parts_to_s3(df, bucket, key2, staging_parts(redshift_config, preproc_config),
+                                           staging_format, table_name, min_part_rows) #Save in the staging format for COPY command
+        size = sum(part_size for _, part_size in parts)
+        stats['rows'] += len(df)
+        stats['bytes'] += size
+    if len(parts) == 1:
+        s3_path, parts = parts[0][0], []
+    return PreparedFile(key, table_name, s3_path, size, staging_format, tuple(staging_columns(df)), len(df), parts=tuple(parts))
+
+def prepare_file_streaming(redshift_config: Dict[str, Union[str, int]],
+                           bucket: str,
+                           key: str,
+                           preproc_config: Dict[str, Union[bool, int, str]],
+                           fingerprint: Optional[BlockFingerprint] = None
+                           ) -> Optional[PreparedFile]:
+    """
+    Same as prepare_file, but the file is read, formatted and staged in chunks so memory use
+    does not grow with the number of rows.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file, decoded (see s3_preproc.object_key).
+        preproc_config (dict): Preprocessing parameters from get_preproc_config_params.
+        fingerprint (BlockFingerprint, optional): Only the blocks of rows it lets through are staged.
+
+    Returns:
+        Optional[PreparedFile]: The staged file, or None if the file is not compatible.
+    """
+    filename = key.split('/')[-1] #Expecting files from a special upload folder
+    targetfile, chunks = load_file_chunks(bucket, key, preproc_config['chunksize'], preproc_config['sheet_name'],
+                                          preproc_config['excel_engine'], parse_dtypes(redshift_config, filename, preproc_config),
+                                          raw_key=True)
+    if not targetfile:
+        logger.info(f'File {key} detected, but not compatible')
+        return None
+
+    chunks = timed('load_file', chunks) #Stages below are timed per chunk, as the upload pulls them
+    first = next(chunks, None)
+    with stage('check_columns') as stats:
+        stats['rows'] += 0 if first is None else len(first)
+        table_name = table_for_file(redshift_config, first, filename) if first is not None else None #Every chunk shares the header
+        if table_name is None:
+            return None
+
+    staging_format = preproc_config['staging_format']
+    key2 = staging_key(filename, staging_format)
+    s3_path = f"s3://{bucket}/{key2}"
+    formatted = timed('format_for_table', (format_for_table(chunk, table_name, filename) for chunk in itertools.chain([first], chunks)))
+    rejected: List[pd.DataFrame] = []
+    if preproc_config['validate']:
+        formatted = timed('validate', validate_chunks(formatted, get_catalog(redshift_config).column_definitions(table_name), rejected))
+    if fingerprint is not None:
+        formatted = timed('fingerprint', fingerprint.filter(formatted))
+    with stage('save_dataframe_to_s3') as stats:
+        parts = stream_dataframe_parts_to_s3(_counted(formatted, stats), bucket, key2, staging_parts(redshift_config, preproc_config),
+                                             preproc_config['part_size'], staging_format, table_name)
+        size = sum(part_size for _, part_size in parts)
+        stats['bytes'] += size
+    if rejected:
+        with stage('validate'), _discarded_on_error(parts):
+            save_rejected_rows(pd.concat(rejected, ignore_index=True), bucket, filename, preproc_config['error_prefix'])
+    if len(parts) == 1:
+        s3_path, parts = parts[0][0], [] #A short file may fit in the first part alone
+    return PreparedFile(filename, table_name, s3_path, size, staging_format, tuple(staging_columns(first)), stats['rows'],
+                        parts=tuple(parts))
+
+def prepare_file_in_processes(redshift_config: Dict[str, Union[str, int]],
+                              bucket: str,
+                              key: str,
+                              preproc_config: Dict[str, Union[bool, int, str]],
+                              pool: ProcessPoolExecutor,
+                              processes: int,
+                              fingerprint: Optional[BlockFingerprint] = None
+                              ) -> Optional[PreparedFile]:
+    """
+    Same as prepare_file, but parsing, formatting, validation and encoding run in the worker
+    processes of pool, so a large file uses every core. Every piece of the file is written by its
+    worker straight to its own staged object, and the pieces are loaded by one manifest COPY.
+
+    With split_csv enabled, CSV files are split by byte range on line boundaries (see
+    process_pool.read_line_range) and every worker downloads and parses its own range. Quoted
+    fields spanning lines would be cut, so by default CSV files are handled like workbooks, which
+    cannot be split before they are parsed: this process reads them chunk by chunk and the workers
+    take the rest of the work.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file, decoded (see s3_preproc.object_key).
+        preproc_config (dict): Preprocessing parameters from get_preproc_config_params.
+        pool (ProcessPoolExecutor): Pool from process_pool.get_process_pool.
+        processes (int): Number of workers of the pool.
+        fingerprint (BlockFingerprint, optional): Only the blocks of rows it lets through are staged.
+            Every worker fingerprints the blocks inside its piece, the blocks across pieces are hashed here.
+
+    Returns:
+        Optional[PreparedFile]: The staged file, or None if the file is not compatible or has no rows to load.
+    """
+    extension = key.split('.')[-1].lower()
+    filename = key.split('/')[-1] #Expecting files from a special upload folder
+    staging_format = preproc_config['staging_format']
+    key2 = staging_key(filename, staging_format)
+    dtypes = parse_dtypes(redshift_config, filename, preproc_config)
+
+    def task(index: int, table_name: str, definitions, **piece) -> StagingTask:
+        if fingerprint is not None:
+            piece.update(previous_blocks=fingerprint.previous, block_rows=fingerprint.block_rows)
+        return StagingTask(bucket, key, part_key(key2, index + 1), filename, table_name, staging_format,
+                           preproc_config['part_size'], preproc_config['chunksize'], definitions, **piece)
+
+    if extension == 'csv' and preproc_config['split_csv']:
+        with stage('load_file'):
+            size = object_size(bucket, key, raw_key=True)
+            header = header_line(bucket, key)
+        with stage('check_columns'):
+            first = pd.read_csv(BytesIO(header), nrows=0) if header is not None else None
+            #Only the header is read here, a new table is profiled from the first lines of the file
+            sample = lambda: pd.read_csv(BytesIO(header + read_line_range(bucket, key, len(header), len(header) + READ_BLOCK_SIZE)))
+            table_name = table_for_file(redshift_config, first, filename, sample) if first is not None else None
+            if table_name is None:
+                return None
+        definitions = get_catalog(redshift_config).column_definitions(table_name) if preproc_config['validate'] else None
+        #At least one range per worker, more for very large files so a worker holds at most process_range_size bytes
+        ranges = max(processes, -(-(size - len(header)) // preproc_config['process_range_size']))
+        bounds = [len(header) + (size - len(header)) * index // ranges for index in range(ranges + 1)]
+        futures = [pool.submit(stage_part, task(index, table_name, definitions, header=header,
+                                                start=bounds[index], end=bounds[index + 1], dtypes=dtypes))
+                   for index in range(ranges)]
+    else:
+        targetfile, chunks = load_file_chunks(bucket, key, preproc_config['chunksize'], preproc_config['sheet_name'],
+                                              preproc_config['excel_engine'], dtypes, raw_key=True)
+        if not targetfile:
+            logger.info(f'File {key} detected, but not compatible')
+            return None
+        chunks = timed('load_file', chunks)
+        first = next(chunks, None)
+        with stage('check_columns'):
+            table_name = table_for_file(redshift_config, first, filename) if first is not None else None
+            if table_name is None:
+                return None
+        definitions = get_catalog(redshift_config).column_definitions(table_name) if preproc_config['validate'] else None
+        futures = []
+        for index, chunk in enumerate(itertools.chain([first], chunks)):
+            pending = [future for future in futures if not future.done()]
+            if len(pending) >= 2 * processes:
+                wait(pending, return_when=FIRST_COMPLETED) #Bounds the parsed chunks waiting for a worker
+            futures.append(pool.submit(stage_part, task(index, table_name, definitions, frame=chunk)))
+
+    pieces = collect_parts(futures, bucket)
+    parts = [(piece.s3_path, piece.size) for piece in pieces if piece.s3_path is not None]
+    rows = sum(piece.rows for piece in pieces)
+    if fingerprint is not None:
+        with stage('fingerprint') as stats, _discarded_on_error(parts):
+            #Blocks across two pieces are hashed here, the workers only hash the blocks inside their piece
+            edges = list(fingerprint.extend_pieces(pieces))
+            if edges:
+                edge_rows = concat_frames(edges)
+                edge_key = part_key(key2, len(pieces) + 1)
+                parts.append((f's3://{bucket}/{edge_key}', save_dataframe_to_s3(edge_rows, bucket, edge_key, staging_format, table_name)))
+                rows += len(edge_rows)
+                stats['rows'] += len(edge_rows)
+    rejected = [piece.rejected for piece in pieces if piece.rejected is not None]
+    if rejected:
+        with stage('validate'), _discarded_on_error(parts):
+            save_rejected_rows(pd.concat(rejected, ignore_index=True), bucket, filename, preproc_config['error_prefix'])
+    if not parts:
+        if fingerprint is None or not fingerprint.unchanged:
+            logger.warning(f'File {key} has no valid rows, nothing to load')
+        return None
+    staged_size = sum(part_size for _, part_size in parts)
+    s3_path = f"s3://{bucket}/{key2}"
+    if len(parts) == 1:
+        s3_path, parts = parts[0][0], []
+    return PreparedFile(filename, table_name, s3_path, staged_size, staging_format, tuple(staging_columns(first)), rows,
+                        parts=tuple(parts))
+
+@contextmanager
+def _discarded_on_error(parts: List[Tuple[str, int]]) -> Iterator[None]:
+    #Staged objects of an attempt that fails afterwards are deleted, a retry stages the file again
+    try:
+        yield
+    except Exception:
+        discard_staged(s3_path for s3_path, _ in parts)
+        raise
+
+def _counted(chunks: Iterable[pd.DataFrame], stats: Dict[str, Union[int, float]]) -> Iterator[pd.DataFrame]:
+    for chunk in chunks:
+        stats['rows'] += len(chunk)
+        yield chunk
+
+def save_rejected_rows(rejected: pd.DataFrame, bucket: str, filename: str, error_prefix: str) -> None:
+    """
+    Write the rows rejected by validation to the error folder of the bucket, so they can be fixed
+    and uploaded again. Does nothing if no row was rejected.
+
+    Parameters:
+        rejected (pd.DataFrame): Rejected rows with their reject_reason column.
+        bucket (str): The S3 bucket of the uploaded file.
+        filename (str): Name of the uploaded file.
+        error_prefix (str): Folder in the bucket that receives the rejected rows.
+    """
+    if rejected.empty:
+        return
+    error_key = rejected_rows_key(filename, error_prefix)
+    save_dataframe_to_s3(rejected, bucket, error_key)
+    logger.warning(f'{len(rejected)} rows of {filename} rejected, see s3://{bucket}/{error_key}')
+
+def load_prepared_file(redshift_config: Dict[str, Union[str, int]],
+                       bucket: str,
+                       prepared: PreparedFile,
+                       batcher: Optional[CopyBatcher] = None,
+                       on_commit: Optional[Callable[[], None]] = None,
+                       on_error: Optional[Callable[[Exception], None]] = None
+                       ) -> None:
+    """
+    Second half of the ETL: COPY a staged file into its table, or queue it for a batched COPY.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        prepared (PreparedFile): The staged file returned by prepare_file.
+        batcher (CopyBatcher, optional): If given, the staged file is queued for a batched COPY
+            instead of being copied right away.
+        on_commit (callable, optional): Called once the data is committed in Redshift.
+        on_error (callable, optional): Called by the batcher if its batched COPY of the file fails.
+            Errors of a direct COPY are raised to the caller.
+    """
+    trace = prepared.trace or FileTrace(bucket, prepared.filename)
+    if batcher is not None:
+        batcher.add(prepared.table_name, StagedFile(prepared.s3_path, prepared.size, prepared.staging_format,
+                                                    prepared.columns, trace.committed(on_commit),
+                                                    trace.failed(on_error), trace, prepared.ledger_entry,
+                                                    prepared.parts))
+    else:
+        ledger_entries = [prepared.ledger_entry] if prepared.ledger_entry is not None else None
+        staged = [s3_path for s3_path, _ in prepared.entries()] #Deleted once nothing will read them again
+        start = time.perf_counter()
+        try:
+            s3_path, manifest = prepared.s3_path, False
+            if prepared.parts:
+                #One manifest COPY over all the parts, so every slice loads some of them
+                manifest_key = f"{prepared.s3_path[len(f's3://{bucket}/'):]}.manifest"
+                save_manifest_to_s3(prepared.entries(), bucket, manifest_key)
+                s3_path, manifest = f's3://{bucket}/{manifest_key}', True
+                staged.append(s3_path)
+            copy_data_from_s3_to_redshift(redshift_config, s3_path, prepared.table_name, manifest=manifest,
+                                          staging_format=prepared.staging_format, columns=list(prepared.columns),
+                                          ledger_entries=ledger_entries)
+        except AlreadyLoaded:
+            trace.finish('duplicate') #Loaded by someone else since the lookup, nothing was copied
+            delete_when_loaded(staged)
+            if on_commit is not None:
+                on_commit()
+            return
+        except Exception as error:
+            trace.record('copy_data_from_s3_to_redshift', time.perf_counter() - start)
+            trace.finish('failed', error)
+            discard_staged(staged) #A redelivery stages the file again under new keys
+            raise error
+        trace.record('copy_data_from_s3_to_redshift', time.perf_counter() - start, prepared.rows, prepared.size)
+        delete_when_loaded(staged)
+        trace.committed(on_commit)()
+    logger.info(f'File {prepared.filename} from bucket {bucket} is a valid file')
+
+def process_file(redshift_config: Dict[str, Union[str, int]],
+                 bucket: str,
+                 key: str,
+                 batcher: Optional[CopyBatcher] = None,
+                 preproc_config: Optional[Dict[str, Union[bool, int, str]]] = None,
+                 on_commit: Optional[Callable[[], None]] = None,
+                 on_error: Optional[Callable[[Exception], None]] = None,
+                 raw_key: bool = False
+                 ) -> None:
+    """
+    Run the whole ETL for a single uploaded file: load, validate, format, stage and COPY.
+
+    Parameters:
+        redshift_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        bucket (str): The S3 bucket of the uploaded file.
+        key (str): The key of the uploaded file.
+        batcher (CopyBatcher, optional): If given, the staged file is queued for a batched COPY.
+        preproc_config (dict, optional): Preprocessing parameters from get_preproc_config_params.
+        on_commit (callable, optional): Called once the file is loaded, or right away if the file
+            is not compatible and there is nothing to load.
+        on_error (callable, optional): Called if a batched COPY of the file fails.
+        raw_key (bool): The key is listed from the bucket, not encoded as in S3 events.
+    """
+    prepared = call_with_retries(prepare_file, redshift_config, bucket, key, preproc_config, raw_key) #Transient S3 and Redshift errors
+    if prepared is not None:
+        load_prepared_file(redshift_config, bucket, prepared, batcher, on_commit, on_error)
+    elif on_commit is not None:
+        on_commit()
@@ -0,0 +1,228 @@
+import os
+import threading
+import multiprocessing
+import pandas as pd
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_EXCEPTION
+from typing import Dict, List, Union, Optional, Iterator, NamedTuple, FrozenSet, Tuple
+import s3_preproc
+from s3_preproc import format_for_table, delete_keys, _StagingSink
+from validation import validate_chunks
+from fingerprint import BlockFingerprint
+from frame_dtypes import FrameDtypes
+from file_readers import read_csv_chunks
+from metrics import FileTrace, activate, stage, timed, current_trace, add_memory
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEADER_PROBE_SIZE = 64 * 1024 #Bytes read from the start of a CSV file to find its header line
+READ_BLOCK_SIZE = 1024 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+def pool_size(processes: Union[int, str, None]) -> int:
+    """
+    Number of worker processes for the processes setting: a fixed number, 'auto' for one per
+    core, 0 or None to keep every file in the calling process.
+    """
+    if processes == 'auto':
+        return os.cpu_count() or 1
+    return max(int(processes or 0), 0)
+
+def get_process_pool(processes: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Return the process pool shared by every file of the consumer, started on first use.
+
+    Workers are spawned rather than forked: the consumer runs threads (SQS poller, file workers)
+    and holds open connections that a forked child must not inherit. Where processes cannot be
+    started (e.g. AWS Lambda has no /dev/shm for the pool semaphores) None is returned and files
+    are processed in the calling process.
+
+    Parameters:
+        processes (int): Number of worker processes.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None and _pool_size >= 0:
+            try:
+                _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+                _pool_size = processes
+            except OSError as error:
+                logger.warning("Process pool not available, files are processed in a single process: %s", error)
+                _pool_size = -1 #Do not try again
+        return _pool
+
+def shutdown_process_pool() -> None:
+    """
+    Stop the worker processes, waiting for the tasks they are running.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool, _pool_size = None, 0
+
+class StagingTask(NamedTuple):
+    #Everything a worker needs to stage one piece of a file, sent to it pickled
+    bucket: str
+    key: str
+    part_key: str
+    filename: str
+    table_name: str
+    staging_format: str
+    part_size: int
+    chunksize: int
+    column_definitions: Optional[List[Dict[str, Union[str, int, None]]]]
+    header: bytes = b''
+    start: int = 0
+    end: int = 0
+    frame: Optional[pd.DataFrame] = None
+    previous_blocks: Optional[FrozenSet[str]] = None #Fingerprint of the last loaded version, None to stage every row
+    block_rows: int = 0
+    dtypes: Optional[FrameDtypes] = None #Compact dtypes a byte range is parsed with
+
+class StagedPart(NamedTuple):
+    #What a worker sends back: the staged object (None if no row was left) and its share of the trace
+    s3_path: Optional[str]
+    size: int
+    rows: int
+    rejected: Optional[pd.DataFrame]
+    stages: Dict[str, Dict[str, Union[int, float]]]
+    blocks: Tuple[Tuple[str, int], ...] = () #(hash, rows) of the fingerprinted blocks of the piece
+    changed_rows: int = 0
+    memory: Optional[Dict] = None #Memory report of the first DataFrame the worker parsed, see metrics.add_memory
+    head: Optional[pd.DataFrame] = None #Rows of blocks shared with the neighbouring pieces, see BlockFingerprint.filter_piece
+    tail: Optional[pd.DataFrame] = None
+    bounded: bool = False
+
+def read_line_range(bucket: str, key: str, start: int, end: int) -> bytes:
+    """
+    Download the whole lines of a text object that start at an offset in [start, end). A line that
+    starts before start belongs to the previous range and one that ends after end is read to its
+    end, so consecutive ranges cover every line exactly once. A range starting at 0 skips the first
+    line, the header.
+
+    Lines are split on newlines, quoted fields spanning several lines are not supported, which is why
+    splitting is opt-in (Preproc.split_csv).
+    """
+    offset = max(start - 1, 0) #Reading from the byte before tells whether a line starts at start
+    body = s3_preproc.s3.get_object(Bucket=bucket, Key=key, Range=f'bytes={offset}-')['Body']
+    data = bytearray()
+    try:
+        while True:
+            block = body.read(READ_BLOCK_SIZE)
+            data += block
+            first = data.find(b'\n')
+            if first < 0:
+                if not block:
+                    return b''
+                continue
+            if offset + first + 1 >= end:
+                return b'' #No line starts in the range
+            stop = data.find(b'\n', max(end - offset - 1, first + 1))
+            if stop >= 0:
+                return bytes(data[first + 1:stop + 1])
+            if not block:
+                return bytes(data[first + 1:])
+    finally:
+        body.close()
+
+def _parse_range(task: StagingTask) -> Iterator[pd.DataFrame]:
+    with stage('load_file') as stats:
+        data = read_line_range(task.bucket, task.key, task.start, task.end)
+        stats['bytes'] += len(data)
+    if not data.strip():
+        return iter(())
+    return _measured(read_csv_chunks(BytesIO(task.header + data), task.chunksize, task.dtypes))
+
+def _measured(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    for chunk in chunks:
+        add_memory(chunk)
+        yield chunk
+
+def stage_part(task: StagingTask) -> StagedPart:
+    """
+    Worker side: parse, format, validate and stage one piece of a file as its own S3 object.
+    The piece is a byte range of a CSV file (task.start, task.end) or an already parsed chunk
+    (task.frame).
+    """
+    trace = FileTrace(task.bucket, task.key) #Only collects the timings, the parent publishes the file trace
+    rejected: List[pd.DataFrame] = []
+    sink = None
+    rows = 0
+    with activate(trace):
+        try:
+            chunks = timed('load_file', _parse_range(task)) if task.frame is None else iter([task.frame])
+            chunks = timed('format_for_table', (format_for_table(chunk, task.table_name, task.filename) for chunk in chunks))
+            if task.column_definitions is not None:
+                chunks = timed('validate', validate_chunks(chunks, task.column_definitions, rejected))
+            fingerprint = None
+            if task.previous_blocks is not None:
+                fingerprint = BlockFingerprint(task.previous_blocks, task.block_rows)
+                chunks = timed('fingerprint', fingerprint.filter_piece(chunks))
+            with stage('save_dataframe_to_s3') as stats:
+                for chunk in chunks:
+                    if chunk.empty:
+                        continue
+                    if sink is None:
+                        sink = _StagingSink(task.bucket, task.part_key, task.part_size, task.staging_format, task.table_name)
+                    sink.write(chunk)
+                    rows += len(chunk)
+                size = sink.finish() if sink is not None else 0
+                stats['rows'] += rows
+                stats['bytes'] += size
+        except Exception as error:
+            if sink is not None and not sink.finished:
+                sink.abort()
+            raise error
+    s3_path = f's3://{task.bucket}/{task.part_key}' if sink is not None else None
+    return StagedPart(s3_path, size, rows, pd.concat(rejected, ignore_index=True) if rejected else None, trace.stages,
+                      tuple(fingerprint.blocks) if fingerprint is not None else (),
+                      fingerprint.changed_rows if fingerprint is not None else 0, trace.memory,
+                      *((fingerprint.head, fingerprint.tail, fingerprint.bounded) if fingerprint is not None else ()))
+
+def header_line(bucket: str, key: str) -> Optional[bytes]:
+    """
+    First line of a text object, with its newline. None if the start of the object has no complete line.
+    """
+    body = s3_preproc.s3.get_object(Bucket=bucket, Key=key, Range=f'bytes=0-{HEADER_PROBE_SIZE - 1}')['Body']
+    probe = body.read()
+    end = probe.find(b'\n')
+    return None if end < 0 else probe[:end + 1]
+
+def collect_parts(futures: List[Future], bucket: str) -> List[StagedPart]:
+    """
+    Wait for the pieces of a file and add the timings of the workers to the active trace, summed
+    over the workers. On the first failure the pending pieces are cancelled and the objects already
+    staged for the file are deleted, so a retry starts clean, then the error is raised.
+
+    Returns:
+        List[StagedPart]: The pieces in submission order.
+    """
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = next((future for future in done if future.exception() is not None), None)
+    if failed is None:
+        parts = [future.result() for future in futures]
+        _merge(parts)
+        return parts
+    for future in futures:
+        future.cancel()
+    wait(futures)
+    staged = [future.result().s3_path for future in futures
+              if not future.cancelled() and future.exception() is None and future.result().s3_path]
+    if staged:
+        delete_keys(bucket, [path.split('/', 3)[3] for path in staged])
+    raise failed.exception()
+
+def _merge(parts: List[StagedPart]) -> None:
+    trace = current_trace()
+    if trace is None:
+        return
+    for part in parts:
+        for name, stats in part.stages.items():
+            trace.record(name, stats['seconds'], stats['rows'], stats['bytes'])
+        if part.memory is not None:
+            trace.add_memory(part.memory)
@@ -1,10 +1,14 @@
 import yaml
 import boto3
-import psycopg2
 import logging
-from sql_queries import QUERY_TABLE_NAMES, CREATE_GENDER_SUBMISSION, CREATE_TRAIN_DATA, CREATE_TEST_DATA, QUERY_COL_NAMES
+from connection_pool import get_pool
+from schema_catalog import get_catalog
+from sql_queries import QUERY_TABLE_NAMES, TABLE_DDL, INTERNAL_TABLE_DDL, QUERY_COL_NAMES, COPY_FORMAT_OPTIONS
+from sql_queries import QUERY_SLICE_COUNT, MERGE_CREATE_STAGE, MERGE_DEDUPE_STAGE, MERGE_DELETE, MERGE_INSERT, MERGE_STATEMENT, MERGE_DROP_STAGE, MERGE_STRATEGIES
+from ingestion_ledger import LedgerEntry, AlreadyLoaded, record_entries
+from failure_policy import call_redshift
 from botocore.exceptions import ClientError
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Optional, Tuple
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -56,6 +60,12 @@ def get_rs_config_params() -> Dict[str, Union[str, int]]:
             - user (str): The username.
             - password (str): The password retrieved from the config file or Secrets Manager.
             - iam_role (str): The ARN from the IAM Role used to copy data to the cluster
+            - pool_max_size (int): Maximum number of pooled connections.
+            - pool_idle_timeout (int): Seconds an idle pooled connection is kept open.
+            - pool_health_check_interval (int): Seconds of idleness before a pooled connection is probed.
+            - catalog_ttl (int): Seconds the cached schema catalog is considered fresh.
+            - merge (dict): Tables loaded in merge mode, {table: {'keys': [...], 'strategy': ...}}.
+              Strategy is delete_insert (default) or merge. Other tables are appended to.
     """
 
     with open('config/config.yaml', 'r') as file: 
@@ -71,6 +81,14 @@ def get_rs_config_params() -> Dict[str, Union[str, int]]:
     else:
         password = get_secret(config['SecretsManager']['secret_name'], config['Region'])
     iam_role = config['Redshift']['iam_role']
+    pool = config['Redshift'].get('pool', {})
+    catalog_ttl = config['Redshift'].get('catalog_ttl', 300)
+    merge = {}
+    for table, options in (config['Redshift'].get('merge') or {}).items():
+        strategy = options.get('strategy', 'delete_insert')
+        if strategy not in MERGE_STRATEGIES:
+            raise ValueError(f'Unknown merge strategy {strategy} for {table}, expected one of {list(MERGE_STRATEGIES)}')
+        merge[table] = {'keys': [key.lower() for key in options['keys']], 'strategy': strategy}
 
     return {
         'host': host,
@@ -78,7 +96,12 @@ def get_rs_config_params() -> Dict[str, Union[str, int]]:
         'dbname': dbname,
         'user': user,
         'password': password,
-        'iam_role': iam_role
+        'iam_role': iam_role,
+        'pool_max_size': pool.get('max_size', 4),
+        'pool_idle_timeout': pool.get('idle_timeout', 300),
+        'pool_health_check_interval': pool.get('health_check_interval', 30),
+        'catalog_ttl': catalog_ttl,
+        'merge': merge
     }
 
 def retrieve_table_names(config_params: Dict[str, Union[str, int]]) -> List[str]:
@@ -102,14 +125,8 @@ def retrieve_table_names(config_params: Dict[str, Union[str, int]]) -> List[str]
     redshift_tables  = []
 
     try:
-        # Establish connection to Redshift
-        with psycopg2.connect(
-            host=config_params['host'],
-            port=config_params['port'],
-            dbname=config_params['dbname'],
-            user=config_params['user'],
-            password=config_params['password']
-        ) as connection:
+        # Borrow a pooled connection to Redshift
+        with get_pool(config_params).connection() as connection:
             with connection.cursor() as cursor:
 
                 cursor.execute(QUERY_TABLE_NAMES)
@@ -147,21 +164,11 @@ def ensure_required_tables(config_params: Dict[str, Union[str, int]]) -> None:
     """
 
     try:
-        # Establish connection to Redshift
-        with psycopg2.connect(
-            host=config_params['host'],
-            port=config_params['port'],
-            dbname=config_params['dbname'],
-            user=config_params['user'],
-            password=config_params['password']
-        ) as connection:
+        # Borrow a pooled connection to Redshift
+        with get_pool(config_params).connection() as connection:
             with connection.cursor() as cursor:
 
-                table_queries = {
-                    'gender_submission': CREATE_GENDER_SUBMISSION, 
-                    'train_data': CREATE_TRAIN_DATA,
-                    'test_data': CREATE_TEST_DATA
-                }
+                table_queries = {**TABLE_DDL, **INTERNAL_TABLE_DDL}
                 
                 cursor.execute(QUERY_TABLE_NAMES)
                 tables = cursor.fetchall() #Obtain all tables and schemes
@@ -170,19 +177,28 @@ def ensure_required_tables(config_params: Dict[str, Union[str, int]]) -> None:
                 for _, tablename in tables:
                     redshift_tables.append(tablename)
 
+                created = False
                 for table in table_queries.keys():
                     if table not in redshift_tables :
                         cursor.execute(table_queries[table])
                         connection.commit()
+                        created = True
         
     except Exception as error:
         logger.error("Error connecting to Redshift: %s", error)
         raise error
+
+    if created:
+        get_catalog(config_params).refresh() #New tables must be visible to routing right away
         
 
 def copy_data_from_s3_to_redshift(config_params: Dict[str, Union[str, int]], 
                                   s3_path: str, 
                                   target_table: str, 
+                                  manifest: bool = False,
+                                  staging_format: str = 'csv',
+                                  columns: Optional[List[str]] = None,
+                                  ledger_entries: Optional[List[LedgerEntry]] = None
                                   ) -> None:
     """
     Copy data from an S3 bucket to a Redshift table using the COPY command.
@@ -197,39 +213,147 @@ def copy_data_from_s3_to_redshift(config_params: Dict[str, Union[str, int]],
             - iam_role (str): The ARN of the IAM role that grants access to S3.
         s3_path (str): The full S3 path to the file, e.g., 's3://bucket_name/file.csv'.
         target_table (str): The name of the destination table in Redshift.
+        manifest (bool): If True, s3_path points to a COPY manifest listing the files to load.
+            Tables listed in config_params['merge'] are upserted on their keys instead of appended to.
+        staging_format (str): Format of the staged files: csv, csv_gzip, csv_zstd or parquet.
+        columns (List[str], optional): Target columns in file order. If None, the file must hold
+            every non IDENTITY column of the table in table order.
+        ledger_entries (List[LedgerEntry], optional): Objects loaded by this COPY. They are written
+            to the ingestion ledger in the same transaction.
 
     Returns:
         None
 
     Raises:
+        AlreadyLoaded: If one of the ledger entries was already recorded. Nothing is loaded.
+        CircuitOpen: If Redshift is unavailable, see failure_policy.CircuitBreaker.
         Exception: If an error occurs during the data copy process.
     """
 
+    merge = config_params.get('merge', {}).get(target_table)
+    before, after = [], []
+    copy_table = target_table
+    if merge is not None:
+        copy_table = f'{target_table}_merge_stage'
+        before, after = merge_statements(target_table, copy_table, columns, merge['keys'], merge['strategy'])
+
+    column_list = f"({', '.join(columns)})" if columns else ''
     copy_command = f"""
-        COPY {target_table}
+        COPY {copy_table} {column_list}
         FROM '{s3_path}'
         IAM_ROLE '{config_params['iam_role']}'
-        CSV
-        IGNOREHEADER 1;
+        {'MANIFEST' if manifest else ''}
+        {COPY_FORMAT_OPTIONS[staging_format]};
     """
     
-    try:
-        with psycopg2.connect(
-            host=config_params['host'],
-            port=config_params['port'],
-            dbname=config_params['dbname'],
-            user=config_params['user'],
-            password=config_params['password']
-        ) as connection:
+    def run_copy() -> None:
+        with get_pool(config_params).connection() as connection:
             with connection.cursor() as cursor:
 
+                if ledger_entries:
+                    record_entries(cursor, ledger_entries) #Rolled back with the COPY if anything fails
+                for statement in before:
+                    cursor.execute(statement)
                 cursor.execute(copy_command)
-                connection.commit()
+                for statement in after:
+                    cursor.execute(statement)
+                connection.commit() #Merge mode: the target only changes here, all at once
 
+    try:
+        call_redshift(run_copy) #Transient failures retried, fails fast while Redshift is unavailable
+
+    except AlreadyLoaded as error:
+        logger.info("Skipping COPY into %s: %s", target_table, error)
+        raise error
     except Exception as error:
         logger.error("Error loading data to Redshift: %s", error)
         raise error
 
+_slice_counts: Dict[tuple, int] = {}
+
+def get_slice_count(config_params: Dict[str, Union[str, int]]) -> int:
+    """
+    Number of slices of the cluster, queried once per process from stv_slices.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters.
+
+    Returns:
+        int: The slice count, or 1 if stv_slices cannot be read (e.g. the user lacks access to it).
+            Only a permission error is remembered, other failures are queried again on the next call.
+    """
+    cluster_key = (config_params['host'], config_params['port'])
+    if cluster_key not in _slice_counts:
+        try:
+            with get_pool(config_params).connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(QUERY_SLICE_COUNT)
+                    slices = cursor.fetchone()[0]
+        except Exception as error:
+            if getattr(error, 'pgcode', None) != '42501': #insufficient_privilege, it will not change until restart
+                logger.warning("Could not read the slice count, this file will not be split: %s", error)
+                return 1
+            logger.warning("Could not read the slice count, staged files will not be split: %s", error)
+            slices = 1
+        _slice_counts[cluster_key] = max(int(slices), 1)
+    return _slice_counts[cluster_key]
+
+def merge_statements(target_table: str,
+                     stage_table: str,
+                     columns: Optional[List[str]],
+                     keys: List[str],
+                     strategy: str = 'delete_insert'
+                     ) -> Tuple[List[str], List[str]]:
+    """
+    Statements that surround a COPY into stage_table to upsert its rows into target_table.
+
+    With delete_insert the target rows whose keys appear in the stage are deleted and the staged
+    rows inserted. With merge a single MERGE updates the matched rows and inserts the rest. Both
+    are set-based, so only the keys present in the file are touched. The staged rows are first
+    reduced to one per key (see MERGE_DEDUPE_STAGE), so a key repeated in the files is neither
+    inserted twice nor matched twice by MERGE.
+
+    Parameters:
+        target_table (str): The table to upsert into.
+        stage_table (str): Name of the session temp table the COPY loads.
+        columns (List[str]): Loaded columns, in file order. Required in merge mode.
+        keys (List[str]): Columns that identify a row, e.g. ['passengerid'].
+        strategy (str): 'delete_insert' or 'merge'.
+
+    Returns:
+        Tuple[List[str], List[str]]: Statements to run before the COPY and after it.
+
+    Raises:
+        ValueError: If the columns are unknown or do not include every key.
+    """
+    if not columns:
+        raise ValueError(f'Merge loading into {target_table} needs the list of loaded columns')
+    missing = [key for key in keys if key not in columns]
+    if missing:
+        raise ValueError(f'Merge keys {missing} of {target_table} are not among the loaded columns')
+
+    column_list = ', '.join(columns)
+    unique_table = f'{stage_table}_unique'
+    condition = ' AND '.join(f'{target_table}.{key} = {unique_table}.{key}' for key in keys)
+    before = [MERGE_CREATE_STAGE.format(stage=stage_table, columns=column_list, target=target_table)]
+    updated = [column for column in columns if column not in keys]
+    after = [MERGE_DEDUPE_STAGE.format(unique=unique_table, stage=stage_table, columns=column_list,
+                                       keys=', '.join(keys), order=', '.join(updated or keys))]
+    if strategy == 'merge' and updated:
+        after.append(MERGE_STATEMENT.format(
+            target=target_table,
+            stage=unique_table,
+            condition=condition,
+            assignments=', '.join(f'{column} = {unique_table}.{column}' for column in updated),
+            columns=column_list,
+            values=', '.join(f'{unique_table}.{column}' for column in columns)
+        ))
+    else:
+        after += [MERGE_DELETE.format(target=target_table, stage=unique_table, condition=condition),
+                  MERGE_INSERT.format(target=target_table, columns=column_list, stage=unique_table)]
+    after += [MERGE_DROP_STAGE.format(stage=unique_table), MERGE_DROP_STAGE.format(stage=stage_table)]
+    return before, after
+
 def query_col_names(config_params: Dict[str, Union[str, int]], table_name: str) -> List[str]:
     """
     Retrieve the column names for a given table from Redshift.
@@ -255,13 +379,7 @@ def query_col_names(config_params: Dict[str, Union[str, int]], table_name: str)
     columns = []
     
     try:
-        with psycopg2.connect(
-            host=config_params['host'],
-            port=config_params['port'],
-            dbname=config_params['dbname'],
-            user=config_params['user'],
-            password=config_params['password']
-        ) as connection:
+        with get_pool(config_params).connection() as connection:
             with connection.cursor() as cursor:
                 cursor.execute(query)
                 response = cursor.fetchall()
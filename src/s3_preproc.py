@@ -1,51 +1,237 @@
 
 import json
+import time
+import uuid
+import zlib
+import yaml
 import boto3
+import shutil
+import tempfile
 import pandas as pd
 from io import BytesIO, StringIO
-import difflib
-from typing import List, Tuple, Optional, Dict, Union
-from redshift_loader import query_col_names, retrieve_table_names
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict, Union, Iterator, Iterable, IO
+from file_readers import READERS, SEEKABLE_FORMATS, SheetSelector, read_chunks
+from schema_catalog import get_catalog
+from table_router import TableRouter, route_file
+from frame_dtypes import FrameDtypes, concat_frames
+from metrics import add_bytes, add_memory
 import logging
 
 logger = logging.getLogger(__name__)
 
 s3 = boto3.client('s3')
 
-def load_file(bucket: str, key: str) -> Tuple[bool, Optional[pd.DataFrame]]:
+MIN_PART_SIZE = 5 * 1024 * 1024 #S3 rejects multipart parts smaller than 5 MiB, except the last one
+SPOOL_MAX_SIZE = 64 * 1024 * 1024 #Workbooks larger than this are spooled to disk instead of memory
+STAGING_THREADS = 8 #Parts of an in-memory DataFrame encoded and uploaded at the same time
+MAX_DELETE_KEYS = 1000 #DeleteObjects takes at most 1000 keys per request
+
+STAGING_SUFFIXES = {
+    'csv': '.csv',
+    'csv_gzip': '.csv.gz',
+    'csv_zstd': '.csv.zst',
+    'parquet': '.parquet'
+}
+
+def get_preproc_config_params() -> Dict[str, Union[bool, int, str]]:
+    """
+    Load the preprocessing parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with preprocessing parameters:
+            - streaming (bool): Whether files are processed chunk by chunk.
+            - chunksize (int): Number of rows parsed and transformed at a time when streaming.
+            - part_size (int): Size in bytes of every multipart upload part sent to S3.
+            - staging_format (str): Format of the staged files, one of csv, csv_gzip, csv_zstd or parquet.
+            - excel_engine (str): Engine for workbooks: auto, calamine or openpyxl.
+            - sheet_name (int, str or list): Sheets read from workbooks.
+            - validate (bool): Whether rows are checked against the table definition before staging.
+            - error_prefix (str): Folder in the bucket that receives the rejected rows.
+            - ledger (bool): Whether files already recorded in the ingestion ledger are skipped.
+            - staging_parts (int or 'auto'): Objects every staged file is split into, so the COPY
+              runs on several slices. 'auto' uses the number of slices of the cluster.
+            - min_part_rows (int): Rows below which an in-memory file is split in fewer parts.
+            - processes (int or 'auto'): Worker processes that parse, validate and encode large
+              files in parallel. 'auto' starts one per core, 0 keeps every file in the consumer process.
+            - process_min_size (int): Files of at least this many bytes go to the worker processes.
+            - process_range_size (int): Bytes of a CSV file parsed by a worker at a time.
+            - split_csv (bool): Whether the workers download and parse byte ranges of a CSV file on their
+              own. Ranges are cut on line boundaries, so only enable it for files without quoted fields
+              that span lines. Otherwise CSV files are parsed by the consumer process, like workbooks.
+            - fingerprint (bool): Whether content already loaded is skipped: a file whose ETag and
+              size match a loaded object is not downloaded, and from a new version of an object
+              loaded into a merge table only the blocks of rows that changed are loaded. Needs the ledger.
+            - fingerprint_block_rows (int): Average rows per fingerprinted block.
+            - compact_dtypes (bool): Whether files are parsed with dtypes derived from their table:
+              categoricals for short text columns, Arrow backed strings and the narrowest numbers.
+            - category_max_length (int): Text columns declared this short or shorter are categoricals.
+            - string_storage (str): Storage of the other text columns, pyarrow or python.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    preproc = config.get('Preproc', {})
+    staging_format = preproc.get('staging_format', 'csv')
+    if staging_format not in STAGING_SUFFIXES:
+        raise ValueError(f'Unknown staging format {staging_format}, expected one of {list(STAGING_SUFFIXES)}')
+
+    return {
+        'streaming': preproc.get('streaming', False),
+        'chunksize': preproc.get('chunksize', 50000),
+        'part_size': max(preproc.get('part_size', 8 * 1024 * 1024), MIN_PART_SIZE),
+        'staging_format': staging_format,
+        'excel_engine': preproc.get('excel_engine', 'auto'),
+        'sheet_name': preproc.get('sheet_name', 0),
+        'validate': preproc.get('validate', False),
+        'error_prefix': preproc.get('error_prefix', 'Errors/'),
+        'ledger': preproc.get('ledger', False),
+        'staging_parts': preproc.get('staging_parts', 1),
+        'min_part_rows': preproc.get('min_part_rows', 100000),
+        'processes': preproc.get('processes', 0),
+        'process_min_size': preproc.get('process_min_size', 64 * 1024 * 1024),
+        'process_range_size': max(preproc.get('process_range_size', 64 * 1024 * 1024), 1024 * 1024),
+        'split_csv': preproc.get('split_csv', False),
+        'fingerprint': preproc.get('ledger', False) and preproc.get('fingerprint', False),
+        'fingerprint_block_rows': preproc.get('fingerprint_block_rows', 10000),
+        'compact_dtypes': preproc.get('compact_dtypes', False),
+        'category_max_length': preproc.get('category_max_length', 8),
+        'string_storage': preproc.get('string_storage', 'pyarrow')
+    }
+
+def object_key(key: str, raw_key: bool = False) -> str:
+    """
+    Key of an S3 object. S3 events encode spaces in keys as '+', keys listed from the bucket are raw.
+
+    Parameters:
+        key (str): The key as the S3 event gives it, or as listed if raw_key.
+        raw_key (bool): The key is not encoded.
+    """
+    return key if raw_key else key.replace('+', ' ')
+
+def _open_s3_file(bucket: str, key: str, extension: str) -> IO:
+    #CSV is parsed straight from the StreamingBody. Workbooks need random access, so they are spooled
+    #to a temporary file that only stays in memory while small
+    response = s3.get_object(Bucket=bucket, Key=key)
+    add_bytes('load_file', response['ContentLength'])
+    if extension not in SEEKABLE_FORMATS:
+        return response['Body']
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(response['Body'], spool, 1024 * 1024)
+    spool.seek(0)
+    return spool
+
+def object_identity(bucket: str, key: str, raw_key: bool = False) -> Tuple[str, Optional[str], int]:
+    """
+    Identify the current content of an S3 object with a HEAD request, without downloading it.
+
+    Parameters:
+        bucket (str): The name of the S3 bucket.
+        key (str): The key (path) of the file in the S3 bucket.
+        raw_key (bool): The key is not encoded as in S3 events, see object_key.
+
+    Returns:
+        Tuple[str, Optional[str], int]:
+            - str: The ETag of the object, without quotes.
+            - Optional[str]: Its version id, None if the bucket is not versioned.
+            - int: Its size in bytes.
+    """
+    response = s3.head_object(Bucket=bucket, Key=object_key(key, raw_key))
+    version_id = response.get('VersionId')
+    return (response['ETag'].strip('"'), None if version_id in (None, 'null') else version_id,
+            response['ContentLength'])
+
+def object_size(bucket: str, key: str, raw_key: bool = False) -> int:
+    """
+    Size in bytes of an S3 object, from a HEAD request.
+    """
+    return s3.head_object(Bucket=bucket, Key=object_key(key, raw_key))['ContentLength']
+
+def load_file(bucket: str,
+              key: str,
+              sheet_name: SheetSelector = 0,
+              excel_engine: str = 'auto',
+              dtypes: Optional[FrameDtypes] = None,
+              raw_key: bool = False
+              ) -> Tuple[bool, Optional[pd.DataFrame]]:
     """
     Load a file from an S3 bucket and convert it to a pandas DataFrame if the file extension is allowed.
 
     Parameters:
         bucket (str): The name of the S3 bucket.
         key (str): The key (path) of the file in the S3 bucket.
+        sheet_name (int, str or list): Sheets to read from workbooks. Several sheets are concatenated.
+        excel_engine (str): Engine for workbooks: 'auto', 'calamine' or 'openpyxl'.
+        dtypes (FrameDtypes, optional): Compact dtypes of the target table, applied while parsing.
+        raw_key (bool): The key is not encoded as in S3 events, see object_key.
 
     Returns:
         Tuple[bool, Optional[pd.DataFrame]]:
             - bool: True if the file was successfully loaded and converted, False otherwise.
             - Optional[pd.DataFrame]: The resulting DataFrame if the file extension is allowed; otherwise, None.
     """
-    allowed_extensions = {'xlsx', 'xls', 'csv'}
     extension = key.split('.')[-1].lower()  # Use the last part after a dot as extension
 
-    if extension in allowed_extensions:
+    if extension in READERS:
         # Replace '+' characters with spaces in the key.
-        key = key.replace('+', ' ')
-        response = s3.get_object(Bucket=bucket, Key=key)
-        file_content = response['Body'].read()
-        file_io = BytesIO(file_content)
-        if extension == 'csv':
-            df = pd.read_csv(file_io)
+        key = object_key(key, raw_key)
+        with _open_s3_file(bucket, key, extension) as file_io:
+            frames = list(read_chunks(file_io, extension, None, sheet_name, excel_engine, dtypes))
+        if not frames:
+            df = pd.DataFrame() #Only blank sheets, handled as a file without rows
         else:
-            df = pd.read_excel(file_io, engine='openpyxl')
+            df = concat_frames(frames) #Sheets parsed apart keep their categoricals
+        add_memory(df)
         return True, df
     else:
         return False, None
 
+def load_file_chunks(bucket: str,
+                     key: str,
+                     chunksize: int = 50000,
+                     sheet_name: SheetSelector = 0,
+                     excel_engine: str = 'auto',
+                     dtypes: Optional[FrameDtypes] = None,
+                     raw_key: bool = False
+                     ) -> Tuple[bool, Optional[Iterator[pd.DataFrame]]]:
+    """
+    Stream a file from an S3 bucket as an iterator of pandas DataFrames. CSV files are never read
+    whole into memory; workbooks are spooled to a temporary file and read row by row when the
+    openpyxl engine is used.
+
+    Parameters:
+        bucket (str): The name of the S3 bucket.
+        key (str): The key (path) of the file in the S3 bucket.
+        chunksize (int): Number of rows in every DataFrame.
+        sheet_name (int, str or list): Sheets to read from workbooks, in order.
+        excel_engine (str): Engine for workbooks: 'auto', 'calamine' or 'openpyxl'.
+        dtypes (FrameDtypes, optional): Compact dtypes of the target table, applied while parsing.
+        raw_key (bool): The key is not encoded as in S3 events, see object_key.
+
+    Returns:
+        Tuple[bool, Optional[Iterator[pd.DataFrame]]]:
+            - bool: True if the file extension is allowed and the stream was opened, False otherwise.
+            - Optional[Iterator[pd.DataFrame]]: The chunks of the file; otherwise, None.
+    """
+    extension = key.split('.')[-1].lower()
+    if extension not in READERS:
+        return False, None
+
+    key = object_key(key, raw_key)
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        with _open_s3_file(bucket, key, extension) as file_io:
+            for chunk in read_chunks(file_io, extension, chunksize, sheet_name, excel_engine, dtypes):
+                add_memory(chunk)
+                yield chunk
+
+    return True, chunks()
+
 def decide_table_for_file(filename: str, table_names: List[str], cutoff: float = 0.4) -> Optional[str]:
     """
     Decide which table to use based on the similarity between the filename and available table names.
-    In the future we could augment precision by using RapidFuzz o fuzzywuzzy, or even a NLP best suited library.
+    One-off version of the routing index, the pipeline uses the shared router from table_router.get_router.
 
     Parameters:
         filename (str): The name of the file (including extension) to be processed.
@@ -55,16 +241,7 @@ def decide_table_for_file(filename: str, table_names: List[str], cutoff: float =
     Returns:
         Optional[str]: The table name that best matches the filename, or None if no match exceeds the cutoff.
     """
-    # Remove the extension and convert to lowercase.
-    base_name = filename.split('.')[0].lower()
-    
-    # Use difflib to obtain the closest match.
-    matches = difflib.get_close_matches(base_name, table_names, n=1, cutoff=cutoff)
-    
-    if matches:
-        return matches[0]
-    else:
-        return None
+    return TableRouter(table_names, cutoff=cutoff, cache_size=0).route(filename)
 
 
 def check_columns(
@@ -76,8 +253,8 @@ def check_columns(
     Check if the DataFrame columns match the expected columns for the Redshift table 
     inferred from the filename.
 
-    This function retrieves the list of available table names from Redshift, determines 
-    the appropriate table based on the filename, retrieves the expected column names for that table, 
+    This function reads the list of available table names from the cached schema catalog, determines 
+    the appropriate table based on the filename, reads the expected column names for that table, 
     and then checks whether each column in the DataFrame (in lowercase) is present in the expected columns.
 
     Parameters:
@@ -93,13 +270,13 @@ def check_columns(
     Returns:
         bool: True if all columns in the DataFrame are found in the expected column names; False otherwise.
     """
-    all_tables = retrieve_table_names(rs_config)
-    table_name = decide_table_for_file(filename, all_tables)
+    catalog = get_catalog(rs_config)
+    table_name = route_file(rs_config, filename)
     
     if table_name is None:
         return False
         
-    col_names = query_col_names(rs_config, table_name)
+    col_names = catalog.columns(table_name)
     check = True
     for column in df.columns:
         in_expected = column.lower() in col_names
@@ -107,19 +284,387 @@ def check_columns(
     
     return check
 
-def save_dataframe_to_s3(df: pd.DataFrame, bucket: str, key: str) -> None:
+class S3MultipartWriter:
     """
-    Saves a pandas DataFrame to an S3 bucket as a CSV file.
+    Write-only file object that uploads what is written to it as an S3 multipart upload.
+
+    Parameters:
+        bucket (str): Name of the S3 bucket.
+        key (str): Key of the object to create.
+        part_size (int): Bytes buffered before a part is uploaded (at least 5 MiB).
+    """
+
+    def __init__(self, bucket: str, key: str, part_size: int = 8 * 1024 * 1024) -> None:
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.closed = False
+        self._upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        self._parts: List[Dict[str, Union[str, int]]] = []
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass #Parts are only sent once they reach the minimum size
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self.closed = True #Writers such as pyarrow close their sink, finish() completes the upload
+
+    def _upload_part(self) -> None:
+        number = len(self._parts) + 1
+        response = s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                  PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': number})
+        self._buffer.clear()
+
+    def finish(self) -> int:
+        """
+        Upload the remaining bytes and complete the multipart upload.
+
+        Returns:
+            int: Total number of bytes written to the object.
+        """
+        if self._buffer or not self._parts:
+            self._upload_part() #The last part may be smaller than the minimum
+        s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                     MultipartUpload={'Parts': self._parts})
+        self.closed = True
+        return self._position
+
+    def abort(self) -> None:
+        """
+        Cancel the multipart upload and discard the uploaded parts.
+        """
+        self.closed = True
+        s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+class _NoCompression:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+def part_key(key: str, index: int) -> str:
+    """
+    Key of one part of a staged file split in several objects, e.g. Tmp/train-<run>-autogen.csv.gz ->
+    Tmp/train-<run>-autogen.part0001.csv.gz.
+    """
+    for suffix in sorted(STAGING_SUFFIXES.values(), key=len, reverse=True):
+        if key.endswith(suffix):
+            return f'{key[:-len(suffix)]}.part{index:04d}{suffix}'
+    return f'{key}.part{index:04d}'
+
+def _compressor(staging_format: str):
+    #Incremental compressor for the CSV staging formats, so chunks can be compressed as they stream
+    if staging_format == 'csv_gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31) #wbits=31 writes a gzip container
+    if staging_format == 'csv_zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compressobj()
+    return _NoCompression()
+
+def staging_columns(df: pd.DataFrame) -> List[str]:
+    """
+    Column names of a staged DataFrame as Redshift knows them (lowercase), in file order.
+    """
+    return [str(column).lower() for column in df.columns]
+
+def dataframe_to_arrow(df: pd.DataFrame, table_name: Optional[str] = None):
+    """
+    Convert a DataFrame to an Arrow table typed after the table's DDL in sql_queries.py.
+
+    Parameters:
+      - df: DataFrame to convert.
+      - table_name: Target table. Columns it does not declare keep the type pandas infers.
+
+    Returns:
+      - pyarrow.Table with lowercase column names.
+    """
+    import pyarrow as pa
+    from table_schema import get_table_schema, arrow_type
+
+    declared = {column.name: column.redshift_type for column in (get_table_schema(table_name) or [])}
+    arrays = []
+    for column, name in zip(df.columns, staging_columns(df)):
+        array = pa.array(df[column], from_pandas=True)
+        if pa.types.is_dictionary(array.type):
+            array = array.dictionary_decode() #Categorical columns are staged as their values
+        if name in declared:
+            target = arrow_type(declared[name])
+            if not array.type.equals(target):
+                try:
+                    array = array.cast(target)
+                except pa.ArrowNotImplementedError:
+                    array = array.cast(pa.string()).cast(target) #e.g. float -> decimal goes through text
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=staging_columns(df))
+
+class _StagingSink:
+    #Encodes DataFrames in a staging format straight into one multipart upload
+    def __init__(self, bucket: str, key: str, part_size: int, staging_format: str, table_name: Optional[str]) -> None:
+        self.key = key
+        self.finished = False
+        self._writer = S3MultipartWriter(bucket, key, part_size)
+        self._staging_format = staging_format
+        self._table_name = table_name
+        self._compressor = None if staging_format == 'parquet' else _compressor(staging_format)
+        self._parquet_writer = None
+        self._header = True
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self._compressor is None:
+            import pyarrow.parquet as pq
+            table = dataframe_to_arrow(chunk, self._table_name)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self._writer, table.schema)
+            self._parquet_writer.write_table(table) #One row group per chunk
+        else:
+            self._writer.write(self._compressor.compress(chunk.to_csv(index=False, header=self._header).encode('utf-8')))
+            self._header = False #Every object has a single header
+
+    def finish(self) -> int:
+        if self._compressor is None:
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+        else:
+            self._writer.write(self._compressor.flush())
+        size = self._writer.finish()
+        self.finished = True
+        return size
+
+    def abort(self) -> None:
+        self._writer.abort()
+
+def save_dataframe_to_s3(df: pd.DataFrame,
+                         bucket: str,
+                         key: str,
+                         staging_format: str = 'csv',
+                         table_name: Optional[str] = None
+                         ) -> int:
+    """
+    Saves a pandas DataFrame to an S3 bucket in the given staging format.
 
     Parameters:
       - df: DataFrame to be saved.
       - bucket: Name of the S3 bucket.
       - key: Path and file name within the bucket (e.g., 'folder/data.csv').
+      - staging_format: One of csv, csv_gzip, csv_zstd or parquet.
+      - table_name: Target table, used to type the Parquet columns.
+
+    Returns:
+      - The number of bytes written to S3.
+    """
+    if staging_format == 'parquet':
+        import pyarrow.parquet as pq
+        buffer = BytesIO()
+        pq.write_table(dataframe_to_arrow(df, table_name), buffer)
+        body = buffer.getvalue()
+    else:
+        csv_buffer = StringIO()
+        df.to_csv(csv_buffer, index=False)
+        compressor = _compressor(staging_format)
+        body = compressor.compress(csv_buffer.getvalue().encode('utf-8')) + compressor.flush()
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+    return len(body)
+
+def stream_dataframes_to_s3(chunks: Iterable[pd.DataFrame],
+                            bucket: str,
+                            key: str,
+                            part_size: int = 8 * 1024 * 1024,
+                            staging_format: str = 'csv',
+                            table_name: Optional[str] = None
+                            ) -> int:
+    """
+    Saves a sequence of DataFrames to a single object in S3 using a multipart upload, so only
+    about one part is held in memory at a time.
+
+    Parameters:
+      - chunks: DataFrames with the same columns, written in order. CSV output has a single header.
+      - bucket: Name of the S3 bucket.
+      - key: Path and file name within the bucket (e.g., 'folder/data.csv').
+      - part_size: Bytes buffered before a part is uploaded (at least 5 MiB).
+      - staging_format: One of csv, csv_gzip, csv_zstd or parquet.
+      - table_name: Target table, used to type the Parquet columns.
+
+    Returns:
+      - The number of bytes written to S3.
+    """
+    sink = _StagingSink(bucket, key, part_size, staging_format, table_name)
+    try:
+        for chunk in chunks:
+            sink.write(chunk)
+        return sink.finish()
+    except Exception as error:
+        logger.error("Error streaming %s to S3, aborting upload: %s", key, error)
+        sink.abort()
+        raise error
+
+def stream_dataframe_parts_to_s3(chunks: Iterable[pd.DataFrame],
+                                 bucket: str,
+                                 key: str,
+                                 parts: int = 1,
+                                 part_size: int = 8 * 1024 * 1024,
+                                 staging_format: str = 'csv',
+                                 table_name: Optional[str] = None
+                                 ) -> List[Tuple[str, int]]:
+    """
+    Same as stream_dataframes_to_s3, but the chunks are dealt round-robin into up to parts objects,
+    each a complete file in the staging format, so a manifest COPY loads them on several slices.
+    Files with fewer chunks than parts produce fewer objects. Up to parts multipart uploads are
+    open at once, each buffering up to part_size bytes.
+
+    Parameters:
+      - chunks: DataFrames with the same columns.
+      - bucket: Name of the S3 bucket.
+      - key: Key of the staged file. With a single part it is used as is, see part_key otherwise.
+      - parts: Maximum number of objects.
+      - part_size: Bytes buffered before a multipart upload part is sent (at least 5 MiB).
+      - staging_format: One of csv, csv_gzip, csv_zstd or parquet.
+      - table_name: Target table, used to type the Parquet columns.
+
+    Returns:
+      - (s3 path, size in bytes) of every object written.
+    """
+    if parts <= 1:
+        return [(f's3://{bucket}/{key}', stream_dataframes_to_s3(chunks, bucket, key, part_size, staging_format, table_name))]
+    sinks: List[_StagingSink] = []
+    try:
+        for index, chunk in enumerate(chunks):
+            if index < parts:
+                sinks.append(_StagingSink(bucket, part_key(key, index + 1), part_size, staging_format, table_name))
+            sinks[index % parts].write(chunk)
+        if not sinks:
+            sinks.append(_StagingSink(bucket, key, part_size, staging_format, table_name))
+        return [(f's3://{bucket}/{sink.key}', sink.finish()) for sink in sinks]
+    except Exception as error:
+        logger.error("Error streaming %s to S3, aborting upload: %s", key, error)
+        for sink in sinks:
+            if not sink.finished:
+                sink.abort()
+        finished = [sink.key for sink in sinks if sink.finished]
+        if finished:
+            delete_keys(bucket, finished) #Parts already written would be left behind by a retry
+        raise error
+
+def save_dataframe_parts_to_s3(df: pd.DataFrame,
+                               bucket: str,
+                               key: str,
+                               parts: int = 1,
+                               staging_format: str = 'csv',
+                               table_name: Optional[str] = None,
+                               min_part_rows: int = 100000
+                               ) -> List[Tuple[str, int]]:
+    """
+    Same as save_dataframe_to_s3, but the rows are split evenly into up to parts objects that are
+    encoded and uploaded in parallel, so a manifest COPY loads them on several slices.
+
+    Parameters:
+      - df: DataFrame to be saved.
+      - bucket: Name of the S3 bucket.
+      - key: Key of the staged file. With a single part it is used as is, see part_key otherwise.
+      - parts: Maximum number of objects.
+      - staging_format: One of csv, csv_gzip, csv_zstd or parquet.
+      - table_name: Target table, used to type the Parquet columns.
+      - min_part_rows: Smaller DataFrames are split in fewer parts, tiny objects only add overhead.
+
+    Returns:
+      - (s3 path, size in bytes) of every object written.
+    """
+    parts = max(1, min(parts, len(df) // max(min_part_rows, 1)))
+    if parts == 1:
+        return [(f's3://{bucket}/{key}', save_dataframe_to_s3(df, bucket, key, staging_format, table_name))]
+    bounds = [len(df) * index // parts for index in range(parts + 1)]
+    keys = [part_key(key, index + 1) for index in range(parts)]
+    try:
+        with ThreadPoolExecutor(max_workers=min(parts, STAGING_THREADS)) as executor:
+            sizes = executor.map(lambda index: save_dataframe_to_s3(df.iloc[bounds[index]:bounds[index + 1]], bucket,
+                                                                    keys[index], staging_format, table_name), range(parts))
+            return [(f's3://{bucket}/{part}', size) for part, size in zip(keys, sizes)]
+    except Exception as error:
+        logger.error("Error staging the parts of %s, deleting them: %s", key, error)
+        delete_keys(bucket, keys) #Parts already written would be left behind by a retry
+        raise error
+
+def delete_keys(bucket: str, keys: List[str]) -> int:
+    """
+    Delete objects with DeleteObjects requests of up to 1000 keys, the most S3 takes at once.
+
+    Parameters:
+      - bucket: Name of the S3 bucket.
+      - keys: Keys to delete. Missing keys count as deleted.
+
+    Returns:
+      - The number of keys S3 could not delete, they are logged.
     """
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_bytes = csv_buffer.getvalue().encode('utf-8')
-    s3.put_object(Bucket=bucket, Key=key, Body=csv_bytes)
+    failed = 0
+    for start in range(0, len(keys), MAX_DELETE_KEYS):
+        batch = keys[start:start + MAX_DELETE_KEYS]
+        response = s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.warning("Could not delete s3://%s/%s: %s", bucket, error.get('Key'), error.get('Message'))
+            failed += 1
+    return failed
+
+def delete_staged_objects(bucket: str, entries: List[Tuple[str, int]]) -> None:
+    """
+    Delete staged objects that will not be loaded.
+
+    Parameters:
+      - bucket: Name of the S3 bucket.
+      - entries: (s3 path, size in bytes) of the objects, as returned by the staging functions.
+    """
+    delete_keys(bucket, [s3_path[len(f's3://{bucket}/'):] for s3_path, _ in entries])
+
+def run_id() -> str:
+    """
+    Timestamp and random suffix that make the keys written for one processing run unique,
+    e.g. 20240131T101500-3f2a9c1d.
+    """
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+def staging_key(filename: str, staging_format: str, prefix: str = 'Tmp/') -> str:
+    """
+    Key of the staged file of an upload, unique for every run: two uploads with the same name, or
+    a retry of the same upload, never write over an object a COPY may still be reading.
+    e.g. train.csv -> Tmp/train-20240131T101500-3f2a9c1d-autogen.csv.gz
+
+    Parameters:
+      - filename: Name of the uploaded file.
+      - staging_format: One of csv, csv_gzip, csv_zstd or parquet.
+      - prefix: Folder of the staged files, a Tmp folder is needed in the bucket.
+    """
+    return f"{prefix}{filename.split('.')[0]}-{run_id()}-autogen{STAGING_SUFFIXES[staging_format]}"
+
+def save_manifest_to_s3(entries: List[Tuple[str, int]], bucket: str, key: str) -> None:
+    """
+    Saves a Redshift COPY manifest listing several staged files.
+
+    Parameters:
+      - entries: List of (s3 path, size in bytes) for every file to load.
+      - bucket: Name of the S3 bucket.
+      - key: Path and file name of the manifest within the bucket (e.g., 'Tmp/manifests/x.manifest').
+    """
+    manifest = {
+        'entries': [
+            {'url': s3_path, 'mandatory': True, 'meta': {'content_length': size}}
+            for s3_path, size in entries
+        ]
+    }
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'))
 
 def format_for_table(df: pd.DataFrame, table_name: str, filename: str) -> pd.DataFrame:
     """
@@ -129,15 +674,7 @@ def format_for_table(df: pd.DataFrame, table_name: str, filename: str) -> pd.Dat
       - df: DataFrame to be formated.
       - table_name: Target table.
     """
-    base_name = filename.split('.')[0].lower()
-    candidates = ['train', 'test']
-    matches = difflib.get_close_matches(base_name, candidates, n=1, cutoff=0.8)
-    if not matches:
-        matches = None
-    else:
-        matches = matches[0]
-    
-    if table_name == 'gender_submission' or table_name == 'train':
+    if table_name == 'gender_submission' or table_name == 'train_data':
         df['Survived'] = df['Survived'].map({0: 'false', 1: 'true'})
     
     return df
\ No newline at end of file
@@ -0,0 +1,136 @@
+import time
+import threading
+import logging
+from connection_pool import get_pool
+from failure_policy import call_redshift
+from sql_queries import QUERY_CATALOG
+from typing import Dict, Union, List, Tuple, Optional
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SchemaCatalog:
+    """
+    In-process cache of the Redshift catalog: table names and their column definitions.
+
+    The whole catalog is loaded with a single query and kept for ttl seconds. Callers that know the
+    catalog changed (e.g. after creating a table) call refresh() or invalidate().
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters as returned by
+            get_rs_config_params.
+        ttl (float): Seconds a loaded catalog is considered fresh.
+    """
+
+    def __init__(self, config_params: Dict[str, Union[str, int]], ttl: float = 300) -> None:
+        self.config_params = config_params
+        self.ttl = ttl
+        self._tables: Dict[str, List[Dict[str, Union[str, int, None]]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.version = 0 #Bumped whenever the set of tables changes, see table_router.get_router
+
+    def _load(self) -> Dict[str, List[Dict[str, Union[str, int, None]]]]:
+        tables = {}
+        def query() -> List[Tuple]:
+            with get_pool(self.config_params).connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(QUERY_CATALOG)
+                    return cursor.fetchall()
+
+        try:
+            rows = call_redshift(query) #Retried, and fails fast while Redshift is unavailable
+        except Exception as error:
+            logger.error("Error retrieving the catalog from Redshift: %s", error)
+            raise error
+
+        for tablename, column_name, data_type, char_length, precision, scale, is_nullable, default in rows:
+            columns = tables.setdefault(tablename, [])
+            if column_name is not None:
+                columns.append({
+                    'name': column_name,
+                    'data_type': data_type,
+                    'character_maximum_length': char_length,
+                    'numeric_precision': precision,
+                    'numeric_scale': scale,
+                    'nullable': is_nullable == 'YES',
+                    'default': default
+                })
+        return tables
+
+    def refresh(self) -> None:
+        """
+        Reload the catalog from Redshift right away.
+        """
+        tables = self._load()
+        with self._lock:
+            if tables.keys() != self._tables.keys():
+                self.version += 1
+            self._tables = tables
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """
+        Mark the catalog as stale so the next read reloads it.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def _snapshot(self) -> Dict[str, List[Dict[str, Union[str, int, None]]]]:
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+            if fresh:
+                return self._tables
+        self.refresh()
+        with self._lock:
+            return self._tables
+
+    def table_names(self) -> List[str]:
+        """
+        Returns:
+            List[str]: Names of every user table in the database.
+        """
+        return list(self._snapshot().keys())
+
+    def columns(self, table_name: str) -> List[str]:
+        """
+        Parameters:
+            table_name (str): The table to look up.
+
+        Returns:
+            List[str]: Column names of the table in ordinal order, empty if the table is unknown.
+        """
+        return [column['name'] for column in self._snapshot().get(table_name, [])]
+
+    def column_definitions(self, table_name: str) -> List[Dict[str, Union[str, int, None]]]:
+        """
+        Parameters:
+            table_name (str): The table to look up.
+
+        Returns:
+            List[dict]: One dictionary per column in ordinal order with the keys name, data_type,
+                character_maximum_length, numeric_precision, numeric_scale, nullable and default.
+        """
+        return list(self._snapshot().get(table_name, []))
+
+
+_catalogs: Dict[Tuple, SchemaCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(config_params: Dict[str, Union[str, int]]) -> SchemaCatalog:
+    """
+    Return the process-wide schema catalog for the given Redshift parameters, creating it on first use.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): Redshift connection parameters as returned by
+            get_rs_config_params. The optional catalog_ttl key sets the cache lifetime in seconds.
+
+    Returns:
+        SchemaCatalog: The shared catalog for that cluster and database.
+    """
+    catalog_key = (config_params['host'], config_params['port'], config_params['dbname'])
+    with _catalogs_lock:
+        catalog = _catalogs.get(catalog_key)
+        if catalog is None:
+            catalog = SchemaCatalog(config_params, ttl=config_params.get('catalog_ttl', 300))
+            _catalogs[catalog_key] = catalog
+        return catalog
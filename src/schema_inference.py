@@ -0,0 +1,313 @@
+import re
+import math
+import yaml
+import threading
+import pandas as pd
+from connection_pool import get_pool
+from schema_catalog import get_catalog
+from table_router import route_file, explicit_route
+from s3_preproc import check_columns
+from sql_queries import CREATE_INFERRED_TABLE, ALTER_ADD_COLUMN, INTERNAL_TABLE_DDL
+from typing import Dict, List, Union, Optional, NamedTuple, Callable
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INTEGER_TYPES = (('SMALLINT', 2**15 - 1), ('INTEGER', 2**31 - 1), ('BIGINT', 2**63 - 1))
+MAX_VARCHAR = 65535 #Redshift limit, in bytes
+BYTEDICT_MAX_DISTINCT = 255 #BYTEDICT keeps at most 256 values per block
+IDENTIFIER_RE = re.compile(r'^[a-z_][a-z0-9_]{0,126}$') #COPY column lists are not quoted, names must be plain identifiers
+DATE_RE = r'^\d{4}-\d{1,2}-\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$'
+BOOLEAN_VALUES = {'true', 'false', 't', 'f'}
+
+def get_inference_config_params() -> Dict[str, Union[bool, int, float]]:
+    """
+    Load the schema inference parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with inference parameters:
+            - enabled (bool): Whether files that match no table get one created from their content.
+            - evolve (bool): Whether columns a table lacks are added to it (ALTER TABLE ADD COLUMN).
+            - sample_rows (int): Rows profiled to infer the column types.
+            - headroom (float): Factor applied to the widest value and the integer range seen in the
+              sample, so later rows still fit.
+            - min_shared_columns (float): Share of the file columns the routed table must already
+              have before it is evolved, so a broad routing rule never grows an unrelated table.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    inference = config.get('SchemaInference', {})
+    return {
+        'enabled': inference.get('enabled', False),
+        'evolve': inference.get('evolve', False),
+        'sample_rows': inference.get('sample_rows', 10000),
+        'headroom': max(inference.get('headroom', 1.25), 1.0),
+        'min_shared_columns': inference.get('min_shared_columns', 0.5)
+    }
+
+class ColumnProfile(NamedTuple):
+    """
+    Column inferred from a sample of a file.
+
+    Attributes:
+        name (str): Column name, lowercased the way Redshift stores it.
+        redshift_type (str): Narrowest type that holds the sample, e.g. 'SMALLINT' or 'VARCHAR(24)'.
+        encoding (str): Compression encoding for the column.
+        distinct (int): Distinct non null values in the sample.
+        unique (bool): Whether every non null value of the sample is different.
+    """
+    name: str
+    redshift_type: str
+    encoding: str
+    distinct: int
+    unique: bool
+
+def _integer_type(values: pd.Series, headroom: float) -> str:
+    bound = max(abs(int(values.min())), abs(int(values.max()))) * headroom
+    return next((name for name, high in INTEGER_TYPES if bound <= high), 'BIGINT')
+
+def _varchar_width(text: pd.Series, headroom: float) -> int:
+    widest = int(text.str.encode('utf-8').str.len().max()) if len(text) else 0 #Redshift lengths are in bytes
+    return min(max(8 * math.ceil(widest * headroom / 8), 8), MAX_VARCHAR)
+
+def _text_type(text: pd.Series, headroom: float) -> str:
+    #Type of a column pandas left as text: booleans, numbers or dates written as strings, else VARCHAR
+    lowered = text.str.strip().str.lower()
+    if lowered.isin(BOOLEAN_VALUES).all():
+        return 'BOOLEAN'
+    numbers = pd.to_numeric(text, errors='coerce')
+    if numbers.notna().all() and not text.str.match(r'^\s*[+-]?0\d').any(): #Leading zeros are codes, not numbers
+        if (numbers % 1 == 0).all():
+            return _integer_type(numbers, headroom)
+        return 'DOUBLE PRECISION'
+    if text.str.match(DATE_RE).all():
+        dates = pd.to_datetime(text, errors='coerce')
+        if dates.notna().all():
+            return 'DATE' if (dates == dates.dt.normalize()).all() else 'TIMESTAMP'
+    return f'VARCHAR({_varchar_width(text, headroom)})'
+
+def profile_column(name: str, series: pd.Series, headroom: float = 1.25) -> ColumnProfile:
+    """
+    Infer the Redshift type and encoding of a column from sample values. Every check is vectorized
+    over the whole sample.
+
+    Parameters:
+        name (str): Column name.
+        series (pd.Series): Sample values.
+        headroom (float): Factor applied to the widest value and the integer range of the sample.
+
+    Returns:
+        ColumnProfile: The inferred column.
+    """
+    values = series.dropna()
+    if values.empty:
+        redshift_type = 'VARCHAR(256)' #Nothing to infer from, the widest a sample of nulls can reasonably ask for
+    elif pd.api.types.is_bool_dtype(values):
+        redshift_type = 'BOOLEAN'
+    elif pd.api.types.is_integer_dtype(values):
+        redshift_type = _integer_type(values, headroom)
+    elif pd.api.types.is_float_dtype(values):
+        #pandas reads integer columns with nulls as floats
+        redshift_type = _integer_type(values, headroom) if (values % 1 == 0).all() else 'DOUBLE PRECISION'
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        redshift_type = 'DATE' if (values == values.dt.normalize()).all() else 'TIMESTAMP'
+    else:
+        redshift_type = _text_type(values.astype(str), headroom)
+
+    distinct = int(values.nunique())
+    if redshift_type.startswith('VARCHAR'):
+        encoding = 'BYTEDICT' if distinct <= BYTEDICT_MAX_DISTINCT and distinct * 2 <= len(values) else 'ZSTD'
+    elif redshift_type in ('DOUBLE PRECISION', 'BOOLEAN'):
+        encoding = 'ZSTD' #AZ64 only takes integers, decimals, dates and timestamps
+    else:
+        encoding = 'AZ64'
+    return ColumnProfile(name.lower(), redshift_type, encoding, distinct, distinct == len(values))
+
+def profile_frame(df: pd.DataFrame, headroom: float = 1.25) -> List[ColumnProfile]:
+    """
+    Parameters:
+        df (pd.DataFrame): Sample of the file, with its original column names.
+        headroom (float): Factor applied to the widest value and the integer range of the sample.
+
+    Returns:
+        List[ColumnProfile]: One profile per column, in file order.
+    """
+    return [profile_column(str(column), df[column], headroom) for column in df.columns]
+
+def table_keys(profiles: List[ColumnProfile]) -> Dict[str, Optional[str]]:
+    """
+    Choose the distribution and sort keys of a new table.
+
+    The distribution key is an identifier column (named id or ending in id) whose sample values are
+    all different, so rows spread evenly over the slices and joins on it stay local. The sort key is
+    the first date or timestamp column, which is what range filters usually hit, and otherwise the
+    distribution key.
+
+    Returns:
+        dict: 'distkey' and 'sortkey', None where Redshift should decide (DISTSTYLE AUTO, no sort key).
+    """
+    distkey = next((profile.name for profile in profiles
+                    if profile.unique and profile.distinct > 1 and profile.name.endswith('id')
+                    and (profile.redshift_type in ('SMALLINT', 'INTEGER', 'BIGINT') or profile.redshift_type.startswith('VARCHAR'))),
+                   None)
+    sortkey = next((profile.name for profile in profiles if profile.redshift_type in ('DATE', 'TIMESTAMP')), distkey)
+    return {'distkey': distkey, 'sortkey': sortkey}
+
+def create_table_statement(table_name: str, profiles: List[ColumnProfile]) -> str:
+    """
+    Redshift DDL for a table holding the profiled columns. Columns are nullable, since a sample
+    without nulls says nothing about the rest of the data, and the first sort key column is left
+    uncompressed (RAW) so range restricted scans can skip blocks.
+
+    Parameters:
+        table_name (str): Name of the table.
+        profiles (List[ColumnProfile]): Its columns, see profile_frame.
+
+    Returns:
+        str: The CREATE TABLE statement.
+    """
+    keys = table_keys(profiles)
+    columns = ',\n'.join(f'    "{profile.name}" {profile.redshift_type} NULL '
+                         f'ENCODE {"RAW" if profile.name == keys["sortkey"] else profile.encoding}'
+                         for profile in profiles)
+    options = f'DISTSTYLE KEY DISTKEY("{keys["distkey"]}")' if keys['distkey'] else 'DISTSTYLE AUTO'
+    if keys['sortkey']:
+        options += f' SORTKEY("{keys["sortkey"]}")'
+    return CREATE_INFERRED_TABLE.format(table=table_name, columns=columns, options=options)
+
+def add_column_statements(table_name: str, profiles: List[ColumnProfile]) -> List[str]:
+    """
+    Parameters:
+        table_name (str): Name of the table.
+        profiles (List[ColumnProfile]): Columns missing from it.
+
+    Returns:
+        List[str]: One ALTER TABLE per column, Redshift adds a single column per statement.
+    """
+    return [ALTER_ADD_COLUMN.format(table=table_name, column=profile.name, type=profile.redshift_type, encoding=profile.encoding)
+            for profile in profiles]
+
+def inferred_table_name(filename: str) -> Optional[str]:
+    """
+    Name of the table created for a file: its lowercase stem without a trailing date or sequence
+    number, so 'sales_2024-05.csv' and 'sales_2024-06.csv' share the table sales.
+
+    Returns:
+        Optional[str]: The table name, or None if the stem gives no valid identifier.
+    """
+    stem = re.sub(r'\W+', '_', filename.split('.')[0].lower()).strip('_')
+    name = re.sub(r'[_\d]*\d[_\d]*$', '', stem).strip('_') or stem
+    if name and name[0].isdigit():
+        name = f't_{name}'
+    return name if IDENTIFIER_RE.match(name or '') and name not in INTERNAL_TABLE_DDL else None
+
+_provision_lock = threading.Lock()
+
+def provision_table(rs_config: Dict[str, Union[str, int]],
+                    table_name: str,
+                    sample: pd.DataFrame,
+                    headroom: float = 1.25
+                    ) -> List[str]:
+    """
+    Create a table from a sample of a file, or add the columns of the sample that an existing table
+    lacks, in one transaction, then reload the schema catalog so routing and validation see it.
+
+    Another consumer may provision the same table at the same time: if the statements fail but the
+    catalog then has every column of the sample, the table is used as it is.
+
+    Parameters:
+        rs_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        table_name (str): Table to create or evolve.
+        sample (pd.DataFrame): Sample of the file.
+        headroom (float): Factor applied to the widest value and the integer range of the sample.
+
+    Returns:
+        List[str]: The statements that were run, empty if the table already had every column.
+
+    Raises:
+        Exception: If the table could not be created or evolved.
+    """
+    catalog = get_catalog(rs_config)
+    with _provision_lock: #Consumer threads of this process provision one table at a time
+        existing = set(catalog.columns(table_name))
+        profiles = [profile for profile in profile_frame(sample, headroom) if profile.name not in existing]
+        if not profiles:
+            return []
+        statements = add_column_statements(table_name, profiles) if existing else [create_table_statement(table_name, profiles)]
+        try:
+            with get_pool(rs_config).connection() as connection:
+                with connection.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
+                    connection.commit()
+        except Exception as error:
+            catalog.refresh()
+            if all(profile.name in catalog.columns(table_name) for profile in profiles):
+                logger.info("Table %s was provisioned by another consumer", table_name)
+                return []
+            logger.error("Error provisioning table %s: %s", table_name, error)
+            raise error
+        catalog.refresh()
+    logger.info("Provisioned table %s:\n%s", table_name, '\n'.join(statements))
+    return statements
+
+_inference_config: Optional[Dict] = None
+
+def table_for_file(rs_config: Dict[str, Union[str, int]],
+                   df: pd.DataFrame,
+                   filename: str,
+                   sample: Optional[Callable[[], pd.DataFrame]] = None
+                   ) -> Optional[str]:
+    """
+    Decide the table of a file, provisioning it from the file content when schema inference is
+    enabled: a file that matches no table gets one named after it (see inferred_table_name), and
+    one routed to a table that lacks some of its columns gets them added when evolve is enabled,
+    if the file is named after the table or routed to it by a rule (never by a fuzzy match).
+
+    Parameters:
+        rs_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        df (pd.DataFrame): The file or its first chunk.
+        filename (str): The name of the file (including extension) to be processed.
+        sample (Callable, optional): Returns rows to profile when df only has the header.
+
+    Returns:
+        Optional[str]: The table, or None if the file is not compatible.
+    """
+    global _inference_config
+    if check_columns(rs_config, df, filename):
+        return route_file(rs_config, filename)
+    if _inference_config is None:
+        _inference_config = get_inference_config_params()
+    config = _inference_config
+    if not config['enabled']:
+        return None
+
+    columns = [str(column).lower() for column in df.columns]
+    invalid = [column for column in columns if not IDENTIFIER_RE.match(column)]
+    if invalid or len(set(columns)) != len(columns):
+        logger.warning(f'File {filename} has column names that are not plain identifiers or repeat: {invalid or columns}')
+        return None
+    table_name = route_file(rs_config, filename)
+    if table_name is not None:
+        if not config['evolve'] or explicit_route(rs_config, filename) != table_name:
+            return None #Tables are not to be changed, or only by files named after them or routed by a rule
+        shared = set(columns) & set(get_catalog(rs_config).columns(table_name))
+        if len(shared) < config['min_shared_columns'] * len(columns):
+            return None #Not the same dataset
+    else:
+        table_name = inferred_table_name(filename)
+        if table_name is None:
+            logger.warning(f'File {filename} matches no table and its name gives no valid table name')
+            return None
+
+    if df.empty and sample is not None:
+        df = sample()
+    if df.empty:
+        logger.info(f'File {filename} has no rows to profile a table from')
+        return None
+    if len(df) > config['sample_rows']:
+        df = df.sample(n=config['sample_rows'], random_state=0)
+    provision_table(rs_config, table_name, df, config['headroom'])
+    return table_name if check_columns(rs_config, df, table_name) else None
@@ -4,7 +4,8 @@
 QUERY_TABLE_NAMES = """
 SELECT schemaname, tablename
 FROM pg_catalog.pg_tables
-WHERE schemaname NOT IN ('pg_catalog', 'information_schema');
+WHERE schemaname NOT IN ('pg_catalog', 'information_schema')
+AND schemaname NOT LIKE 'pg_temp%';
 """
 
 CREATE_GENDER_SUBMISSION = """
@@ -50,10 +51,157 @@ CREATE TABLE test_data(
 ) DISTSTYLE AUTO;
 """
 
+# Tables the application needs, with the DDL used to create them -> redshift_loader.py, table_schema.py
+TABLE_DDL = {
+    'gender_submission': CREATE_GENDER_SUBMISSION,
+    'train_data': CREATE_TRAIN_DATA,
+    'test_data': CREATE_TEST_DATA
+}
+
+# Objects already loaded, one row per S3 object version committed by a COPY -> ingestion_ledger.py
+CREATE_INGESTION_LEDGER = """
+CREATE TABLE ingestion_ledger(
+    bucket VARCHAR(255) NOT NULL,
+    object_key VARCHAR(1024) NOT NULL,
+    etag VARCHAR(64) NOT NULL,
+    version_id VARCHAR(1024) NULL,
+    table_name VARCHAR(127) NOT NULL,
+    rows_loaded BIGINT NULL,
+    loaded_at TIMESTAMP DEFAULT GETDATE(),
+    object_size BIGINT NULL
+) DISTSTYLE ALL SORTKEY(bucket, object_key);
+"""
+
+# Content fingerprint of every loaded object version: the hash of each block of rows, whether or not
+# the block had to be copied. A new version of the object only loads the blocks that are not here -> fingerprint.py
+CREATE_INGESTION_BLOCKS = """
+CREATE TABLE ingestion_blocks(
+    bucket VARCHAR(255) NOT NULL,
+    object_key VARCHAR(1024) NOT NULL,
+    etag VARCHAR(64) NOT NULL,
+    block_index INTEGER NOT NULL,
+    block_hash CHAR(32) NOT NULL,
+    block_rows INTEGER NOT NULL
+) DISTSTYLE AUTO SORTKEY(bucket, object_key, etag);
+"""
+
+# Tables the application keeps for itself. They are created like TABLE_DDL, but files are never routed to them
+INTERNAL_TABLE_DDL = {
+    'ingestion_ledger': CREATE_INGESTION_LEDGER,
+    'ingestion_blocks': CREATE_INGESTION_BLOCKS
+}
+
+# Tables created from the profile of a file that matches no table, and columns added to the table
+# a file is routed to. Redshift adds one column per ALTER TABLE -> schema_inference.py
+CREATE_INFERRED_TABLE = """
+CREATE TABLE IF NOT EXISTS {table}(
+{columns}
+) {options};
+"""
+
+ALTER_ADD_COLUMN = 'ALTER TABLE {table} ADD COLUMN "{column}" {type} ENCODE {encoding};'
+
+QUERY_LEDGER_LOOKUP = """
+SELECT 1
+FROM ingestion_ledger
+WHERE bucket = %s AND object_key = %s AND etag = %s
+LIMIT 1;
+"""
+
+# Same content (ETag and size) already loaded into the table, under any key
+QUERY_LEDGER_CONTENT_LOOKUP = """
+SELECT object_key
+FROM ingestion_ledger
+WHERE etag = %s AND object_size = %s AND table_name = %s
+LIMIT 1;
+"""
+
+# Only inserts if the object is not in the ledger yet, rowcount tells whether it was new
+INSERT_LEDGER_ENTRY = """
+INSERT INTO ingestion_ledger (bucket, object_key, etag, version_id, table_name, rows_loaded, object_size)
+SELECT %s, %s, %s, %s, %s, %s, %s
+WHERE NOT EXISTS (
+    SELECT 1 FROM ingestion_ledger WHERE bucket = %s AND object_key = %s AND etag = %s
+);
+"""
+
+# Block hashes of the last loaded version of an object
+QUERY_LATEST_BLOCKS = """
+SELECT b.block_hash
+FROM ingestion_blocks b
+JOIN (
+    SELECT etag
+    FROM ingestion_ledger
+    WHERE bucket = %s AND object_key = %s
+    ORDER BY loaded_at DESC
+    LIMIT 1
+) latest ON b.etag = latest.etag
+WHERE b.bucket = %s AND b.object_key = %s;
+"""
+
+# Only the blocks of the last loaded version of an object are ever read: the others are deleted
+# when a new version is recorded
+DELETE_SUPERSEDED_BLOCKS = "DELETE FROM ingestion_blocks WHERE bucket = %s AND object_key = %s AND etag <> %s;"
+
+# Followed by one (bucket, object_key, etag, block_index, block_hash, block_rows) tuple per block
+INSERT_LEDGER_BLOCKS = "INSERT INTO ingestion_blocks (bucket, object_key, etag, block_index, block_hash, block_rows) VALUES %s"
+
 QUERY_COL_NAMES = """
 SELECT column_name
 FROM information_schema.columns
 WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
 AND table_name = 'X'
 ORDER BY table_schema, table_name, ordinal_position;
-"""
\ No newline at end of file
+"""
+
+# Whole catalog in one round-trip: every user table with its column definitions. Tables without
+# columns still show up thanks to the LEFT JOIN -> schema_catalog.py
+QUERY_CATALOG = """
+SELECT t.tablename, c.column_name, c.data_type, c.character_maximum_length,
+       c.numeric_precision, c.numeric_scale, c.is_nullable, c.column_default
+FROM pg_catalog.pg_tables t
+LEFT JOIN information_schema.columns c
+ON c.table_schema = t.schemaname AND c.table_name = t.tablename
+WHERE t.schemaname NOT IN ('pg_catalog', 'information_schema')
+AND t.schemaname NOT LIKE 'pg_temp%'
+ORDER BY t.tablename, c.ordinal_position;
+"""
+
+# Merge (upsert) loading: files are copied into a session temp table shaped like the loaded columns,
+# then applied to the target in the same transaction -> redshift_loader.py
+MERGE_CREATE_STAGE = "CREATE TEMP TABLE {stage} AS SELECT {columns} FROM {target} WHERE 1 = 0;"
+
+# One row per key: the stage keeps no file order, so among rows with the same keys the one kept is
+# the first in the order of the other columns, the same on every run
+MERGE_DEDUPE_STAGE = """
+CREATE TEMP TABLE {unique} AS
+SELECT {columns} FROM (
+    SELECT {columns}, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {order}) AS merge_row FROM {stage}
+) ranked
+WHERE merge_row = 1;
+"""
+
+MERGE_DELETE = "DELETE FROM {target} USING {stage} WHERE {condition};"
+
+MERGE_INSERT = "INSERT INTO {target} ({columns}) SELECT {columns} FROM {stage};"
+
+MERGE_STATEMENT = """
+MERGE INTO {target} USING {stage} ON {condition}
+WHEN MATCHED THEN UPDATE SET {assignments}
+WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values});
+"""
+
+MERGE_DROP_STAGE = "DROP TABLE {stage};"
+
+MERGE_STRATEGIES = ('delete_insert', 'merge')
+
+# Number of slices of the cluster, files are split in as many parts to load them in parallel -> redshift_loader.py
+QUERY_SLICE_COUNT = "SELECT COUNT(*) FROM stv_slices;"
+
+# Data format options of the COPY command for every staging format -> redshift_loader.py
+COPY_FORMAT_OPTIONS = {
+    'csv': 'CSV IGNOREHEADER 1',
+    'csv_gzip': 'CSV GZIP IGNOREHEADER 1',
+    'csv_zstd': 'CSV ZSTD IGNOREHEADER 1',
+    'parquet': 'FORMAT AS PARQUET'
+}
@@ -1,10 +1,14 @@
-import boto3
 import json
 import yaml
+import time
+import queue
+import threading
 import logging
+from functools import lru_cache
+from failure_policy import get_failure_config_params
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-from typing import Dict, Union, Tuple, List
+from typing import Dict, Union, Tuple, List, Optional
 
 def get_sqs_config_params() -> Dict[str, Union[str, int]]:
     """
@@ -16,6 +20,9 @@ def get_sqs_config_params() -> Dict[str, Union[str, int]]:
             - queue_url (str): The SQS URL.
             - waittime (int): The port number.
             - maxmessages (int): The database name.
+            - prefetch (int): Messages buffered ahead of the workers by SqsPoller.
+            - visibility_timeout (int): Seconds a received message stays hidden from other consumers.
+            - heartbeat_interval (int): Seconds between visibility extensions of messages in progress.
     """
 
     with open('config/config.yaml', 'r') as file: 
@@ -25,11 +32,23 @@ def get_sqs_config_params() -> Dict[str, Union[str, int]]:
         'region': config['Region'],
         'queue_url': config['SQS']['url'],
         'waittime': config['SQS']['waittime'],
-        'maxmessages': config['SQS']['maxmessages']
+        'maxmessages': config['SQS']['maxmessages'],
+        'prefetch': config['SQS'].get('prefetch', 20),
+        'visibility_timeout': config['SQS'].get('visibility_timeout', 120),
+        'heartbeat_interval': config['SQS'].get('heartbeat_interval', 30)
     }
 
-config_params = get_sqs_config_params()
-sqs = boto3.client('sqs', region_name=config_params['region'])  
+@lru_cache(maxsize=None)
+def sqs_client(region: str):
+    """
+    Return the SQS client for a region, created on first use so importing this module stays cheap.
+    """
+    import boto3
+    return boto3.client('sqs', region_name=region)
+
+@lru_cache(maxsize=1)
+def _default_config_params() -> Dict[str, Union[str, int]]:
+    return get_sqs_config_params()
 
 def get_files_data(config_params: Dict[str, Union[str, int]]) -> Tuple[bool, List[Tuple[str, str]]]:
     """
@@ -49,6 +68,7 @@ def get_files_data(config_params: Dict[str, Union[str, int]]) -> Tuple[bool, Lis
     """
     
     new_files = []
+    sqs = sqs_client(config_params['region'])
     response = sqs.receive_message(
             QueueUrl=config_params['queue_url'],
             MaxNumberOfMessages=config_params['maxmessages'],
@@ -85,6 +105,9 @@ def delete_unhandled_messages(receipt_handle: str) -> None:
         receipt_handle (str): The message's handler
     """
 
+    config_params = _default_config_params()
+    sqs = sqs_client(config_params['region'])
+
     # Set the visibility timeout to 0 to make the message visible again.
     sqs.change_message_visibility(
         QueueUrl=config_params['queue_url'],
@@ -95,4 +118,250 @@ def delete_unhandled_messages(receipt_handle: str) -> None:
     sqs.delete_message(
         QueueUrl=config_params['queue_url'],
         ReceiptHandle=receipt_handle
-    )
\ No newline at end of file
+    )
+
+class SqsMessage:
+    """
+    A received SQS message and the S3 files it announces.
+
+    The message is acknowledged (deleted) once every file reports file_done, which callers do only
+    after the Redshift COPY committed (or the file was dead-lettered). If any file reports file_failed
+    the message is released: its visibility is no longer extended, so SQS delivers it again once the
+    timeout, or the given delay, expires.
+
+    Attributes:
+        message_id (str): The SQS message id.
+        receipt_handle (str): The handle used to extend or delete the message.
+        files (List[Tuple[str, str, Optional[int]]]): (S3 bucket name, key, size in bytes) for every
+            record in the message. The size is None if the record does not carry it.
+        receive_count (int): Number of times SQS delivered the message, this delivery included.
+    """
+
+    def __init__(self,
+                 poller: 'SqsPoller',
+                 message_id: str,
+                 receipt_handle: str,
+                 files: List[Tuple[str, str, Optional[int]]],
+                 receive_count: int = 1
+                 ) -> None:
+        self.message_id = message_id
+        self.receipt_handle = receipt_handle
+        self.files = files
+        self.receive_count = receive_count
+        self._poller = poller
+        self._remaining = len(files)
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def file_done(self) -> None:
+        """
+        Report that one of the files was loaded, or needs no loading.
+        """
+        with self._lock:
+            self._remaining -= 1
+            finished = self._remaining == 0 and not self._failed
+        if finished:
+            self._poller.ack(self)
+
+    def file_failed(self, error: Optional[Exception] = None, delay: Optional[float] = None) -> None:
+        """
+        Report that one of the files could not be loaded, so the message must be delivered again.
+
+        Parameters:
+            error (Exception, optional): The failure, logged.
+            delay (float, optional): Seconds before the redelivery. The visibility timeout if None.
+        """
+        with self._lock:
+            already_failed = self._failed
+            self._failed = True
+        if not already_failed:
+            logger.warning("Releasing SQS message %s for redelivery: %s", self.message_id, error)
+            self._poller.release(self, delay)
+
+class SqsPoller:
+    """
+    Background SQS consumer with a bounded prefetch buffer.
+
+    A receiver thread keeps up to prefetch messages ready, so the workers do not wait on long polls.
+    A heartbeat thread extends the visibility timeout of every message still in progress and deletes
+    acknowledged messages in batches of up to 10 with delete_message_batch. Entries of a batch that
+    SQS fails on its side are logged and sent again. A message whose body cannot be read is left for
+    redelivery until Failures.max_receives deliveries, then its body is logged and it is deleted.
+
+    Parameters:
+        config_params (dict[str, Union[str, int]]): SQS parameters as returned by get_sqs_config_params.
+    """
+
+    def __init__(self, config_params: Dict[str, Union[str, int]]) -> None:
+        self.config_params = config_params
+        self._sqs = sqs_client(config_params['region'])
+        self.visibility_timeout = config_params.get('visibility_timeout', 120)
+        self.heartbeat_interval = config_params.get('heartbeat_interval', 30)
+        self.max_receives = get_failure_config_params()['max_receives']
+        self._buffer: queue.Queue = queue.Queue(maxsize=config_params.get('prefetch', 20))
+        self._in_progress: Dict[str, SqsMessage] = {}
+        self._acks: List[SqsMessage] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Start the receiver and heartbeat threads.
+        """
+        for target, name in ((self._receive_loop, 'sqs-receiver'), (self._heartbeat_loop, 'sqs-heartbeat')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """
+        Stop the background threads and delete the messages acknowledged so far.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=self.config_params['waittime'] + 5)
+        self._flush_acks()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[SqsMessage]:
+        """
+        Take the next prefetched message.
+
+        Parameters:
+            timeout (float, optional): Seconds to wait for a message. Waits forever if None.
+
+        Returns:
+            Optional[SqsMessage]: The message, or None if none arrived within the timeout.
+        """
+        try:
+            return self._buffer.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def ack(self, message: SqsMessage) -> None:
+        """
+        Queue a fully processed message for deletion.
+        """
+        with self._lock:
+            self._in_progress.pop(message.message_id, None)
+            self._acks.append(message)
+            full = len(self._acks) >= 10
+        if full:
+            self._flush_acks()
+
+    def release(self, message: SqsMessage, delay: Optional[float] = None) -> None:
+        """
+        Stop extending the visibility of a message so SQS delivers it again, after delay seconds if given.
+        """
+        with self._lock:
+            self._in_progress.pop(message.message_id, None)
+        if delay is not None:
+            try:
+                self._sqs.change_message_visibility(QueueUrl=self.config_params['queue_url'], ReceiptHandle=message.receipt_handle,
+                                                    VisibilityTimeout=int(min(delay, 43200)))
+            except Exception as error:
+                logger.error("Error changing the visibility of SQS message %s: %s", message.message_id, error)
+
+    def _receive_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                response = self._sqs.receive_message(
+                    QueueUrl=self.config_params['queue_url'],
+                    MaxNumberOfMessages=min(self.config_params['maxmessages'], 10),
+                    WaitTimeSeconds=self.config_params['waittime'],
+                    VisibilityTimeout=self.visibility_timeout,
+                    AttributeNames=['ApproximateReceiveCount']
+                )
+            except Exception as error:
+                logger.error("Error reading from SQS: %s", error)
+                self._stop.wait(1)
+                continue
+
+            for raw in response.get('Messages', []):
+                receive_count = int(raw.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+                try:
+                    body = json.loads(raw['Body']) # S3 messages comes in JSON format
+                    files = [(record['s3']['bucket']['name'], record['s3']['object']['key'], record['s3']['object'].get('size'))
+                             for record in body.get('Records', [])]
+                except Exception as error:
+                    if receive_count < self.max_receives:
+                        logger.error("Error reading from SQS, message %s left for redelivery: %s", raw['MessageId'], error)
+                        continue
+                    #It would come back on every visibility timeout, the body is kept in the log instead
+                    logger.error("Error reading from SQS, deleting message %s after %d deliveries: %s. Body: %s",
+                                 raw['MessageId'], receive_count, error, raw.get('Body'))
+                    self.ack(SqsMessage(self, raw['MessageId'], raw['ReceiptHandle'], [], receive_count))
+                    continue
+
+                message = SqsMessage(self, raw['MessageId'], raw['ReceiptHandle'], files, receive_count)
+                with self._lock:
+                    self._in_progress[message.message_id] = message
+                if not files:
+                    self.ack(message) #Nothing to load, e.g. s3:TestEvent
+                    continue
+                while not self._stop.is_set():
+                    try:
+                        self._buffer.put(message, timeout=1) #Blocks while the buffer is full
+                        break
+                    except queue.Full:
+                        continue
+
+    def _heartbeat_loop(self) -> None:
+        last_extension = time.monotonic()
+        while not self._stop.wait(1):
+            self._flush_acks()
+            if time.monotonic() - last_extension >= self.heartbeat_interval:
+                self._extend_visibility()
+                last_extension = time.monotonic()
+
+    def _extend_visibility(self) -> None:
+        with self._lock:
+            messages = list(self._in_progress.values())
+        for start in range(0, len(messages), 10):
+            pending = messages[start:start + 10]
+            for attempt in range(2): #Entries SQS failed on its side are sent once more right away
+                entries = [{'Id': str(index), 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': self.visibility_timeout}
+                           for index, message in enumerate(pending)]
+                try:
+                    response = self._sqs.change_message_visibility_batch(QueueUrl=self.config_params['queue_url'], Entries=entries)
+                except Exception as error:
+                    logger.error("Error extending SQS visibility timeouts: %s", error)
+                    continue
+                pending = self._batch_failures(response, pending, 'extending the visibility of')
+                if not pending:
+                    break
+
+    def _flush_acks(self) -> None:
+        with self._lock:
+            acks, self._acks = self._acks, []
+        retry: List[SqsMessage] = []
+        for start in range(0, len(acks), 10):
+            batch = acks[start:start + 10]
+            entries = [{'Id': str(index), 'ReceiptHandle': message.receipt_handle} for index, message in enumerate(batch)]
+            try:
+                response = self._sqs.delete_message_batch(QueueUrl=self.config_params['queue_url'], Entries=entries)
+            except Exception as error:
+                logger.error("Error deleting SQS messages: %s", error)
+                retry.extend(batch)
+                continue
+            retry.extend(self._batch_failures(response, batch, 'deleting'))
+        if retry:
+            with self._lock:
+                self._acks.extend(retry) #Deleted again by the next flush of the heartbeat
+        if retry and self._stop.is_set():
+            logger.warning("%d acknowledged SQS messages were not deleted and will be delivered again", len(retry))
+
+    @staticmethod
+    def _batch_failures(response: Dict, messages: List[SqsMessage], action: str) -> List[SqsMessage]:
+        """
+        Log the Failed entries of an SQS batch response and return the messages worth retrying: the
+        ones SQS failed on its side. Sender faults (e.g. an expired receipt handle) fail again, the
+        message is delivered again instead.
+        """
+        retry = []
+        for failure in response.get('Failed', []):
+            message = messages[int(failure['Id'])]
+            logger.error("Error %s SQS message %s: %s %s", action, message.message_id, failure.get('Code'), failure.get('Message'))
+            if not failure.get('SenderFault'):
+                retry.append(message)
+        return retry
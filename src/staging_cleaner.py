@@ -0,0 +1,234 @@
+import sys
+import time
+import queue
+import argparse
+import threading
+import datetime
+import yaml
+import logging
+from typing import Dict, List, Union, Optional, Iterable, Tuple
+from s3_preproc import s3, delete_keys, MAX_DELETE_KEYS
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_cleanup_config_params() -> Dict[str, Union[bool, int, str]]:
+    """
+    Load the staging cleanup parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with cleanup parameters:
+            - enabled (bool): Whether staged objects and manifests are deleted once their COPY committed.
+            - flush_seconds (float): Longest time a committed object waits before its delete request.
+            - bucket (str): Bucket swept for orphans.
+            - prefix (str): Folder of the staged objects and manifests.
+            - orphan_age_hours (float): Staged objects older than this are orphans for the sweep.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    cleanup = config.get('Cleanup', {})
+    return {
+        'enabled': cleanup.get('enabled', False),
+        'flush_seconds': cleanup.get('flush_seconds', 5),
+        'bucket': cleanup.get('bucket', config.get('S3', {}).get('bucket')),
+        'prefix': cleanup.get('prefix', 'Tmp/'),
+        'orphan_age_hours': cleanup.get('orphan_age_hours', 24)
+    }
+
+class StagingCleaner:
+    """
+    Background thread deleting staged objects once nothing will read them again.
+
+    Committed files are queued with schedule() and deleted in DeleteObjects requests of up to 1000
+    keys, grouped per bucket, at most flush_seconds after they were queued, so the COPY path never
+    waits on S3. Objects of a failed COPY are not queued: they are kept for troubleshooting (the
+    COPY error names them) until the orphan sweep removes them.
+
+    Parameters:
+        flush_seconds (float): Longest time a key waits in the queue.
+    """
+
+    def __init__(self, flush_seconds: float = 5) -> None:
+        self.flush_seconds = flush_seconds
+        self.deleted = 0
+        self._queue: 'queue.Queue[Optional[Tuple[str, List[str]]]]' = queue.Queue()
+        self._idle = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name='staging-cleaner', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def schedule(self, bucket: str, keys: Iterable[str]) -> None:
+        """
+        Queue objects for deletion.
+
+        Parameters:
+            bucket (str): Name of the S3 bucket.
+            keys (Iterable[str]): Keys of the staged objects and manifests.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        with self._idle:
+            self._pending += 1
+        self._queue.put((bucket, keys))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued key has been sent to S3, e.g. before a Lambda invocation returns and
+        the container is frozen.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        self._queue.put(('', [])) #Wakes the thread so it deletes right away instead of waiting out flush_seconds
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stop(self) -> None:
+        """
+        Delete what is queued and end the thread. A later start_cleaner starts a new one.
+        """
+        global _cleaner
+        if _cleaner is self:
+            _cleaner = None #Keys deleted from now on do not wait on a stopped thread
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        batches: Dict[str, List[str]] = {}
+        received = 0
+        deadline = None
+        running = True
+        while running:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ('', [])
+            if item is None:
+                running = False
+            elif item[1]:
+                batches.setdefault(item[0], []).extend(item[1])
+                received += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            full = any(len(keys) >= MAX_DELETE_KEYS for keys in batches.values())
+            if not running or full or item == ('', []) or (deadline is not None and time.monotonic() >= deadline):
+                for bucket, keys in batches.items():
+                    try:
+                        self.deleted += len(keys) - delete_keys(bucket, keys)
+                    except Exception as error:
+                        logger.warning("Error deleting %d staged objects from %s, the sweep will remove them: %s",
+                                       len(keys), bucket, error)
+                batches, deadline = {}, None
+                with self._idle:
+                    self._pending -= received
+                    received = 0
+                    self._idle.notify_all()
+
+_cleaner: Optional[StagingCleaner] = None
+
+def start_cleaner(flush_seconds: float = 5) -> StagingCleaner:
+    """
+    Start the cleaner used by delete_when_loaded, once per process.
+    """
+    global _cleaner
+    if _cleaner is None:
+        _cleaner = StagingCleaner(flush_seconds)
+        _cleaner.start()
+    return _cleaner
+
+def get_cleaner() -> Optional[StagingCleaner]:
+    """
+    Returns:
+        Optional[StagingCleaner]: The cleaner started by start_cleaner, if any.
+    """
+    return _cleaner
+
+def delete_when_loaded(s3_paths: Iterable[str]) -> None:
+    """
+    Queue staged objects of a committed COPY for deletion. Does nothing if no cleaner was started.
+
+    Parameters:
+        s3_paths (Iterable[str]): Full s3:// paths of the staged objects and manifests.
+    """
+    cleaner = _cleaner
+    if cleaner is None:
+        return
+    by_bucket: Dict[str, List[str]] = {}
+    for path in s3_paths:
+        bucket, key = path[len('s3://'):].split('/', 1)
+        by_bucket.setdefault(bucket, []).append(key)
+    for bucket, keys in by_bucket.items():
+        cleaner.schedule(bucket, keys)
+
+def discard_staged(s3_paths: Iterable[str]) -> None:
+    """
+    Delete staged objects that will never be loaded, e.g. those of a failed attempt before it is
+    retried. They go through the cleaner if one was started, and are deleted right away otherwise.
+
+    Parameters:
+        s3_paths (Iterable[str]): Full s3:// paths of the staged objects.
+    """
+    s3_paths = list(s3_paths)
+    if _cleaner is not None:
+        delete_when_loaded(s3_paths)
+        return
+    by_bucket: Dict[str, List[str]] = {}
+    for path in s3_paths:
+        bucket, key = path[len('s3://'):].split('/', 1)
+        by_bucket.setdefault(bucket, []).append(key)
+    for bucket, keys in by_bucket.items():
+        delete_keys(bucket, keys)
+
+def sweep_orphans(bucket: str, prefix: str, older_than_hours: float, dry_run: bool = False) -> int:
+    """
+    Delete staged objects and manifests left behind by COPY commands that failed or by consumers
+    that stopped before their cleanup ran.
+
+    Parameters:
+        bucket (str): Name of the S3 bucket.
+        prefix (str): Folder of the staged objects.
+        older_than_hours (float): Only objects last modified longer ago are deleted, so files that are
+            being loaded right now are left alone.
+        dry_run (bool): Only log what would be deleted.
+
+    Returns:
+        int: Number of orphans found.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=older_than_hours)
+    orphans: List[str] = []
+    found = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if item['LastModified'] >= cutoff:
+                continue
+            found += 1
+            if dry_run:
+                logger.info(f"Orphan s3://{bucket}/{item['Key']} ({item['Size']} bytes, {item['LastModified']:%Y-%m-%d %H:%M})")
+                continue
+            orphans.append(item['Key'])
+            if len(orphans) >= MAX_DELETE_KEYS:
+                delete_keys(bucket, orphans)
+                orphans = []
+    if orphans:
+        delete_keys(bucket, orphans)
+    logger.info(f"{'Found' if dry_run else 'Deleted'} {found} orphans under s3://{bucket}/{prefix} older than {older_than_hours} h")
+    return found
+
+def main(argv: Optional[List[str]] = None) -> None:
+    config = get_cleanup_config_params()
+    parser = argparse.ArgumentParser(description='Delete staged objects left behind under the staging prefix.')
+    parser.add_argument('--bucket', default=config['bucket'])
+    parser.add_argument('--prefix', default=config['prefix'])
+    parser.add_argument('--older-than', type=float, default=config['orphan_age_hours'], metavar='HOURS')
+    parser.add_argument('--dry-run', action='store_true', help='List the orphans without deleting them')
+    args = parser.parse_args(argv)
+    sweep_orphans(args.bucket, args.prefix, args.older_than, args.dry_run)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,164 @@
+import yaml
+import fnmatch
+import threading
+from functools import lru_cache
+from itertools import chain
+from collections import Counter, defaultdict
+from schema_catalog import get_catalog
+from sql_queries import INTERNAL_TABLE_DDL
+from typing import Dict, Union, List, Optional, Tuple
+
+def get_routing_config_params() -> Dict[str, Union[float, int, List[Dict[str, str]]]]:
+    """
+    Load the file to table routing parameters from the YAML file.
+
+    Returns:
+        dict: A dictionary with routing parameters:
+            - rules (list): Ordered {pattern, table} rules. Patterns are shell-style (e.g. 'train*')
+              and matched against the lowercase filename without extension.
+            - cutoff (float): Minimum n-gram similarity for the fuzzy fallback.
+            - cache_size (int): Number of routing decisions memoized per filename stem.
+    """
+
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    routing = config.get('Routing', {})
+    return {
+        'rules': routing.get('rules', []) or [],
+        'cutoff': routing.get('cutoff', 0.4),
+        'cache_size': routing.get('cache_size', 65536)
+    }
+
+def _ngrams(text: str, n: int) -> set:
+    padded = ' ' * (n - 1) + text + ' ' #Padding makes prefixes weigh more, like pg_trgm
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class TableRouter:
+    """
+    Routing index that maps uploaded filenames to table names.
+
+    Built once from the list of tables. A filename stem is routed by, in order: an exact table name,
+    the first matching pattern rule, and finally the table with the highest n-gram (Dice) similarity
+    above the cutoff, found through an inverted n-gram index so only tables that share n-grams with
+    the stem are scored. Ties are resolved by table name, so decisions are stable, and every decision
+    is memoized per stem.
+
+    Parameters:
+        table_names (List[str]): Tables files can be routed to.
+        rules (List[dict], optional): Ordered {pattern, table} rules. Rules that point to unknown
+            tables are ignored.
+        cutoff (float): Minimum similarity for the fuzzy fallback.
+        n (int): n-gram size.
+        cache_size (int): Number of memoized decisions.
+    """
+
+    def __init__(self,
+                 table_names: List[str],
+                 rules: Optional[List[Dict[str, str]]] = None,
+                 cutoff: float = 0.4,
+                 n: int = 3,
+                 cache_size: int = 65536
+                 ) -> None:
+        self.table_names = sorted(set(table_names))
+        self.cutoff = cutoff
+        self.n = n
+        self._tables = set(self.table_names)
+        self._rules: List[Tuple[str, str]] = [(rule['pattern'].lower(), rule['table']) for rule in (rules or [])
+                                               if rule['table'] in self._tables]
+        self._sizes: List[int] = []
+        self._index: Dict[str, List[int]] = defaultdict(list)
+        for table_id, table_name in enumerate(self.table_names):
+            grams = _ngrams(table_name.lower(), n)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._index[gram].append(table_id)
+        self._route_stem = lru_cache(maxsize=cache_size)(self._decide)
+
+    def route(self, filename: str) -> Optional[str]:
+        """
+        Parameters:
+            filename (str): The name of the file (including extension) to be processed.
+
+        Returns:
+            Optional[str]: The table for the file, or None if nothing matches.
+        """
+        return self._route_stem(filename.split('.')[0].lower())
+
+    def explicit_route(self, filename: str) -> Optional[str]:
+        """
+        Like route, without the fuzzy fallback: only an exact table name or a pattern rule.
+        """
+        return self._explicit(filename.split('.')[0].lower())
+
+    def _explicit(self, stem: str) -> Optional[str]:
+        if stem in self._tables:
+            return stem
+        for pattern, table_name in self._rules:
+            if fnmatch.fnmatchcase(stem, pattern):
+                return table_name
+        return None
+
+    def _decide(self, stem: str) -> Optional[str]:
+        return self._explicit(stem) or self._fuzzy(stem)
+
+    def _fuzzy(self, stem: str) -> Optional[str]:
+        grams = _ngrams(stem, self.n)
+        shared = Counter(chain.from_iterable(self._index.get(gram, ()) for gram in grams))
+
+        best_id, best_score = None, 0.0
+        for table_id, count in shared.items():
+            score = 2 * count / (len(grams) + self._sizes[table_id])
+            if score < self.cutoff:
+                continue
+            if best_id is None or score > best_score or (score == best_score and table_id < best_id):
+                best_id, best_score = table_id, score
+        return None if best_id is None else self.table_names[best_id]
+
+_routers: Dict[int, Tuple[int, TableRouter]] = {}
+_routers_lock = threading.Lock()
+_routing_config: Optional[Dict] = None
+
+def get_router(rs_config: Dict[str, Union[str, int]]) -> TableRouter:
+    """
+    Return the routing index for the current schema catalog, rebuilding it only when the catalog
+    was reloaded.
+
+    Parameters:
+        rs_config (dict[str, Union[str, int]]): Redshift connection parameters.
+
+    Returns:
+        TableRouter: The shared router.
+    """
+    global _routing_config
+    catalog = get_catalog(rs_config)
+    table_names = [table for table in catalog.table_names() if table not in INTERNAL_TABLE_DDL] #Refreshes the catalog if its TTL expired
+    with _routers_lock:
+        cached = _routers.get(id(catalog))
+        if cached is not None and cached[0] == catalog.version:
+            return cached[1]
+        if _routing_config is None:
+            _routing_config = get_routing_config_params()
+        router = TableRouter(table_names, _routing_config['rules'], _routing_config['cutoff'],
+                             cache_size=_routing_config['cache_size'])
+        _routers[id(catalog)] = (catalog.version, router)
+        return router
+
+def route_file(rs_config: Dict[str, Union[str, int]], filename: str) -> Optional[str]:
+    """
+    Decide which table an uploaded file goes to.
+
+    Parameters:
+        rs_config (dict[str, Union[str, int]]): Redshift connection parameters.
+        filename (str): The name of the file (including extension) to be processed.
+
+    Returns:
+        Optional[str]: The table name, or None if no table matches.
+    """
+    return get_router(rs_config).route(filename)
+
+def explicit_route(rs_config: Dict[str, Union[str, int]], filename: str) -> Optional[str]:
+    """
+    The table an uploaded file goes to by its exact name or a routing rule, None if it is only a fuzzy match.
+    """
+    return get_router(rs_config).explicit_route(filename)
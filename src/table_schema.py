@@ -0,0 +1,94 @@
+import re
+from sql_queries import TABLE_DDL
+from typing import Dict, List, NamedTuple, Optional
+
+_COLUMN_RE = re.compile(r'^\s*"?(?P<name>\w+)"?\s+'
+                        r'(?P<type>(?:DOUBLE\s+PRECISION|CHARACTER\s+VARYING|\w+)(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?)'
+                        r'(?P<rest>(?:\s+.*)?)$', re.IGNORECASE)
+
+class ColumnSpec(NamedTuple):
+    """
+    A column as declared in one of the DDL strings of sql_queries.py.
+
+    Attributes:
+        name (str): Column name, lowercased the way Redshift stores it.
+        redshift_type (str): Declared type, e.g. 'VARCHAR(100)' or 'DECIMAL(4,2)'.
+        nullable (bool): False if the column is declared NOT NULL.
+        identity (bool): True for IDENTITY columns, which are never loaded from files.
+    """
+    name: str
+    redshift_type: str
+    nullable: bool
+    identity: bool
+
+def parse_ddl(ddl: str) -> List[ColumnSpec]:
+    """
+    Extract the column definitions of a CREATE TABLE statement.
+
+    Parameters:
+        ddl (str): The CREATE TABLE statement.
+
+    Returns:
+        List[ColumnSpec]: The columns in declaration order.
+    """
+    body = ddl[ddl.index('(') + 1:ddl.rindex(')')]
+    columns = []
+    for line in body.splitlines():
+        match = _COLUMN_RE.match(line.rstrip().rstrip(','))
+        if match is None:
+            continue
+        rest = match.group('rest').upper()
+        redshift_type = re.sub(r'\s*([(),])\s*', r'\1', re.sub(r'\s+', ' ', match.group('type').upper()))
+        columns.append(ColumnSpec(
+            name=match.group('name').lower(),
+            redshift_type=redshift_type,
+            nullable='NOT NULL' not in rest,
+            identity='IDENTITY' in rest
+        ))
+    return columns
+
+TABLE_SCHEMAS: Dict[str, List[ColumnSpec]] = {table: parse_ddl(ddl) for table, ddl in TABLE_DDL.items()}
+
+def get_table_schema(table_name: str) -> Optional[List[ColumnSpec]]:
+    """
+    Parameters:
+        table_name (str): One of the tables defined in sql_queries.py.
+
+    Returns:
+        Optional[List[ColumnSpec]]: Its columns, or None if the table has no DDL in sql_queries.py.
+    """
+    return TABLE_SCHEMAS.get(table_name)
+
+def arrow_type(redshift_type: str):
+    """
+    Map a Redshift column type to the pyarrow type used when staging Parquet files.
+
+    Parameters:
+        redshift_type (str): Declared type, e.g. 'INTEGER', 'DECIMAL(4,2)', 'VARCHAR(20)'.
+
+    Returns:
+        pyarrow.DataType: The matching Arrow type. Unknown types are staged as strings.
+    """
+    import pyarrow as pa
+
+    base = redshift_type.split('(')[0].strip()
+    if base in ('SMALLINT', 'INT2'):
+        return pa.int16()
+    if base in ('INTEGER', 'INT', 'INT4'):
+        return pa.int32()
+    if base in ('BIGINT', 'INT8'):
+        return pa.int64()
+    if base in ('REAL', 'FLOAT4'):
+        return pa.float32()
+    if base in ('DOUBLE PRECISION', 'FLOAT', 'FLOAT8'):
+        return pa.float64()
+    if base in ('BOOLEAN', 'BOOL'):
+        return pa.bool_()
+    if base in ('DECIMAL', 'NUMERIC'):
+        precision, scale = (int(part) for part in redshift_type[redshift_type.index('(') + 1:-1].split(','))
+        return pa.decimal128(precision, scale)
+    if base == 'DATE':
+        return pa.date32()
+    if base == 'TIMESTAMP':
+        return pa.timestamp('us')
+    return pa.string()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Union, Tuple, Optional, Iterable, Iterator
+from s3_preproc import run_id
+
+REJECT_REASON_COLUMN = 'reject_reason'
+
+INTEGER_RANGES = {
+    'smallint': (-2**15, 2**15 - 1),
+    'integer': (-2**31, 2**31 - 1),
+    'bigint': (-2**63, 2**63 - 1)
+}
+FLOAT_TYPES = {'real', 'double precision'}
+STRING_TYPES = {'character varying', 'character', 'text'}
+DATE_TYPES = {'date', 'timestamp without time zone', 'timestamp with time zone'}
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1', '1.0'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0', '0.0'}
+
+class _Rejections:
+    #Accumulates one reason string per row with vectorized updates
+    def __init__(self, index: pd.Index) -> None:
+        self.mask = pd.Series(False, index=index)
+        self.reasons = pd.Series('', index=index, dtype=object)
+
+    def add(self, mask: pd.Series, reason: str) -> None:
+        mask = mask.fillna(False).astype(bool)
+        if mask.any():
+            self.mask |= mask
+            self.reasons = self.reasons.where(~mask, self.reasons + reason + '; ')
+
+def _coerce_integer(series: pd.Series, data_type: str, column: str, rejections: _Rejections) -> pd.Series:
+    numbers = pd.to_numeric(series, errors='coerce')
+    not_number = series.notna() & numbers.isna()
+    not_integer = numbers.notna() & (numbers % 1 != 0)
+    low, high = INTEGER_RANGES[data_type]
+    out_of_range = (numbers < low) | (numbers > high)
+    rejections.add(not_number, f'{column}: not a number')
+    rejections.add(not_integer, f'{column}: not an integer')
+    rejections.add(out_of_range, f'{column}: out of {data_type} range')
+    bad = not_number | not_integer | out_of_range #Only this column, rows rejected by others keep their value
+    return numbers.where(~bad).round().astype('Int64')
+
+def _coerce_decimal(series: pd.Series, definition: Dict, column: str, rejections: _Rejections) -> pd.Series:
+    numbers = pd.to_numeric(series, errors='coerce')
+    rejections.add(series.notna() & numbers.isna(), f'{column}: not a number')
+    precision, scale = definition['numeric_precision'], definition['numeric_scale'] or 0
+    if precision:
+        numbers = numbers.round(scale)
+        rejections.add(numbers.abs() >= 10 ** (precision - scale), f'{column}: does not fit numeric({precision},{scale})')
+    return numbers
+
+def _coerce_float(series: pd.Series, column: str, rejections: _Rejections) -> pd.Series:
+    numbers = pd.to_numeric(series, errors='coerce')
+    rejections.add(series.notna() & numbers.isna(), f'{column}: not a number')
+    return numbers
+
+def _coerce_boolean(series: pd.Series, column: str, rejections: _Rejections) -> pd.Series:
+    text = series.astype('string').str.strip().str.lower()
+    is_true = text.isin(TRUE_VALUES)
+    is_false = text.isin(FALSE_VALUES)
+    rejections.add(series.notna() & ~is_true & ~is_false, f'{column}: not a boolean')
+    return pd.Series(np.where(is_true, 'true', np.where(is_false, 'false', None)), index=series.index, dtype=object)
+
+def _coerce_string(series: pd.Series, definition: Dict, column: str, rejections: _Rejections) -> pd.Series:
+    #Compact string and categorical columns already hold text, converting them would copy every value
+    text = series if isinstance(series.dtype, (pd.StringDtype, pd.CategoricalDtype)) else series.astype('string')
+    max_length = definition['character_maximum_length']
+    if max_length:
+        #Redshift lengths are in bytes. Characters are a lower bound, so only long values are encoded
+        lengths = text.str.len()
+        candidates = (lengths * 4 > max_length).fillna(False)
+        if candidates.any():
+            lengths = lengths.where(~candidates, text[candidates].str.encode('utf-8').str.len())
+        rejections.add(lengths > max_length, f'{column}: longer than {max_length} bytes')
+    return text
+
+def _coerce_date(series: pd.Series, column: str, rejections: _Rejections) -> pd.Series:
+    dates = pd.to_datetime(series, errors='coerce')
+    rejections.add(series.notna() & dates.isna(), f'{column}: not a date')
+    return dates
+
+def validate_dataframe(df: pd.DataFrame, column_definitions: List[Dict[str, Union[str, int, None]]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Check and coerce every column of a DataFrame against the Redshift definition of its table.
+
+    All checks are vectorized over whole columns: numeric and date parsing, integer ranges, numeric
+    precision, VARCHAR byte lengths, booleans and NOT NULL constraints. Values that pass are
+    converted to a representation the COPY command accepts (nullable integers, 'true'/'false').
+
+    Parameters:
+        df (pd.DataFrame): The data to be loaded. Column names are matched case-insensitively.
+        column_definitions (List[dict]): Columns of the target table, as returned by
+            SchemaCatalog.column_definitions.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]:
+            - The rows that passed, with coerced columns.
+            - The rejected rows as they arrived, plus a reject_reason column.
+    """
+    definitions = {definition['name']: definition for definition in column_definitions}
+    rejections = _Rejections(df.index)
+    coerced = {}
+
+    for column in df.columns:
+        definition = definitions.get(str(column).lower())
+        if definition is None:
+            continue
+        series = df[column]
+        data_type = definition['data_type']
+        if data_type in INTEGER_RANGES:
+            series = _coerce_integer(series, data_type, column, rejections)
+        elif data_type == 'numeric':
+            series = _coerce_decimal(series, definition, column, rejections)
+        elif data_type in FLOAT_TYPES:
+            series = _coerce_float(series, column, rejections)
+        elif data_type == 'boolean':
+            series = _coerce_boolean(series, column, rejections)
+        elif data_type in STRING_TYPES:
+            series = _coerce_string(series, definition, column, rejections)
+        elif data_type in DATE_TYPES:
+            series = _coerce_date(series, column, rejections)
+        if not definition['nullable']:
+            #Values that failed to coerce are already rejected with their own reason
+            rejections.add(df[column].isna(), f'{column}: null in NOT NULL column')
+        coerced[column] = series
+
+    present = {str(column).lower() for column in df.columns}
+    for name, definition in definitions.items():
+        required = not definition['nullable'] and not definition['default']
+        if required and name not in present:
+            rejections.add(pd.Series(True, index=df.index), f'{name}: missing NOT NULL column')
+
+    valid = df.copy()
+    for column, series in coerced.items():
+        valid[column] = series
+    valid = valid[~rejections.mask]
+    rejected = df[rejections.mask].assign(**{REJECT_REASON_COLUMN: rejections.reasons[rejections.mask].str.rstrip('; ')})
+    return valid, rejected
+
+def validate_chunks(chunks: Iterable[pd.DataFrame],
+                    column_definitions: List[Dict[str, Union[str, int, None]]],
+                    rejected: List[pd.DataFrame]
+                    ) -> Iterator[pd.DataFrame]:
+    """
+    validate_dataframe over a stream of chunks: yields the valid rows of every chunk and appends the
+    (usually few) rejected rows to rejected.
+    """
+    for chunk in chunks:
+        valid, bad = validate_dataframe(chunk, column_definitions)
+        if not bad.empty:
+            rejected.append(bad)
+        yield valid
+
+def rejected_rows_key(filename: str, error_prefix: str = 'Errors/') -> str:
+    """
+    Key of the S3 object that receives the rows of a file rejected by validate_dataframe, unique for
+    every run like the staged file, so uploads with the same name (or the same name and another
+    extension) do not overwrite each other's rejected rows.
+    e.g. train.csv -> Errors/train-csv-20240131T101500-3f2a9c1d-rejected.csv
+
+    Parameters:
+        filename (str): Name of the uploaded file.
+        error_prefix (str): Folder for rejected rows in the bucket.
+    """
+    stem, _, extension = filename.rpartition('.')
+    name = f'{stem}-{extension}' if stem else filename
+    return f"{error_prefix}{name}-{run_id()}-rejected.csv"